@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""Compare the speed and results of the isr and vectorized interpolation engines (config.interpEngine)
+
+Synthetic star fields are masked in one of two patterns:  "border", a blank border like that of a
+resampled mosaic, and "defects", randomly placed bad blocks of up to 8x8 pixels;  the masked pixels
+are set to NaN, and the masked fraction of the image is varied.  The exit status is 1 if the median
+difference between the engines' values of the interpolated pixels exceeds --maxDeviation times the noise.
+E.g.
+    benchDefectInterpolation.py --size 4096 --fractions 0.01 0.1 0.3 0.5 --output interp.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+from lsst.processFile.processFile import ProcessFileConfig, makeTasks, interpolateDefects
+from lsst.processFile.synthetic import makeStarField
+
+patterns = ["border", "defects"]
+
+
+def makeExposure(size, density, pattern, fraction, seed):
+    """Return a size x size ExposureF of a star field with fraction of its pixels masked BAD in pattern"""
+    field = makeStarField(size, size, int(density*size**2), seed=seed)
+    mi = afwImage.MaskedImageF(size, size)
+    mi.getImage().getArray()[:] = field.image
+    mi.getVariance().getArray()[:] = field.variance
+    mi.getMask().set(0)
+
+    mask = mi.getMask().getArray()
+    badBit = mi.getMask().getPlaneBitMask("BAD")
+    if pattern == "border":                 # a border of width n contains fraction of the pixels
+        n = int(round(0.5*size*(1 - np.sqrt(1 - fraction))))
+        if n > 0:
+            for region in (mask[:n], mask[-n:], mask[:, :n], mask[:, -n:]):
+                region |= badBit
+    else:
+        rng = np.random.RandomState(seed)
+        nBlock = int(fraction*size**2/20.25)     # the mean area of a block is 4.5^2
+        for x0, y0, w, h in zip(rng.randint(0, size, nBlock), rng.randint(0, size, nBlock),
+                                rng.randint(1, 9, nBlock), rng.randint(1, 9, nBlock)):
+            mask[y0:y0 + h, x0:x0 + w] |= badBit
+    mi.getImage().getArray()[(mask & badBit) != 0] = np.nan  # e.g. the NaNs of a resampled mosaic
+
+    return afwImage.makeExposure(mi)
+
+
+def timeEngine(config, tasks, exposure, nRepeat):
+    """Return the minimum time taken to interpolate a copy of exposure over nRepeat trials, and the copy"""
+    times = []
+    for i in range(nRepeat):
+        interpolated = exposure.Factory(exposure, True)
+        t0 = time.time()
+        interpolateDefects(config, tasks, interpolated)
+        times.append(time.time() - t0)
+
+    return min(times), interpolated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048, help="Size (on a side) of the images")
+    parser.add_argument("--fractions", type=float, nargs="+", default=[0.001, 0.01, 0.1, 0.3, 0.5],
+                        help="Fractions of the pixels to mask")
+    parser.add_argument("--patterns", nargs="+", default=patterns, choices=patterns,
+                        help="Patterns of masked pixels")
+    parser.add_argument("--density", type=float, default=5e-4, help="Number of stars per pixel")
+    parser.add_argument("--maxDeviation", type=float, default=1.0,
+                        help="Maximum acceptable median difference between the engines, in units of "
+                        "the noise")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to time each engine")
+    parser.add_argument("--seed", type=int, default=12345, help="Random number seed")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    configs, tasks = {}, {}
+    for engine in ("isr", "vectorized"):
+        configs[engine] = ProcessFileConfig()
+        configs[engine].interpEngine = engine
+        tasks[engine] = makeTasks(configs[engine])
+
+    results = []
+    status = 0
+    for pattern in args.patterns:
+        for fraction in args.fractions:
+            exposure = makeExposure(args.size, args.density, pattern, fraction, args.seed)
+            mask = exposure.getMaskedImage().getMask()
+            bad = (mask.getArray() & mask.getPlaneBitMask("BAD")) != 0
+            sigma = np.sqrt(np.median(exposure.getMaskedImage().getVariance().getArray()))
+
+            times, images = {}, {}
+            for engine in ("isr", "vectorized"):
+                times[engine], interpolated = timeEngine(configs[engine], tasks[engine], exposure,
+                                                         args.repeat)
+                images[engine] = interpolated.getMaskedImage().getImage().getArray()[bad]
+            deviation = 0.0
+            if bad.any():
+                deviation = float(np.median(np.abs(images["vectorized"] - images["isr"]))/sigma)
+            ok = bool(deviation <= args.maxDeviation)
+            if not ok:
+                status = 1
+
+            results.append(dict(pattern=pattern, fraction=fraction, maskedFraction=float(bad.mean()),
+                                size=args.size, isrTime=times["isr"], vectorizedTime=times["vectorized"],
+                                deviation=deviation, ok=ok))
+            print("%-7s %5.1f%% masked  isr %8.3fs  vectorized %8.3fs  speedup %6.1f  "
+                  "median difference %5.2f sigma%s" %
+                  (pattern, 100*bad.mean(), times["isr"], times["vectorized"],
+                   times["isr"]/times["vectorized"] if times["vectorized"] > 0 else np.inf, deviation,
+                   "" if ok else "  INCONSISTENT"))
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(dict(defectInterpolation=results), fd, indent=2, sort_keys=True)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
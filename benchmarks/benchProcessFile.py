@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Time the processing of synthetic star fields of various sizes and densities, stage by stage
+
+No real data are needed.  Each case is a synthetic image (optionally with a weight or variance image
+and bad pixels) that's processed with iterRun;  the wall time and peak memory of each stage are recorded.
+
+E.g.
+    benchProcessFile.py --sizes 512 2048 --densities 500 2000 --output bench.json
+    benchProcessFile.py --baseline bench.json      # exits with status 1 if anything got slower
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import itertools
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from lsst.processFile.processFile import ProcessFileConfig, iterRun, writeOutputs, getVersion
+from lsst.processFile.metrics import StageTimer
+from lsst.processFile.synthetic import makeSyntheticFiles
+
+
+def makeCaseName(size, density, noise, badFraction):
+    """Return the name used to identify a benchmark case in the output"""
+    return "%dx%d-density%g-%s-bad%g" % (size, size, density, noise, badFraction)
+
+
+def runCase(config, directory, size, density, noise, badFraction, seed, writeCalexp):
+    """Make and process a synthetic image, returning a dict describing the time and memory used"""
+    nStar = int(density*size**2/1e6)
+    files = makeSyntheticFiles(directory, size, size, nStar, weight=(noise == "weight"),
+                               variance=(noise == "variance"), badFraction=badFraction,
+                               badPixelValue=config.badPixelValue, seed=seed)
+
+    timer = StageTimer()
+    t0 = time.time()
+    for result in iterRun(config, [files.inputFile], [files.weightFile], [files.varianceFile],
+                          returnCalibSources=True, timer=timer):
+        nSource = len(result.sources)
+        outputCalexp = files.inputFile.replace(".fits", ".calexp.fits") if writeCalexp else None
+        with timer("write"):
+            writeOutputs(result, getVersion(), outputCalexp=outputCalexp,
+                         outputCatalog=files.inputFile.replace(".fits", ".src.fits"))
+        del result
+    total = time.time() - t0
+
+    stages = {}
+    for stage in timer.stages:
+        stages[stage["name"]] = dict(wall=stage["wall"], peakRss=stage["peakRss"])
+
+    return dict(size=size, density=density, noise=noise, badFraction=badFraction, nStar=nStar,
+                nSource=nSource, wall=total, peakRss=max(s["peakRss"] for s in stages.values()),
+                stages=stages)
+
+
+def compareWithBaseline(results, baseline, tolerance):
+    """Print the changes relative to baseline, returning True if anything got slower or used more memory
+
+    Cases and stages missing from either results or baseline are ignored
+    """
+    regression = False
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old, new = baseline[name], results[name]
+
+        for what in ("wall", "peakRss"):
+            if new[what] > old[what]*(1 + tolerance):
+                print("REGRESSION: %s %s %.3g (baseline %.3g)" % (name, what, new[what], old[what]))
+                regression = True
+
+        for stage in sorted(new["stages"]):
+            if stage in old["stages"]:
+                oldWall, newWall = old["stages"][stage]["wall"], new["stages"][stage]["wall"]
+                if newWall > oldWall*(1 + tolerance):
+                    print("    %s: %s took %.3fs (baseline %.3fs)" % (name, stage, newWall, oldWall))
+
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048],
+                        help="Sizes of the (square) images, in pixels")
+    parser.add_argument("--densities", type=float, nargs="+", default=[500, 2000],
+                        help="Numbers of stars per million pixels")
+    parser.add_argument("--noise", nargs="+", default=["estimate"],
+                        choices=["estimate", "weight", "variance"],
+                        help="How the noise is specified: estimated from the data, or by a weight or "
+                        "variance image")
+    parser.add_argument("--badFractions", type=float, nargs="+", default=[0.0, 0.01],
+                        help="Fractions of pixels that are bad")
+    parser.add_argument("-C", "--configfile", nargs="*", default=[], help="config override file(s)")
+    parser.add_argument("--writeCalexp", action="store_true", default=False,
+                        help="Write the calexp as well as the catalogue")
+    parser.add_argument("--seed", type=int, default=1, help="Random number seed")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON file written by a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Fractional increase relative to the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    config = ProcessFileConfig()
+    for fileName in args.configfile:
+        config.load(fileName)
+
+    directory = tempfile.mkdtemp(prefix="benchProcessFile-")
+    results = {}
+    try:
+        for size, density, noise, badFraction in itertools.product(args.sizes, args.densities, args.noise,
+                                                                    args.badFractions):
+            name = makeCaseName(size, density, noise, badFraction)
+            results[name] = runCase(config, directory, size, density, noise, badFraction, args.seed,
+                                    args.writeCalexp)
+
+            result = results[name]
+            stages = sorted(result["stages"].items(), key=lambda item: -item[1]["wall"])
+            print("%-40s %6d sources  %8.2fs  %7.1f MB  (%s)" %
+                  (name, result["nSource"], result["wall"], result["peakRss"]/1024.0**2,
+                   ", ".join("%s %.2fs" % (stage, s["wall"]) for stage, s in stages)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(dict(version=getVersion(), python=platform.python_version(), host=platform.node(),
+                           cases=results), fd, indent=2, sort_keys=True)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)["cases"]
+        if compareWithBaseline(results, baseline, args.tolerance):
+            status = 1
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Compare the speed of propagatePsfFlags with its afwTable.matchXy-based predecessor on synthetic catalogues
+
+E.g.
+    benchPropagatePsfFlags.py --sizes 1000 10000 100000 --output psfFlags.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+from lsst.processFile.processFile import propagatePsfFlags, _propagatePsfFlagsByMatchXy
+
+
+def makeCatalogs(nSource, calibFraction, width, seed):
+    """Make a catalogue of nSource sources spread over a width x width image, and a catalogue of
+    calibSources that are (slightly perturbed) copies of calibFraction of them with random PSF flags
+
+    Returns the keysToCopy (as returned by makeTasks), calibSources, and a function returning a fresh
+    copy of the sources
+    """
+    rng = np.random.RandomState(seed)
+
+    def makeSchema():
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        centroidKey = afwTable.Point2DKey.addFields(schema, "centroid", "centroid", "pixel")
+        schema.getAliasMap().set("slot_Centroid", "centroid")
+        return schema, centroidKey
+
+    calibSchema, calibCentroidKey = makeSchema()
+    calibKeys = [calibSchema.addField("calib_psfReserved", type="Flag", doc="reserved"),
+                 calibSchema.addField("calib_psfUsed", type="Flag", doc="used")]
+    schema, centroidKey = makeSchema()
+    keysToCopy = [(schema.addField(calibSchema.find(key).field), key) for key in calibKeys]
+
+    xy = rng.uniform(0, width, size=(nSource, 2))
+    calibIndices = rng.choice(nSource, int(calibFraction*nSource), replace=False)
+    calibXY = xy[calibIndices] + rng.normal(0, 0.1, size=(len(calibIndices), 2))
+
+    calibSources = afwTable.SourceCatalog(calibSchema)
+    for x, y in calibXY:
+        rec = calibSources.addNew()
+        rec.set(calibCentroidKey, afwGeom.Point2D(x, y))
+        for key in calibKeys:
+            rec.set(key, bool(rng.randint(2)))
+
+    def makeSources():
+        sources = afwTable.SourceCatalog(schema)
+        sources.reserve(nSource)
+        for x, y in xy:
+            sources.addNew().set(centroidKey, afwGeom.Point2D(x, y))
+        return sources
+
+    return keysToCopy, calibSources, makeSources
+
+
+def timeFunction(func, keysToCopy, calibSources, makeSources, nRepeat):
+    """Return the minimum time taken by func over nRepeat trials, and the flags it set"""
+    times = []
+    for i in range(nRepeat):
+        sources = makeSources()
+        t0 = time.time()
+        func(keysToCopy, calibSources, sources)
+        times.append(time.time() - t0)
+
+    flags = np.array([[s.get(skey) for skey, ckey in keysToCopy] for s in sources])
+    return min(times), flags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="Numbers of sources to benchmark")
+    parser.add_argument("--calibFraction", type=float, default=0.05,
+                        help="Fraction of the sources that are also calibSources")
+    parser.add_argument("--density", type=float, default=0.01, help="Number of sources per pixel")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to time each function")
+    parser.add_argument("--seed", type=int, default=12345, help="Random number seed")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    status = 0
+    for nSource in args.sizes:
+        width = np.sqrt(nSource/args.density)
+        keysToCopy, calibSources, makeSources = makeCatalogs(nSource, args.calibFraction, width, args.seed)
+
+        newTime, newFlags = timeFunction(propagatePsfFlags, keysToCopy, calibSources, makeSources,
+                                         args.repeat)
+        oldTime, oldFlags = timeFunction(_propagatePsfFlagsByMatchXy, keysToCopy, calibSources, makeSources,
+                                         args.repeat)
+        identical = bool(np.all(newFlags == oldFlags))
+        if not identical:
+            status = 1
+
+        results.append(dict(nSource=nSource, nCalibSource=len(calibSources),
+                            matchXy=oldTime, kdTree=newTime, identical=identical))
+        print("%8d sources  matchXy %8.4fs  kdTree %8.4fs  speedup %6.1f%s" %
+              (nSource, oldTime, newTime, oldTime/newTime if newTime > 0 else np.inf,
+               "" if identical else "  RESULTS DIFFER"))
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(dict(propagatePsfFlags=results), fd, indent=2, sort_keys=True)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
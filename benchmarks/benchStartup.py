@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Measure how long processFile.py takes to start up for commands that don't process any data
+
+E.g.
+    benchStartup.py --output startup.json
+    benchStartup.py --baseline startup.json      # exits with status 1 if startup got slower
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# The commands to time, and the exit status that processFile.py should return
+commands = [
+    ("help", ["--help"], 0),
+    ("showConfig", ["--show", "config"], 0),
+    ("argumentError", ["--jobs", "notAnInteger"], 2),
+]
+
+
+def findScript():
+    """Find processFile.py;  prefer the copy in bin (as installed by scons), then bin.src"""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir)
+    for subDir in ("bin", "bin.src"):
+        script = os.path.join(root, subDir, "processFile.py")
+        if os.path.exists(script):
+            return os.path.normpath(script)
+
+    raise RuntimeError("Unable to find processFile.py")
+
+
+def timeCommand(script, args, expectedStatus, nRepeat):
+    """Run script with args nRepeat times, returning a list of the wall times taken"""
+    times = []
+    with open(os.devnull, "w") as devnull:
+        for i in range(nRepeat):
+            t0 = time.time()
+            status = subprocess.call([sys.executable, script] + args, stdout=devnull, stderr=devnull)
+            times.append(time.time() - t0)
+
+            if status != expectedStatus:
+                raise RuntimeError("%s %s returned %d (expected %d)" %
+                                   (script, " ".join(args), status, expectedStatus))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--script", help="processFile.py to time (default: the one in this package)")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of times to run each command")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON file written by a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Fractional slow down relative to the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    script = args.script if args.script else findScript()
+
+    results = {}
+    for name, cmdArgs, expectedStatus in commands:
+        times = sorted(timeCommand(script, cmdArgs, expectedStatus, args.repeat))
+        results[name] = dict(min=times[0], median=times[len(times)//2], max=times[-1], n=len(times))
+        print("%-15s min %6.3fs  median %6.3fs  max %6.3fs" %
+              (name, results[name]["min"], results[name]["median"], results[name]["max"]))
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(dict(script=script, startup=results), fd, indent=2, sort_keys=True)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)["startup"]
+
+        for name in sorted(results):
+            if name not in baseline:
+                continue
+            old, new = baseline[name]["median"], results[name]["median"]
+            if new > old*(1 + args.tolerance):
+                print("REGRESSION: %s took %.3fs (baseline %.3fs)" % (name, new, old))
+                status = 1
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Compare the accuracy and speed of the variance estimators used by makeExposure on synthetic star fields
+
+The subsample and boxes estimators are compared with the full sigma-clipped variance (afw's VARIANCECLIP)
+at each image size;  the exit status is 1 if any of them differs from it by more than --maxDeviation
+times its reported error.  E.g.
+    benchVarianceEstimate.py --sizes 1024 4096 8192 --output variance.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+from lsst.processFile.synthetic import makeStarField
+from lsst.processFile.varianceEstimate import estimateVariance, varianceEstimators
+
+
+def makeMaskedImage(size, density, seed):
+    """Return a size x size MaskedImageF of a synthetic star field with density stars per pixel"""
+    field = makeStarField(size, size, int(density*size**2), seed=seed)
+    mi = afwImage.MaskedImageF(size, size)
+    mi.getImage().getArray()[:] = field.image
+    mi.getMask().set(0)
+    return mi
+
+
+def timeEstimator(mi, badBit, estimator, nSample, nRepeat):
+    """Return the minimum time taken to estimate the variance of mi over nRepeat trials, and the estimate"""
+    times = []
+    for i in range(nRepeat):
+        t0 = time.time()
+        estimate = estimateVariance(mi, badBit, estimator, nSample=nSample)
+        times.append(time.time() - t0)
+
+    return min(times), estimate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 2048, 4096],
+                        help="Sizes (on a side) of the images to benchmark")
+    parser.add_argument("--density", type=float, default=5e-4, help="Number of stars per pixel")
+    parser.add_argument("--nSample", type=int, default=100000,
+                        help="Approximate number of pixels used by the fast estimators")
+    parser.add_argument("--maxDeviation", type=float, default=3.0,
+                        help="Maximum acceptable difference from the full estimate, in units of the "
+                        "reported error")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to time each estimator")
+    parser.add_argument("--seed", type=int, default=12345, help="Random number seed")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    estimators = [estimator for estimator in sorted(varianceEstimators) if estimator != "full"]
+    results = []
+    status = 0
+    for size in args.sizes:
+        mi = makeMaskedImage(size, args.density, args.seed)
+        badBit = mi.getMask().getPlaneBitMask("BAD")
+
+        fullTime, full = timeEstimator(mi, badBit, "full", args.nSample, args.repeat)
+        result = dict(size=size, full=dict(time=fullTime, variance=full.variance, error=full.error,
+                                           nPixel=full.nPixel))
+        print("%6d^2 full      %10.3f +- %7.3f  %8.4fs" % (size, full.variance, full.error, fullTime))
+
+        for estimator in estimators:
+            estTime, estimate = timeEstimator(mi, badBit, estimator, args.nSample, args.repeat)
+            deviation = (estimate.variance - full.variance)/estimate.error
+            ok = bool(abs(deviation) <= args.maxDeviation)
+            if not ok:
+                status = 1
+
+            result[estimator] = dict(time=estTime, variance=estimate.variance, error=estimate.error,
+                                     nPixel=estimate.nPixel, deviation=deviation, ok=ok)
+            print("%6d^2 %-9s %10.3f +- %7.3f  %8.4fs  speedup %6.1f  deviation %5.2f sigma%s" %
+                  (size, estimator, estimate.variance, estimate.error, estTime,
+                   fullTime/estTime if estTime > 0 else np.inf, deviation, "" if ok else "  INACCURATE"))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(dict(varianceEstimate=results), fd, indent=2, sort_keys=True)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
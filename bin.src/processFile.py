@@ -22,265 +22,38 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+#
+# Only lightweight modules are imported here, so that --help and argument errors are fast;  the stack
+# is imported once the command line has been parsed
+#
+import argparse
 import os
 import re
 import sys
-import numpy as np
-
-import eups
-import lsst.daf.base               as dafBase
-import lsst.pex.logging            as pexLog
-import lsst.afw.coord              as afwCoord
-import lsst.afw.geom               as afwGeom
-import lsst.afw.image              as afwImage
-import lsst.afw.math               as afwMath
-import lsst.afw.table              as afwTable
-import lsst.afw.display            as afwDisplay
-import lsst.meas.algorithms        as measAlg
-import lsst.pex.config             as pexConfig
-
-from lsst.ip.isr import IsrTask
-from lsst.pipe.tasks.characterizeImage import CharacterizeImageTask
-from lsst.meas.algorithms.detection import SourceDetectionTask
-try:
-    from lsst.meas.deblender import SourceDeblendTask
-except ImportError:
-    SourceDeblendTask = None
-from lsst.meas.base import SingleFrameMeasurementTask
-
-class MyIsrConfig(IsrTask.ConfigClass):
-    """A version of IsrTask.ConfigClass that disables almost everything
-    The interpolation code is still run"""
-    
-    def __init__(self, *args, **kwargs):
-        IsrTask.ConfigClass.__init__(self, *args, **kwargs)
-        self.doBias = False
-        self.doDark = False
-        self.doFlat = False
-        self.doFringe = False
-        self.doLinearize = False
-        self.doAssembleCcd = False
-
-class ProcessFileConfig(pexConfig.Config):
-    """A container for the Configs that ProcessFile needs
-
-Using such a container allows us to use the standard -c/-C/--show config options that pipe_base provides
-"""
-    variance = pexConfig.Field(dtype=float, default=np.nan,
-                               doc="Initial per-pixel variance (if <= 0, estimate from inputs)")
-    badPixelValue = pexConfig.Field(dtype=float, default=np.nan, doc="Value indicating a bad pixel")
-    interpPlanes = pexConfig.ListField(
-        dtype = str, default = ["BAD",],
-        doc = "Names of mask planes to interpolate over (e.g. ['BAD', 'SAT'])",
-        itemCheck = lambda x: x in afwImage.MaskU().getMaskPlaneDict().keys())
-
-    isr = MyIsrConfig()
-
-    doCalibrate = pexConfig.Field(dtype=bool, default=True, doc="Calibrate input data?")
-    charImage = pexConfig.ConfigField(dtype=CharacterizeImageTask.ConfigClass,
-                                      doc=CharacterizeImageTask.ConfigClass.__doc__)
-
-    detection = pexConfig.ConfigField(dtype=SourceDetectionTask.ConfigClass,
-                                      doc=SourceDetectionTask.ConfigClass.__doc__)
-    detection.returnOriginalFootprints = False
-
-    measurement = pexConfig.ConfigField(dtype=SingleFrameMeasurementTask.ConfigClass,
-                                        doc=SingleFrameMeasurementTask.ConfigClass.__doc__)
-
-    doDeblend = pexConfig.Field(dtype=bool, default=True, doc="Deblend sources?")
-    if SourceDeblendTask:
-        deblend = pexConfig.ConfigField(dtype=SourceDeblendTask.ConfigClass,
-                                        doc=SourceDeblendTask.ConfigClass.__doc__)
-        
-def run(config, inputFiles, weightFiles=None, varianceFiles=None,
-        returnCalibSources=False, displayResults=[], verbose=False):
-    #
-    # Create the tasks
-    #
-    schema = afwTable.SourceTable.makeMinimalSchema()
-    algMetadata = dafBase.PropertyList()
-
-    isrTask = IsrTask(config=config.isr)
-    charImageTask =         CharacterizeImageTask(None, config=config.charImage)
-    sourceDetectionTask =   SourceDetectionTask(config=config.detection, schema=schema)
-    if config.doDeblend:
-        if SourceDeblendTask:
-            sourceDeblendTask = SourceDeblendTask(config=config.deblend, schema=schema)
-        else:
-            print >> sys.stderr, "Failed to import lsst.meas.deblender;  setting doDeblend = False"
-            config.doDeblend = False
-    sourceMeasurementTask = SingleFrameMeasurementTask(schema=schema, config=config.measurement,
-                                                       algMetadata=algMetadata)
-
-    keysToCopy = []
-    for key in [charImageTask.measurePsf.reservedKey,
-                charImageTask.measurePsf.usedKey,]:
-        keysToCopy.append((schema.addField(charImageTask.schema.find(key).field), key))
-
-    exposureDict = {}; calibSourcesDict = {}; sourcesDict = {}
-    
-    for inputFile, weightFile, varianceFile in zip(inputFiles, weightFiles, varianceFiles):
-        #
-        # Create the output table
-        #
-        tab = afwTable.SourceTable.make(schema)
-        #
-        # read the data
-        #
-        if verbose:
-            print "Reading %s" % inputFile
-            
-        exposure = makeExposure(inputFile, weightFile, varianceFile,
-                                config.badPixelValue, config.variance)
-        #
-        if config.interpPlanes:
-            import lsst.ip.isr as ipIsr
-            defects = ipIsr.getDefectListFromMask(exposure.getMaskedImage(), config.interpPlanes,
-                                                  growFootprints=0)
-
-            isrTask.run(exposure, defects=defects)
-        #
-        # process the data
-        #
-        if config.doCalibrate:
-            result = charImageTask.characterize(exposure)
-            exposure, calibSources = result.exposure, result.sourceCat
-        else:
-            calibSources = None
-            if not exposure.getPsf():
-                charImageTask.installSimplePsf.run(exposure)
-
-        exposureDict[inputFile] = exposure
-        calibSourcesDict[inputFile] = calibSources if returnCalibSources else None
-
-        result = sourceDetectionTask.run(tab, exposure)
-        sources = result.sources
-        sourcesDict[inputFile] = sources
-
-        if config.doDeblend:
-            sourceDeblendTask.run(exposure, sources)
-
-        sourceMeasurementTask.measure(exposure, sources)
-
-        if verbose:
-            print "Detected %d objects" % len(sources)
-
-        propagatePsfFlags(keysToCopy, calibSources, sources)
-        
-        if displayResults:              # display results of processing (see also --debug argparse option)
-            showApertures = "showApertures".upper() in displayResults
-            showPSFs = "showPSFs".upper() in displayResults
-            showShapes = "showShapes".upper() in displayResults
-
-            display = afwDisplay.getDisplay(frame=1)
-
-            if algMetadata.exists("base_CircularApertureFlux_radii"):
-                radii = algMetadata.get("base_CircularApertureFlux_radii")
-            else:
-                radii = []
-
-            display.mtv(exposure, title=os.path.split(inputFile)[1])
-
-            with display.Buffering():
-                for s in sources:
-                    xy = s.getCentroid()
-                    display.dot('+', *xy,
-                                ctype=afwDisplay.CYAN if s.get("flags_negative") else afwDisplay.GREEN)
-
-                    if showPSFs and (s.get("calib_psfUsed") or s.get("calib_psfReserved")):
-                        display.dot('o', *xy, size=10,
-                                    ctype=afwDisplay.GREEN if s.get("calib_psfUsed") else afwDisplay.YELLOW)
-
-                    if showShapes:
-                        display.dot(s.getShape(), *xy, ctype=afwDisplay.RED)
-
-                    if showApertures:
-                        for radius in radii:
-                            display.dot('o', *xy, size=radius, ctype=afwDisplay.YELLOW)
-
-    return exposureDict, calibSourcesDict, sourcesDict
-
-def makeExposure(inputFile, weightFile, varianceFile, badPixelValue, variance):
-    exposure = afwImage.ExposureF(inputFile)
-
-    if np.isfinite(badPixelValue):
-        mi = exposure.getMaskedImage()
-        bad = mi.getImage().getArray() == badPixelValue
-        mi.getMask().getArray()[bad] |= mi.getMask().getPlaneBitMask("BAD")
-        del bad; del mi
-
-    if weightFile or varianceFile:
-        assert(not (weightFile and varianceFile)) # we checked this earlier
-
-        assert not np.isfinite(variance), \
-            "Please don't specify a variance and %s file" % ("weight" if weightFile else "variance")
-
-        mi = exposure.getMaskedImage()
-
-        if weightFile:
-            variance = afwImage.ImageF(weightFile)
-
-            varr = variance.getArray()
-            bad = (varr == 0)
-            varr[bad] = np.inf # avoid numpy warning
-            varr[:] = 1/varr
-        else:
-            variance = afwImage.ImageF(varianceFile)
-            bad = np.logical_not(np.isfinite(mi.getImage().getArray()))
-
-        mi.getMask().getArray()[bad] |= mi.getMask().getPlaneBitMask("BAD")
-        del bad
-
-        mi.getVariance()[:] = variance
-        del mi
-    else:
-        if not np.isfinite(variance) or variance <= 0:
-            mi = exposure.getMaskedImage()
 
-            sctrl = afwMath.StatisticsControl()
-            sctrl.setAndMask(mi.getMask().getPlaneBitMask("BAD"))
-            variance = afwMath.makeStatistics(mi, afwMath.VARIANCECLIP, sctrl).getValue()
-            del sctrl; del mi
+class DeferredConfigAction(argparse.Action):
+    """An argparse action that remembers a -c/-C config override so that it can be applied later
 
-        exposure.getMaskedImage().getVariance()[:] = variance
-
-    return exposure
-
-def propagatePsfFlags(keysToCopy, calibSources, sources, matchRadius=1):
-    """Match the calibSources and sources, and propagate Interesting Flags (e.g. PSF star) to the sources
+    We can't create the config until we've imported the tasks, which we don't want to do until we
+    know that the command line is valid (and didn't ask for --help); applyConfigOverrides
+    applies the overrides in the order in which they were given
     """
-    if calibSources is None or sources is None:
-        return
+    def __call__(self, parser, namespace, values, option_string=None):
+        namespace.configOverrides.append((self.dest, values, option_string))
 
-    closest = False                 # return all matched objects
-    matched = afwTable.matchXy(calibSources, sources, matchRadius, closest)
-    #
-    # Because we had to allow multiple matches to handle parents, we now need to
-    # prune to the best matches
-    #
-    bestMatches = {}
-    for m0, m1, d in matched:
-        id0 = m0.getId()
-        if bestMatches.has_key(id0):
-            if d > bestMatches[id0][2]:
-                continue
+def applyConfigOverrides(parser, args):
+    """Create args.config, and apply the -c/-C overrides remembered by DeferredConfigAction"""
+    import lsst.pipe.base.argumentParser as pbArgparse
+    from lsst.processFile.processFileConfig import ProcessFileConfig
 
-        bestMatches[id0] = (m0, m1, d)
+    actionClasses = dict(config=pbArgparse.ConfigValueAction, configfile=pbArgparse.ConfigFileAction)
 
-    matched = bestMatches.values()
-    #
-    # Check that we got it right
-    #
-    if len(set(m[0].getId() for m in matched)) != len(matched):
-        print("At least one calibSource is matched to more than one Source")
-    #
-    # Copy over the desired flags
-    #
-    for cs, s, d in matched:
-        for skey, ckey in keysToCopy:
-            s.set(skey, cs.get(ckey))
+    args.config = ProcessFileConfig()
+    for dest, values, option_string in args.configOverrides:
+        action = actionClasses[dest](option_strings=[option_string], dest=dest)
+        action(parser, args, values, option_string)
 
-#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+    return args.config
 
 class CaseInsensitiveChoices(list):
     """A class to pass to argparse to provide case-insensitive choices"""
@@ -292,12 +65,9 @@ class CaseInsensitiveChoices(list):
         return self._choices.__iter__()
 
 if __name__ == "__main__":
-    import argparse
-    import lsst.pipe.base.argumentParser as pbArgparse
-
     # Note that argparse doesn't actually respect the newlines in the help message below.
     parser = argparse.ArgumentParser(description="Process a fits file, detecting and measuring sources")
-    parser.add_argument('inputFile', help="""File to process.
+    parser.add_argument('inputFile', nargs="?", help="""File to process (not needed with --serve).
 
 If inputFile contains a %%s it is taken to be a template and is expanded using the values of args.filters
 
@@ -314,16 +84,39 @@ If varianceFile contains a %%s it is taken to be a template and is expanded usin
 Setting this option will override any included 'VARIANCE' image extension in inputFile.
     """)
     parser.add_argument('--filters', nargs="+", help="List of filters to process", default="")
+    parser.add_argument('--manifest', help="""Process the inputs listed in this file (one per line:
+inputFile [weight=FILE] [variance=FILE] [filter=NAME] [calexp=FILE] [catalog=FILE] [calibCatalog=FILE]
+[regions=FILE]), or matching this glob, largest first;  inputs that fail are written to --retryManifest""")
+    parser.add_argument('--retryManifest', help="""Manifest to which to write the inputs that failed
+(default: MANIFEST.retry, or processFile.retry if --manifest is a glob)""")
+    parser.add_argument('--multiBand', action="store_true", default=False,
+                        help="""Detect and deblend the --filters once (on --referenceFilter, or on all the
+bands combined if multiBandDetection == "combined") and measure every band by forced photometry,
+so that all the catalogues share the same source IDs""")
+    parser.add_argument('--referenceFilter', help="Filter to detect on with --multiBand (default: the first)")
+    parser.add_argument('--outputRefCatalog', help="Output reference catalogue, with --multiBand")
     parser.add_argument('--outputCatalog', nargs="?", help="Output catalogue")
     parser.add_argument('--outputCalibCatalog', nargs="?", help="Output catalogue of calibration objects")
     parser.add_argument('--outputCalexp', nargs="?", help="""Output calibrated exposure.
 Also includes the PSF model and detection masks.
     """)
-
-    parser.add_argument("-c", "--config", nargs="*", action=pbArgparse.ConfigValueAction,
+    parser.add_argument('--combinedCatalog', metavar="FILE",
+                        help="""Also append every file's sources, tagged with the input file and filter, to
+this Parquet (.parquet) or HDF5 (.h5) file, one row group per input""")
+    parser.add_argument('--combinedColumns', nargs="+", metavar="PATTERN",
+                        help="""Columns to write to --combinedCatalog, e.g. coord_* base_PsfFlux_*
+(default: all the scalar and flag columns)""")
+    parser.add_argument('--calexpPlanes', default="all", choices=["all", "scalarVariance", "psfOnly"],
+                        help="""Planes to write to --outputCalexp:  all;  the image and mask with the
+variance replaced by its median (scalarVariance);  or only the PSF, Wcs and header (psfOnly)""")
+    parser.add_argument('--compressCalexp', type=float, metavar="Q",
+                        help="""Tile-compress --outputCalexp;  the mask is compressed losslessly, and the
+image and variance are quantized to 1/Q of the noise (Q < 0: an absolute step;  Q = 0: lossless)""")
+
+    parser.add_argument("-c", "--config", nargs="*", action=DeferredConfigAction,
                         help="config override(s), e.g. -c foo=newfoo bar.baz=3", metavar="NAME=VALUE")
     parser.add_argument("-C", "--configfile", dest="configfile", nargs="*",
-                        action=pbArgparse.ConfigFileAction, help="config override file(s)")
+                        action=DeferredConfigAction, help="config override file(s)")
     parser.add_argument("--show", nargs="+", default=(),
                         help="display the specified information to stdout and quit (unless run is specified).")
     parser.add_argument("-L", "--loglevel", help="logging level", default="WARN",
@@ -332,19 +125,58 @@ Also includes the PSF model and detection masks.
     parser.add_argument('--display', nargs='*', help="Display sources on an image display",
                         choices=CaseInsensitiveChoices('True', 'showApertures', "showShapes", "showPSFs"),
                         default=None)
+    parser.add_argument('--regionFile', help="""Write the overlays that --display can show (centroids, PSF stars,
+shapes, and apertures) to this DS9 region file.  May contain a %%s, as for inputFile""")
     parser.add_argument('--verbose', '-v', action="store_true", help="Be chatty?", default=False)
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="Number of files to process in parallel (limited by the available memory)")
+    parser.add_argument('--serve', action="store_true", default=False,
+                        help="""Run as a server, processing files as they appear in --spoolDir or are
+sent to --socket, and writing the outputs next to each input""")
+    parser.add_argument('--spoolDir', help="Directory to watch for files to process when using --serve")
+    parser.add_argument('--socket', help="""UNIX socket to listen on when using --serve;
+clients send a filename per line""")
+    parser.add_argument('--enqueue', metavar="QUEUE",
+                        help="""Add the inputs in --manifest to the work queue in directory QUEUE (largest
+first) for processing by --shard, rather than processing them""")
+    parser.add_argument('--shard', metavar="QUEUE",
+                        help="""Process inputs from the work queue in directory QUEUE, shared with other
+instances (on this or other hosts), until it's empty""")
+    parser.add_argument('--shardTimeout', type=float, default=600, metavar="SECONDS",
+                        help="""Return inputs to the --shard queue if their worker hasn't sent a
+heartbeat for this long (at least about 80s on NFS)""")
+    parser.add_argument('--shardSummary', metavar="QUEUE",
+                        help="Summarize the progress of the work queue in QUEUE, and each host's throughput")
+    parser.add_argument('--cacheDir', help="""Directory in which to cache the outputs of processing each file
+(default: $PROCESSFILE_CACHE or ~/.cache/processFile)""")
+    parser.add_argument('--cacheSize', type=float, default=10,
+                        help="Maximum size of the cache in GB;  least recently used entries are deleted")
+    parser.add_argument('--noCache', action="store_true", default=False,
+                        help="Don't read or write the cache of processed files")
+    parser.add_argument('--checkpoints', action="store_true", default=False,
+                        help="""Save (and resume from) checkpoints after characterization and detection
+in the cache, so reruns with a different deblend or measurement config are faster""")
+    parser.add_argument('--writeQueue', type=int, default=2, metavar="N",
+                        help="""Write the outputs of up to N files in background processes while the
+next file is processed;  0 writes them before processing the next file""")
+    parser.add_argument('--metrics', help="""Write the wall and CPU time, peak memory, and number of objects
+processed by each stage of processing each file to this JSON file""")
+    parser.add_argument('--profile', nargs="+", default=[], metavar="STAGE",
+                        help="""Run these stages (e.g. characterize measurement; or all) under cProfile,
+writing the statistics to --profileDir""")
+    parser.add_argument('--profileDir', default=".", help="Directory to write --profile's output to")
+
+    args = argparse.Namespace()
+    args.configOverrides = []
+    args = parser.parse_args(namespace=args)
 
     #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
     #
     # Create the configs
     #
-    config = ProcessFileConfig()
+    config = applyConfigOverrides(parser, args)
 
     #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
-
-    args = argparse.Namespace()
-    args.config = config
-    args = parser.parse_args(namespace=args)
     #
     # a straight "--display" is equivalent to "--display True"
     #
@@ -354,6 +186,7 @@ Also includes the PSF model and detection masks.
         args.display = [_.upper() for _ in args.display]
 
     try:
+        import lsst.pipe.base.argumentParser as pbArgparse
         pbArgparse.obeyShowArgument(args.show, args.config, exit=True)
     except AttributeError:
         pass
@@ -365,14 +198,80 @@ Also includes the PSF model and detection masks.
             print >> sys.stderr, e
 
     if args.loglevel:
+        import lsst.pex.logging as pexLog
         value = getattr(pexLog.Log, args.loglevel.upper())
         pexLog.Log.getDefaultLog().setThreshold(value)
 
+    if args.serve:
+        if not (args.spoolDir or args.socket):
+            parser.error("--serve requires --spoolDir and/or --socket")
+
+        from lsst.processFile.processFile import serve
+        serve(config, spoolDir=args.spoolDir, socketPath=args.socket, verbose=args.verbose)
+        sys.exit(0)
+    elif args.shardSummary:
+        from lsst.processFile.workQueue import summarizeQueue, formatQueueSummary
+        print "\n".join(formatQueueSummary(summarizeQueue(args.shardSummary)))
+        sys.exit(0)
+    elif args.shard:
+        if args.inputFile or args.manifest:
+            parser.error("--shard takes its inputs from the queue;  please add them with --enqueue")
+
+        from lsst.processFile.processFile import processShard
+        from lsst.processFile.metrics import StageTimer
+        timer = StageTimer(profile=args.profile, profileDir=args.profileDir)
+        result = processShard(config, args.shard, timeout=args.shardTimeout, verbose=args.verbose,
+                              timer=timer, calexpPlanes=args.calexpPlanes,
+                              calexpQuantizeLevel=args.compressCalexp)
+        if args.metrics:
+            timer.writeJson(args.metrics)
+        sys.exit(1 if result.nFailed else 0)
+    elif args.enqueue and not args.manifest:
+        parser.error("--enqueue requires a --manifest")
+    elif args.inputFile is None and not args.manifest:
+        parser.error("Please specify an inputFile or a --manifest")
+    elif args.inputFile and args.manifest:
+        parser.error("Please specify an inputFile *or* a --manifest")
+
     if args.weightFile and args.varianceFile:
         print >> sys.stderr, "Please only specify a weight *or* a variance"
         sys.exit(1)
 
-    if re.search(r"%s", args.inputFile):
+    failed = []                         # manifest entries that we failed to process
+    if args.manifest:
+        if args.multiBand:
+            parser.error("--multiBand can't be used with --manifest")
+
+        from lsst.processFile.manifest import readManifest, validateManifest, writeRetryManifest
+
+        entries, failed = validateManifest(readManifest(args.manifest), verbose=args.verbose)
+        nInput = len(entries) + len(failed)
+        filterNames = [entry.filterName for entry in entries]
+        inputFiles = [entry.inputFile for entry in entries]
+        weightFiles = [entry.weightFile for entry in entries]
+        varianceFiles = [entry.varianceFile for entry in entries]
+
+        args.outputCalexp = [entry.outputs["calexp"] for entry in entries]
+        args.outputCalibCatalog = [entry.outputs["calibCatalog"] for entry in entries]
+        args.outputCatalog = [entry.outputs["catalog"] for entry in entries]
+        args.regionFile = [entry.outputs["regions"] for entry in entries]
+
+        if args.enqueue:
+            from lsst.processFile.manifest import formatManifestEntry
+            from lsst.processFile.workQueue import WorkQueue
+
+            WorkQueue(args.enqueue).enqueue([formatManifestEntry(entry) for entry in entries])
+            print "Added %d inputs to the work queue in %s" % (len(entries), args.enqueue)
+            if failed:
+                retryManifest = args.retryManifest or \
+                    (args.manifest + ".retry" if os.path.isfile(args.manifest) else "processFile.retry")
+                writeRetryManifest(retryManifest, failed)
+                print >> sys.stderr, "Unable to add %d of %d inputs;  wrote them to %s" % \
+                    (len(failed), nInput, retryManifest)
+                sys.exit(1)
+            sys.exit(0)
+    elif re.search(r"%s", args.inputFile):
+        filterNames = args.filters
         inputFiles = [args.inputFile % f for f in args.filters]
         weightFiles = [args.weightFile % f for f in args.filters] if args.weightFile else None
         varianceFiles = [args.varianceFile % f for f in args.filters] if args.varianceFile else None
@@ -383,7 +282,10 @@ Also includes the PSF model and detection masks.
             args.outputCalibCatalog = [args.outputCalibCatalog % f for f in args.filters]
         if args.outputCatalog:
             args.outputCatalog = [args.outputCatalog % f for f in args.filters]
+        if args.regionFile:
+            args.regionFile = [args.regionFile % f for f in args.filters]
     else:
+        filterNames = [None]
         inputFiles = [args.inputFile]
         weightFiles = [args.weightFile if args.weightFile else None]
         varianceFiles = [args.varianceFile if args.varianceFile else None]
@@ -394,30 +296,100 @@ Also includes the PSF model and detection masks.
             args.outputCalibCatalog = [args.outputCalibCatalog]
         if args.outputCatalog:
             args.outputCatalog = [args.outputCatalog]
+        if args.regionFile:
+            args.regionFile = [args.regionFile]
 
-    exposureDict, calibSourcesDict, sourcesDict = run(config, inputFiles,
-                                                      weightFiles=weightFiles, varianceFiles=varianceFiles,
-                                                      returnCalibSources=args.outputCalibCatalog != None,
-                                                      displayResults=args.display, verbose=args.verbose)
-    try:
-        import lsst.processFile.version
-        version = lsst.processFile.version.__version__
-    except ImportError:
-        print >> sys.stderr, "Unable to deduce processFile's version -- did you run scons?"
-        version = "???"
+    if args.multiBand:
+        if not re.search(r"%s", args.inputFile):
+            parser.error("--multiBand requires an inputFile containing %s, expanded using --filters")
+        if args.referenceFilter and args.referenceFilter not in args.filters:
+            parser.error("--referenceFilter %s is not one of --filters" % args.referenceFilter)
+    elif args.referenceFilter or args.outputRefCatalog:
+        parser.error("--referenceFilter and --outputRefCatalog require --multiBand")
+
+    from lsst.processFile.processFile import iterRun, iterRunMultiBand, writeOutputs, getVersion
+
+    version = getVersion()
+
+    from lsst.processFile.metrics import StageTimer
+    timer = StageTimer(profile=args.profile, profileDir=args.profileDir)   # also sets the calexp's METRIC_*
+
+    cache = None
+    if not args.noCache:
+        from lsst.processFile.resultCache import ResultCache, getDefaultCacheDir
+        cache = ResultCache(args.cacheDir if args.cacheDir else getDefaultCacheDir(),
+                            maxBytes=int(args.cacheSize*1024**3))
     #
-    # Write output files
+    # Process the data, writing each file's outputs as soon as it's been processed so that we
+    # needn't keep all the exposures in memory
     #
-    for i, inputFile in enumerate(inputFiles):
-        exposure = exposureDict[inputFile]
-        calibSources = calibSourcesDict[inputFile]
-        sources = sourcesDict[inputFile]
+    if args.multiBand:
+        results = iterRunMultiBand(config, inputFiles, weightFiles=weightFiles, varianceFiles=varianceFiles,
+                                   referenceIndex=args.filters.index(args.referenceFilter)
+                                   if args.referenceFilter else 0,
+                                   returnCalibSources=args.outputCalibCatalog != None,
+                                   displayResults=args.display, verbose=args.verbose,
+                                   cache=cache, timer=timer, checkpoints=args.checkpoints)
+    else:
+        results = iterRun(config, inputFiles, weightFiles=weightFiles, varianceFiles=varianceFiles,
+                          returnCalibSources=args.outputCalibCatalog != None,
+                          displayResults=args.display, verbose=args.verbose, jobs=args.jobs,
+                          cache=cache, timer=timer, checkpoints=args.checkpoints,
+                          continueOnError=bool(args.manifest))
 
-        exposure.getMetadata().set("VERSION", version)
+    from lsst.processFile.asyncWriter import AsyncWriter
 
-        if args.outputCalexp:
-            exposure.writeFits(args.outputCalexp[i])
-        if args.outputCalibCatalog:
-            calibSources.writeFits(args.outputCalibCatalog[i])
-        if args.outputCatalog:
-            sources.writeFits(args.outputCatalog[i])
+    def recordFailure(index, error):
+        entry = entries[index]
+        entry.error = error
+        failed.append(entry)
+
+    combinedCatalog = None
+    if args.combinedCatalog:
+        from lsst.processFile.combinedCatalog import CombinedCatalogWriter
+        combinedCatalog = CombinedCatalogWriter(args.combinedCatalog, columns=args.combinedColumns)
+
+    try:
+        with AsyncWriter(maxPending=args.writeQueue, timer=timer,
+                         onError=recordFailure if args.manifest else None) as writer:
+            for result in results:
+                i = result.index
+                if result.error is not None:
+                    recordFailure(i, result.error)
+                    continue
+                if combinedCatalog:
+                    with timer("writeCombinedCatalog") as stage:
+                        combinedCatalog.append(result.sources, result.inputFile, filterNames[i])
+                        stage["count"] = len(result.sources)
+                outputs = dict(outputCalexp=args.outputCalexp[i] if args.outputCalexp else None,
+                               outputCalibCatalog=args.outputCalibCatalog[i]
+                               if args.outputCalibCatalog and result.calibSources is not None else None,
+                               outputCatalog=args.outputCatalog[i] if args.outputCatalog else None,
+                               outputRegions=args.regionFile[i] if args.regionFile else None)
+                outputRefCatalog = args.outputRefCatalog if i == 0 else None
+
+                def write(result=result, outputs=outputs, outputRefCatalog=outputRefCatalog):
+                    if outputRefCatalog:
+                        result.refSources.writeFits(outputRefCatalog)
+                    writeOutputs(result, version, timer=timer, calexpPlanes=args.calexpPlanes,
+                                 calexpQuantizeLevel=args.compressCalexp, verbose=args.verbose, **outputs)
+
+                writer.submit(write, list(outputs.values()) + [outputRefCatalog], result.inputFile, key=i)
+                del result, write           # the writer holds the outputs until they've been written
+    finally:                            # or the combined catalogue is left unreadable
+        if combinedCatalog:
+            combinedCatalog.close()
+
+    if args.metrics:
+        timer.writeJson(args.metrics)
+    if args.verbose:
+        print timer.report()
+        print writer.report()
+
+    if failed:
+        retryManifest = args.retryManifest or \
+                        (args.manifest + ".retry" if os.path.isfile(args.manifest) else "processFile.retry")
+        writeRetryManifest(retryManifest, failed)
+        print >> sys.stderr, "Failed to process %d of %d inputs;  wrote them to %s" % \
+            (len(failed), nInput, retryManifest)
+        sys.exit(1)
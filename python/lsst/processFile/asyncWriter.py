@@ -0,0 +1,200 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Write the outputs of processing each file in the background, while the next file is processed
+
+afw's objects can't be pickled, and writing them holds the GIL, so neither a thread nor a pool of
+worker processes can write them while we carry on processing.  Instead each file's outputs are written
+by a child process forked for the purpose, which sees the parent's outputs in (copy-on-write) memory.
+The number of children writing at once is bounded;  when the limit is reached we wait for the oldest
+to finish before processing another file, so at most that many files' outputs are held in memory
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import sys
+import time
+import traceback
+
+__all__ = ["AsyncWriter"]
+
+
+class AsyncWriter(object):
+    """Run functions that write files in forked child processes, up to maxPending at a time
+
+    Use as e.g.
+        with AsyncWriter(maxPending=2) as writer:
+            for result in iterRun(...):
+                writer.submit(lambda result=result: writeOutputs(result, ...), [outputFile], result.inputFile)
+
+    Errors are raised (as IOError) by the first call to submit or close after the writing failed, and
+    by close (called on leaving a with block) which waits for all the writes to finish;  if onError is
+    provided, onError(key, traceback) is called instead, where key is that passed to submit (default: its
+    description).  If maxPending is 0 (or os.fork isn't
+    available) the files are written synchronously by submit.
+
+    If timer (a lsst.processFile.metrics.StageTimer) is provided, the stages recorded by the writing
+    functions (e.g. writeOutputs's writeCalexp) are added to it when each write completes
+    """
+
+    def __init__(self, maxPending=2, timer=None, onError=None):
+        self.maxPending = maxPending if hasattr(os, "fork") else 0
+        self.timer = timer
+        self.onError = onError
+
+        self.nFile = 0                  # number of files written
+        self.nByte = 0                  # number of bytes written
+        self.writeTime = 0.0            # wall time spent writing (possibly in parallel with processing)
+        self.waitTime = 0.0             # wall time spent waiting for writes to finish
+        self._pending = []              # (pid, file descriptor, description, key) for each running child
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        try:
+            self.close()
+        except IOError:
+            if excType is None:
+                raise                   # don't hide the exception that's already propagating
+
+    def submit(self, writeFunc, outputFiles, description, key=None):
+        """Call writeFunc() in the background;  it writes outputFiles (a list of names; None is ignored)
+
+        description (e.g. the name of the input file) is used in error messages, and key (default:
+        description) is passed to onError.  Waits for the oldest pending write to finish if there are
+        already maxPending in progress
+        """
+        if key is None:
+            key = description
+        self.check()
+
+        t0 = time.time()
+        while self._pending and len(self._pending) >= self.maxPending:
+            self._finish(self._pending[0])
+        self.waitTime += time.time() - t0
+
+        nStage = len(self.timer.stages) if self.timer else 0
+        if self.maxPending <= 0:
+            try:
+                summary = _runWrite(writeFunc, outputFiles)
+            except Exception:
+                if self.onError is None:
+                    raise
+                self.onError(key, traceback.format_exc())
+            else:
+                self._record(summary)
+            return
+
+        readFd, writeFd = os.pipe()
+        sys.stdout.flush()              # or the child will print our buffered output too
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:                    # the child
+            status = 0
+            try:
+                os.close(readFd)
+                summary = _runWrite(writeFunc, outputFiles)
+                summary["stages"] = self.timer.stages[nStage:] if self.timer else []
+            except Exception:
+                summary = dict(error=traceback.format_exc())
+                status = 1
+            try:
+                with os.fdopen(writeFd, "w") as fd:
+                    json.dump(summary, fd)
+            finally:
+                os._exit(status)        # don't run the parent's atexit handlers or flush its buffers
+
+        os.close(writeFd)
+        self._pending.append((pid, readFd, description, key))
+
+    def check(self):
+        """Raise IOError if any of the writes that have finished failed"""
+        for pending in list(self._pending):
+            pid, status = os.waitpid(pending[0], os.WNOHANG)
+            if pid != 0:
+                self._finish(pending, status)
+
+    def close(self):
+        """Wait for all the pending writes to finish, raising IOError if any of them failed"""
+        t0 = time.time()
+        error = None
+        while self._pending:
+            try:
+                self._finish(self._pending[0])
+            except IOError as e:
+                error = error or e
+        self.waitTime += time.time() - t0
+
+        if error:
+            raise error
+
+    def report(self):
+        """Return a one-line summary of the write throughput"""
+        return "Wrote %d files, %.1f MB in %.2fs (%.1f MB/s); waited %.2fs for writes to finish" % (
+            self.nFile, self.nByte/1024.0**2, self.writeTime,
+            self.nByte/1024.0**2/self.writeTime if self.writeTime > 0 else 0.0, self.waitTime)
+
+    def _finish(self, pending, status=None):
+        """Read the summary sent by the child that's written pending, and wait for it to exit
+
+        status is the child's exit status, if it's already known to have exited
+        """
+        pid, readFd, description, key = pending
+        self._pending.remove(pending)
+
+        with os.fdopen(readFd) as fd:
+            text = fd.read()            # before waiting, as the child can't exit until it's all been read
+        if status is None:
+            status = os.waitpid(pid, 0)[1]
+        try:
+            summary = json.loads(text)
+        except ValueError:
+            summary = dict(error="the writer exited with status %d" % status)
+
+        if "error" in summary or status != 0:
+            error = summary.get("error", "exit status %d" % status)
+            if self.onError is None:
+                raise IOError("Failed to write the outputs of %s:\n%s" % (description, error))
+            self.onError(key, error)
+            return
+
+        self._record(summary)
+
+    def _record(self, summary):
+        """Accumulate the summary of a completed write"""
+        self.nFile += summary["nFile"]
+        self.nByte += summary["nByte"]
+        self.writeTime += summary["wall"]
+        if self.timer and "stages" in summary:
+            self.timer.stages += summary["stages"]
+
+
+def _runWrite(writeFunc, outputFiles):
+    """Call writeFunc, and return a dict of the time it took and the number and size of outputFiles"""
+    t0 = time.time()
+    writeFunc()
+    wall = time.time() - t0
+
+    outputFiles = [fileName for fileName in outputFiles if fileName and os.path.exists(fileName)]
+    return dict(wall=wall, nFile=len(outputFiles),
+                nByte=sum(os.path.getsize(fileName) for fileName in outputFiles))
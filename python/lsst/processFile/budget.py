@@ -0,0 +1,184 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Limit the wall time and memory spent processing each file by falling back to cheaper processing
+
+The stages can't be interrupted, so the budget is checked before each of the expensive ones:
+    characterize  If too much of the budget has gone on reading the data, install a simple PSF instead
+    deblend       If too much has gone, or deblending every footprint would need more memory than is
+                  left, don't deblend footprints with too large an area or too many peaks
+    measurement   If too much has gone, only run the plugins in config.budget.measurementPlugins
+Each fallback that was used is recorded in the catalogue's (and the exposure's) metadata as e.g.
+BUDGET_SIMPLEPSF = True
+"""
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import time
+
+import lsst.pex.config as pexConfig
+
+from .metrics import getRss
+
+__all__ = ["BudgetConfig", "Budget", "fallbackNames", "getFallbacks", "deblendLimits", "trimmedPlugins"]
+
+fallbackNames = ["simplePsf", "deblendLimits", "trimmedMeasurement"]
+
+_bytesPerDeblendedPixel = 40            # approximate memory used by the deblender per pixel per peak
+
+
+class BudgetConfig(pexConfig.Config):
+    """The per-file budgets, and the cheaper processing to fall back on when they're running out"""
+    wallTime = pexConfig.Field(dtype=float, default=0,
+                               doc="Wall time budget for processing each file (seconds); 0 means no limit")
+    memory = pexConfig.Field(dtype=float, default=0,
+                             doc="Memory (resident set size) budget for processing each file (GB); "
+                             "0 means no limit")
+    characterizeFraction = pexConfig.Field(dtype=float, default=0.2,
+                                           doc="Install a simple PSF rather than characterizing the "
+                                           "exposure if this fraction of a budget has been used already")
+    deblendFraction = pexConfig.Field(dtype=float, default=0.4,
+                                      doc="Apply the deblend limits if this fraction of a budget has been "
+                                      "used already (or deblending would exceed the memory budget)")
+    deblendMaxFootprintArea = pexConfig.Field(dtype=int, default=10000,
+                                              doc="Don't deblend footprints with more pixels than this "
+                                              "when applying the deblend limits")
+    deblendMaxNumberOfPeaks = pexConfig.Field(dtype=int, default=20,
+                                              doc="Only deblend this many peaks of each footprint when "
+                                              "applying the deblend limits")
+    measurementFraction = pexConfig.Field(dtype=float, default=0.6,
+                                          doc="Only run measurementPlugins if this fraction of a budget "
+                                          "has been used already")
+    measurementPlugins = pexConfig.ListField(
+        dtype=str, default=["base_SdssCentroid", "base_SdssShape", "base_PsfFlux", "base_PixelFlags"],
+        doc="The measurement plugins to run when trimming the measurement (the others' fields are not set)")
+
+
+class Budget(object):
+    """Track the time and memory used processing a file, and decide which fallbacks to use
+
+    The clock starts when the Budget is created.  The fallbacks that have been used are in
+    budget.fallbacks (a list of names from fallbackNames)
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.fallbacks = []
+        self._t0 = time.time()
+
+    def isLimited(self):
+        """Return True if there is a wall time or memory budget"""
+        return self.config.wallTime > 0 or self.config.memory > 0
+
+    def getFraction(self, extraMemory=0):
+        """Return the largest fraction of a budget used so far (including extraMemory bytes more)"""
+        fractions = [0.0]
+        if self.config.wallTime > 0:
+            fractions.append((time.time() - self._t0)/self.config.wallTime)
+        if self.config.memory > 0:
+            fractions.append((getRss() + extraMemory)/(self.config.memory*1024.0**3))
+
+        return max(fractions)
+
+    def fallBack(self, name, fraction, extraMemory=0, verbose=False):
+        """Return True (and record the fallback name) if more than fraction of a budget has been used
+
+        A memory budget is also exceeded if extraMemory (bytes) more would exceed it;  extraMemory may be
+        a callable returning the number of bytes, which is only called if there's a memory budget and
+        it's needed (e.g. Budget.estimateDeblendMemory, which looks at every source)
+        """
+        if not self.isLimited():
+            return False
+
+        used = self.getFraction()
+        if used <= fraction:
+            if callable(extraMemory):
+                extraMemory = extraMemory() if self.config.memory > 0 else 0
+            if self.getFraction(extraMemory) <= 1:
+                return False
+
+        self.fallbacks.append(name)
+        if verbose:
+            print("Used %.0f%% of the budget; falling back to %s" % (100*used, name))
+
+        return True
+
+    def setMetadata(self, metadata):
+        """Record which fallbacks were used in metadata (e.g. a catalogue's), as BUDGET_SIMPLEPSF etc."""
+        for name in fallbackNames:
+            metadata.set("BUDGET_%s" % name.upper(), name in self.fallbacks)
+
+    def estimateDeblendMemory(self, sources):
+        """Return the approximate memory needed (bytes) to deblend every footprint in sources"""
+        nPixel = 0
+        for source in sources:
+            footprint = source.getFootprint()
+            nPeak = len(footprint.getPeaks())
+            if nPeak > 1:
+                nPixel += footprint.getArea()*nPeak
+
+        return nPixel*_bytesPerDeblendedPixel
+
+
+def getFallbacks(metadata):
+    """Return the names of the fallbacks recorded in metadata (which may be None)"""
+    if metadata is None:
+        return []
+
+    return [name for name in fallbackNames if metadata.exists("BUDGET_%s" % name.upper()) and
+            metadata.get("BUDGET_%s" % name.upper())]
+
+
+@contextlib.contextmanager
+def deblendLimits(deblendTask, config):
+    """Temporarily limit the footprints that deblendTask deblends to those allowed by config (a BudgetConfig)
+
+    The footprints that are skipped, or only partly deblended, are flagged by the deblender
+    """
+    deblendConfig = deblendTask.config
+    saved = deblendConfig.maxFootprintArea, deblendConfig.maxNumberOfPeaks
+    try:
+        for name, limit in [("maxFootprintArea", config.deblendMaxFootprintArea),
+                            ("maxNumberOfPeaks", config.deblendMaxNumberOfPeaks)]:
+            current = getattr(deblendConfig, name)
+            setattr(deblendConfig, name, limit if current <= 0 else min(current, limit))  # 0: no limit
+        yield
+    finally:
+        deblendConfig.maxFootprintArea, deblendConfig.maxNumberOfPeaks = saved
+
+
+@contextlib.contextmanager
+def trimmedPlugins(measurementTask, pluginNames):
+    """Temporarily only run measurementTask's plugins that are named in pluginNames
+
+    The fields of the plugins that aren't run are left with their initial values (e.g. NaN)
+    """
+    plugins = measurementTask.plugins
+    trimmed = type(plugins)()
+    for name, plugin in plugins.items():
+        if name in pluginNames:
+            trimmed[name] = plugin
+
+    measurementTask.plugins = trimmed
+    try:
+        yield
+    finally:
+        measurementTask.plugins = plugins
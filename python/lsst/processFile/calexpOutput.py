@@ -0,0 +1,120 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Write a calexp, optionally tile-compressed and without the planes that aren't needed
+
+The compression uses cfitsio's extended filename syntax (foo.fits[compress ...]), which applies to
+every image HDU in the file.  With quantization the integer mask plane is still compressed losslessly
+(Rice), while the floating-point image and variance planes are quantized
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.pipe.base as pipeBase
+
+__all__ = ["calexpPlanes", "writeCalexp", "getCompressedFileName"]
+
+calexpPlanes = {
+    "all": "The image, mask and variance planes, and the PSF",
+    "scalarVariance": "The image and mask planes;  the variance is replaced by its median, which is "
+                      "recorded as VARIANCE_SCALAR (and costs almost nothing when compressed)",
+    "psfOnly": "Only the PSF, Wcs, Calib and header, attached to a 1x1 exposure;  the original "
+               "bounding box is recorded as CALEXP_X0, CALEXP_Y0, CALEXP_WIDTH and CALEXP_HEIGHT",
+}
+
+
+def getCompressedFileName(fileName, quantizeLevel):
+    """Return the name that makes cfitsio write fileName tile-compressed (fileName if quantizeLevel is None)
+
+    If quantizeLevel is 0 all the planes are compressed losslessly (GZIP);  otherwise they're Rice
+    compressed, with floating-point pixels quantized to 1/quantizeLevel of the noise (a negative
+    quantizeLevel is an absolute quantization step)
+    """
+    if quantizeLevel is None:
+        return fileName
+    elif quantizeLevel == 0:
+        return "%s[compress GZIP]" % fileName
+    else:
+        return "%s[compress Rice; %g]" % (fileName, quantizeLevel)
+
+
+def writeCalexp(exposure, fileName, planes="all", quantizeLevel=None):
+    """Write exposure to fileName, keeping only the planes specified (one of calexpPlanes)
+
+    If quantizeLevel isn't None the file is tile-compressed (see getCompressedFileName).  The exposure
+    isn't modified.
+
+    Returns a Struct with the number of bytes written (nByte), the number that writing all the
+    planes uncompressed would have needed (nByteUncompressed), and the time taken (wall)
+    """
+    if planes not in calexpPlanes:
+        raise ValueError("Unknown calexp planes %s; please choose one of %s" %
+                         (planes, ", ".join(sorted(calexpPlanes))))
+
+    t0 = time.time()
+    nByteUncompressed = exposure.getWidth()*exposure.getHeight()*(4 + 2 + 4)   # image, mask, variance
+
+    if planes == "scalarVariance":
+        mi = exposure.getMaskedImage()
+        varianceArr = mi.getVariance().getArray()
+        good = np.logical_and(np.isfinite(varianceArr), varianceArr > 0)
+        varianceScalar = float(np.median(varianceArr[good])) if good.any() else 0.0
+        variance = afwImage.ImageF(mi.getBBox(afwImage.PARENT))
+        variance.set(varianceScalar)
+
+        output = afwImage.makeExposure(afwImage.MaskedImageF(mi.getImage(), mi.getMask(), variance))
+        del mi, varianceArr, good
+        _copyExposureInfo(exposure, output)
+        output.getMetadata().set("VARIANCE_SCALAR", varianceScalar)
+    elif planes == "psfOnly":
+        output = afwImage.ExposureF(1, 1)
+        output.setXY0(exposure.getXY0())
+        _copyExposureInfo(exposure, output)
+
+        metadata = output.getMetadata()
+        for key, value in [("CALEXP_X0", exposure.getX0()), ("CALEXP_Y0", exposure.getY0()),
+                           ("CALEXP_WIDTH", exposure.getWidth()), ("CALEXP_HEIGHT", exposure.getHeight())]:
+            metadata.set(key, value)
+    else:
+        output = exposure
+
+    if output is not exposure:
+        output.getMetadata().set("CALEXP_PLANES", planes)
+
+    output.writeFits(getCompressedFileName(fileName, quantizeLevel))
+
+    return pipeBase.Struct(nByte=os.path.getsize(fileName), nByteUncompressed=nByteUncompressed,
+                           wall=time.time() - t0)
+
+
+def _copyExposureInfo(exposure, output):
+    """Copy the PSF, Wcs, Calib, Filter and (a copy of) the metadata of exposure to output"""
+    output.setPsf(exposure.getPsf())
+    if exposure.hasWcs():
+        output.setWcs(exposure.getWcs())
+    output.setCalib(exposure.getCalib())
+    output.setFilter(exposure.getFilter())
+    output.setMetadata(exposure.getMetadata().deepCopy())
@@ -0,0 +1,175 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Checkpoint the intermediate products of processing a file, so that reruns that only change
+downstream config (e.g. the deblender or measurement) needn't repeat characterization and detection
+
+Each checkpoint is stored in a ResultCache, keyed by the contents of the input files and only the
+config fields that the checkpointed stage (and those before it) depend on.  The detection checkpoint
+doesn't repeat the characterized exposure:  it only holds the sources (with their footprints) and the
+background that detection subtracted, which are applied to the characterize checkpoint's exposure
+when it's restored
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import lsst.afw.detection as afwDetection
+import lsst.afw.math as afwMath
+import lsst.afw.table as afwTable
+import lsst.pipe.base as pipeBase
+
+__all__ = ["Checkpointer", "checkpointStages", "makeDetectionProducts", "applyDetection", "restoreSources"]
+
+# The checkpoints in the order that they're made, and the config fields that each depends upon
+checkpointStages = [
+    ("characterize", ["variance", "varianceEstimator", "varianceSamplePixels", "badPixelValue",
+                      "interpPlanes", "interpEngine", "isr", "doCalibrate", "charImage", "psfSeed"]),
+    ("detection", ["variance", "varianceEstimator", "varianceSamplePixels", "badPixelValue",
+                   "interpPlanes", "interpEngine", "isr", "doCalibrate", "charImage", "psfSeed",
+                   "detection"]),
+]
+
+# Fields set by detection, which are copied when restoring its checkpoint into a catalogue whose schema
+# has been changed by a different deblender or measurement config
+_detectionFields = ["flags_negative"]
+
+class Checkpointer(object):
+    """Save and restore the checkpoints of processing one file in cache (a ResultCache)
+
+    The characterize checkpoint contains the characterized exposure (with its PSF) and the calibSources;
+    the detection checkpoint contains the sources, with their footprints, and the background subtracted
+    by detection (see makeDetectionProducts), and is only usable with the characterize checkpoint
+    """
+
+    def __init__(self, cache, config, version, inputFile, weightFile=None, varianceFile=None,
+                 verbose=False):
+        self.cache = cache
+        self.inputFile = inputFile
+        self.verbose = verbose
+
+        self.keys = {}
+        for stage, fields in checkpointStages:
+            self.keys[stage] = cache.makeKey(config, version, inputFile, weightFile, varianceFile,
+                                             stage=stage, fields=fields)
+
+    def restore(self, stage=None):
+        """Return the name and contents of the latest checkpoint that's available, or (None, None)
+
+        If stage is given (e.g. "characterize") only that checkpoint is considered.
+        The contents are a Struct with exposure, calibSources, and (for the detection checkpoint) sources;
+        the detection checkpoint's exposure is the characterize checkpoint's, with detection's mask
+        planes and background applied
+        """
+        stages = [name for name, fields in reversed(checkpointStages) if stage is None or name == stage]
+        if not stages:
+            raise ValueError("Unknown checkpoint %s" % stage)
+
+        for stage in stages:
+            products = self.cache.get(self.keys[stage])
+            if products is None:
+                continue
+
+            if stage == "detection":
+                characterized = self.cache.get(self.keys["characterize"])
+                if characterized is None or characterized.exposure is None:
+                    continue            # it's been evicted
+                applyDetection(characterized.exposure, products.sources, products.background)
+                products = pipeBase.Struct(exposure=characterized.exposure,
+                                           calibSources=characterized.calibSources, sources=products.sources)
+
+            if self.verbose:
+                print("Resuming processing %s after %s" % (self.inputFile, stage))
+            return stage, products
+
+        return None, None
+
+    def save(self, stage, products):
+        """Save products as stage
+
+        For the characterize checkpoint, products is a Struct with the exposure and calibSources;  for the
+        detection checkpoint, a Struct returned by makeDetectionProducts
+        """
+        self.cache.put(self.keys[stage], products)
+
+def makeDetectionProducts(detectionResult, detectionConfig):
+    """Return the products of detection to save in its checkpoint, or None if they can't be saved
+
+    detectionResult is the Struct returned by SourceDetectionTask.run, configured by detectionConfig.
+    Returns a Struct with the sources, and the background (a BackgroundList, or None) that was
+    subtracted from the exposure if detectionConfig.reEstimateBackground
+    """
+    background = None
+    if getattr(detectionConfig, "reEstimateBackground", False):
+        background = getattr(getattr(detectionResult, "fpSets", None), "background", None)
+        if background is None:
+            return None                 # we can't reproduce the exposure
+        if not isinstance(background, afwMath.BackgroundList):
+            backgroundList = afwMath.BackgroundList()
+            backgroundList.append(background)
+            background = backgroundList
+
+    return pipeBase.Struct(sources=detectionResult.sources, background=background)
+
+def applyDetection(exposure, sources, background=None):
+    """Make the characterized exposure look as it did after detecting sources (from the detection checkpoint)
+
+    The background (a BackgroundList, if not None) is subtracted, and the DETECTED (or, for sources
+    with flags_negative set, DETECTED_NEGATIVE) mask bit is set in the sources' footprints
+    """
+    mi = exposure.getMaskedImage()
+    if background is not None:
+        mi -= background.getImage()
+
+    mask = mi.getMask()
+    detected, detectedNegative = mask.getPlaneBitMask("DETECTED"), mask.getPlaneBitMask("DETECTED_NEGATIVE")
+    maskArr = mask.getArray()
+    maskArr &= ~np.array(detected | detectedNegative, dtype=maskArr.dtype)
+
+    schema = sources.getSchema()
+    negativeKey = schema.find("flags_negative").key if "flags_negative" in schema.getNames() else None
+    for source in sources:
+        isNegative = negativeKey is not None and source.get(negativeKey)
+        afwDetection.setMaskFromFootprint(mask, source.getFootprint(),
+                                          detectedNegative if isNegative else detected)
+
+def restoreSources(savedSources, table):
+    """Return a copy of savedSources (as saved in the detection checkpoint) in table
+
+    The schema of table may differ from that of savedSources in all but the fields set by detection;
+    the footprints and detection's flags are copied, and the ids are assigned by table in the same order
+    as they were when the sources were detected
+    """
+    sources = afwTable.SourceCatalog(table)
+    sources.reserve(len(savedSources))
+
+    savedNames, names = savedSources.getSchema().getNames(), table.getSchema().getNames()
+    keys = [(savedSources.getSchema().find(name).key, table.getSchema().find(name).key)
+            for name in _detectionFields if name in savedNames and name in names]
+
+    for saved in savedSources:
+        record = sources.addNew()
+        record.setFootprint(saved.getFootprint())
+        for savedKey, key in keys:
+            record.set(key, saved.get(savedKey))
+
+    return sources
@@ -0,0 +1,184 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Append the catalogues of many input files to a single columnar file (Parquet or HDF5)
+
+Each file's sources are appended as soon as they're available (so the whole batch is never in memory),
+tagged with the input file and filter.  In Parquet each file's sources are a row group;  in HDF5 each
+column is a (chunked, extensible) dataset, with a fileIndex column and a files table giving the name,
+filter and rows of each input file.  Only scalar and flag columns are written (not arrays or
+covariances), optionally selected by name.
+"""
+from __future__ import absolute_import, division, print_function
+
+import fnmatch
+import os
+
+import numpy as np
+
+__all__ = ["CombinedCatalogWriter", "getCatalogColumns"]
+
+_scalarTypes = ("I", "L", "F", "D", "Flag", "Angle")
+_hdf5ChunkRows = 65536                  # rows per HDF5 chunk, independent of the size of any one catalogue
+
+
+def getCatalogColumns(catalog, columns=None):
+    """Return a list of (name, numpy array) for the scalar and flag columns of catalog
+
+    If columns (a list of names or shell-style patterns, e.g. "base_PsfFlux_*") is specified only
+    the matching columns (and id) are returned.  Angles are in radians
+    """
+    if not catalog.isContiguous():
+        catalog = catalog.copy(deep=True)
+    columnView = catalog.getColumnView()
+
+    outputs = []
+    for item in catalog.getSchema():
+        field = item.getField()
+        name = field.getName()
+        if field.getTypeString() not in _scalarTypes:
+            continue
+        if columns is not None and name != "id" and \
+           not any(fnmatch.fnmatchcase(name, pattern) for pattern in columns):
+            continue
+
+        outputs.append((name, np.array(columnView[item.getKey()])))
+
+    return outputs
+
+
+class CombinedCatalogWriter(object):
+    """Append catalogues to fileName, which is written as Parquet (*.parquet) or HDF5 (*.h5, *.hdf5)
+
+    Requires pyarrow or h5py respectively.  Use as e.g.
+        with CombinedCatalogWriter("sources.parquet", columns=["coord_*", "base_PsfFlux_*"]) as writer:
+            for result in iterRun(...):
+                writer.append(result.sources, result.inputFile, filterName)
+
+    Every catalogue must have the same columns (i.e. be processed with the same config)
+    """
+
+    def __init__(self, fileName, columns=None, format=None):
+        if format is None:
+            ext = os.path.splitext(fileName)[1].lower()
+            format = dict([(".parquet", "parquet"), (".pq", "parquet"),
+                           (".h5", "hdf5"), (".hdf5", "hdf5")]).get(ext)
+            if format is None:
+                raise ValueError("Unable to deduce the format of %s from its extension; "
+                                 "please use .parquet or .h5" % fileName)
+
+        self.fileName = fileName
+        self.columns = columns
+        self.format = format
+        self.nFile = 0
+        self.nRow = 0
+
+        if format == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise RuntimeError("Writing %s as Parquet requires pyarrow" % fileName)
+            self._pa = pyarrow
+            self._writer = None         # created when we know the schema
+        elif format == "hdf5":
+            try:
+                import h5py
+            except ImportError:
+                raise RuntimeError("Writing %s as HDF5 requires h5py" % fileName)
+            self._file = h5py.File(fileName, "w")
+            self._files = []            # (inputFile, filterName, firstRow, nRow)
+        else:
+            raise ValueError("Unknown combined catalogue format %s; please choose parquet or hdf5" % format)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, sources, inputFile, filterName=None):
+        """Append the columns of sources, tagged with inputFile and filterName"""
+        columns = getCatalogColumns(sources, self.columns)
+        filterName = filterName or ""
+
+        if self.format == "parquet":
+            self._appendParquet(columns, len(sources), inputFile, filterName)
+        else:
+            self._appendHdf5(columns, len(sources), inputFile, filterName)
+
+        self.nFile += 1
+        self.nRow += len(sources)
+
+    def close(self):
+        """Finish writing the file"""
+        if self.format == "parquet":
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        elif self._file is not None:
+            names = [inputFile for inputFile, filterName, firstRow, nRow in self._files]
+            filters = [filterName for inputFile, filterName, firstRow, nRow in self._files]
+            files = self._file.create_group("files")
+            files.create_dataset("inputFile", data=np.array(names, dtype=bytes))
+            files.create_dataset("filter", data=np.array(filters, dtype=bytes))
+            files.create_dataset("firstRow", data=np.array([f[2] for f in self._files], dtype=np.int64))
+            files.create_dataset("nRow", data=np.array([f[3] for f in self._files], dtype=np.int64))
+
+            self._file.close()
+            self._file = None
+
+    def _appendParquet(self, columns, nRow, inputFile, filterName):
+        pa = self._pa
+        arrays = [pa.array(value) for name, value in columns]
+        arrays += [pa.array([inputFile]*nRow, type=pa.string()).dictionary_encode(),
+                   pa.array([filterName]*nRow, type=pa.string()).dictionary_encode()]
+        names = [name for name, value in columns] + ["inputFile", "filter"]
+        table = pa.Table.from_arrays(arrays, names=names)
+
+        if self._writer is None:
+            import pyarrow.parquet
+
+            self._writer = pyarrow.parquet.ParquetWriter(self.fileName, table.schema)
+        elif not table.schema.equals(self._writer.schema):
+            raise RuntimeError("The columns of %s differ from those already written to %s" %
+                               (inputFile, self.fileName))
+
+        self._writer.write_table(table, row_group_size=max(1, nRow))   # one row group per file
+
+    def _appendHdf5(self, columns, nRow, inputFile, filterName):
+        columns = columns + [("fileIndex", np.full(nRow, len(self._files), dtype=np.int32))]
+        if self._files and \
+           sorted(name for name, value in columns) != sorted(self._file["sources"].keys()):
+            raise RuntimeError("The columns of %s differ from those already written to %s" %
+                               (inputFile, self.fileName))
+
+        group = self._file.require_group("sources")
+        for name, value in columns:
+            if name not in group:
+                group.create_dataset(name, data=value, maxshape=(None,), chunks=(_hdf5ChunkRows,),
+                                     compression="gzip")
+            else:
+                dataset = group[name]
+                dataset.resize((self.nRow + nRow,))
+                dataset[self.nRow:] = value
+
+        self._files.append((inputFile, filterName, self.nRow, nRow))
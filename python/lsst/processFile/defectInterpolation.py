@@ -0,0 +1,109 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Interpolate over the masked pixels of an image directly from its mask, a block of rows at a time
+
+The isr engine converts the mask planes to a list of defects (ipIsr.getDefectListFromMask) and
+interpolates over each in turn with IsrTask, which is slow when a large fraction of the image is masked
+(e.g. the blank borders of a resampled mosaic).  The vectorized engine instead finds every masked
+pixel's nearest unmasked neighbours in its row with a cumulative maximum (and minimum) over the row,
+and interpolates all the masked pixels of chunkRows rows at once.  Like meas_algorithms'
+interpolateOverDefects it interpolates along rows, linearly between the unmasked pixels either side of
+each run of masked pixels;  runs that touch the edge of the image are set to a fallback value (the
+clipped mean of the unmasked pixels), and the interpolated pixels have the INTRP mask bit set
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from .varianceEstimate import _goodValues, _clippedVariance
+
+__all__ = ["interpEngines", "interpolateFromMask"]
+
+interpEngines = {
+    "isr": "Convert the mask to a list of defects, and interpolate over them with IsrTask",
+    "vectorized": "Interpolate along rows directly from the mask, a block of rows at a time",
+}
+
+
+def interpolateFromMask(maskedImage, planes, fallbackValue=None, chunkRows=256, nSample=100000):
+    """Interpolate over the pixels of maskedImage with any of the mask planes (a list of names) set
+
+    The pixels with no unmasked pixel on one side of them in their row are set to fallbackValue (default:
+    the clipped mean of about nSample unmasked pixels).  The image is processed chunkRows rows at a time.
+    The interpolated pixels have the INTRP mask bit set;  their variance isn't changed
+
+    Returns the number of pixels interpolated
+    """
+    mask = maskedImage.getMask()
+    bits = mask.getPlaneBitMask(list(planes))
+    mask.addMaskPlane("INTRP")
+    intrpBit = mask.getPlaneBitMask("INTRP")
+
+    image = maskedImage.getImage().getArray()
+    maskArr = mask.getArray()
+    height, width = image.shape
+    chunkRows = max(1, min(chunkRows, height))
+
+    nInterp = 0
+    for r0 in range(0, height, chunkRows):
+        r1 = min(r0 + chunkRows, height)
+        bad = (maskArr[r0:r1] & bits) != 0
+        if not bad.any():
+            continue
+
+        if fallbackValue is None:
+            step = max(1, int(np.sqrt(height*width/nSample)))
+            fallbackValue = _clippedVariance(_goodValues(image[step//2::step, step//2::step],
+                                                         maskArr[step//2::step, step//2::step], bits),
+                                             3.0, 3).mean
+
+        nInterp += _interpolateRows(image[r0:r1], bad, fallbackValue)
+        np.bitwise_or(maskArr[r0:r1], intrpBit, out=maskArr[r0:r1], where=bad)
+
+    return nInterp
+
+
+def _interpolateRows(image, bad, fallbackValue):
+    """Interpolate over the pixels of image (a 2-d numpy array) where bad is True, along each row
+
+    Returns the number of pixels interpolated
+    """
+    width = image.shape[1]
+    columns = np.arange(width, dtype=np.int32)
+    left = np.where(bad, -1, columns)   # the column of the nearest good pixel to the left (or -1)
+    np.maximum.accumulate(left, axis=1, out=left)
+    right = np.where(bad, width, columns)[:, ::-1]  # ... and to the right (or width)
+    right = np.minimum.accumulate(right, axis=1)[:, ::-1]
+
+    y, x = np.nonzero(bad)
+    x0, x1 = left[y, x], right[y, x]
+    del left, right
+
+    edge = np.logical_or(x0 < 0, x1 >= width)
+    image[y[edge], x[edge]] = fallbackValue
+
+    interior = np.logical_not(edge)
+    y, x, x0, x1 = y[interior], x[interior], x0[interior], x1[interior]
+    weight = (x - x0)/(x1 - x0)
+    image[y, x] = (1 - weight)*image[y, x0] + weight*image[y, x1]
+
+    return len(edge)
@@ -0,0 +1,169 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Read a manifest of files to process, validate and schedule them, and record the ones that failed
+
+A manifest is a text file with one input per line:
+    input.fits [weight=WEIGHT] [variance=VARIANCE] [filter=FILTER]
+               [calexp=CALEXP] [catalog=CATALOG] [calibCatalog=CALIBCATALOG] [regions=REGIONS]
+Blank lines and lines starting with # are ignored.  If no outputs are given for an input, its calexp
+and catalogues are written next to it (see lsst.processFile.utils.makeOutputFileNames).  Instead of a
+file a manifest may be a glob (e.g. "data/*.fits"), in which case the outputs are written next to each
+input (and existing outputs aren't treated as inputs).
+"""
+from __future__ import absolute_import, division, print_function
+
+import glob
+import os
+
+import lsst.pipe.base as pipeBase
+
+from .utils import makeOutputFileNames, isOutputFileName
+
+__all__ = ["manifestKeys", "readManifest", "parseManifestLine", "validateManifest", "formatManifestEntry",
+           "writeRetryManifest"]
+
+# The keys that may be given for each input, and the corresponding outputs' names (if any)
+manifestKeys = dict(weight=None, variance=None, filter=None,
+                    calexp="calexp", catalog="catalog", calibCatalog="calibCatalog", regions="regions")
+
+
+def _makeEntry(inputFile, line=None, **kwargs):
+    """Return a Struct describing one input;  the outputs default to files next to inputFile"""
+    outputs = dict((name, kwargs.get(name)) for name in manifestKeys if manifestKeys[name])
+    if not any(outputs.values()):
+        outputs.update(makeOutputFileNames(inputFile))
+
+    return pipeBase.Struct(inputFile=inputFile, weightFile=kwargs.get("weight"),
+                           varianceFile=kwargs.get("variance"), filterName=kwargs.get("filter"),
+                           outputs=outputs, line=line, bbox=None, cost=0, error=kwargs.get("error"))
+
+
+def readManifest(manifest):
+    """Return a list of Structs describing the inputs listed in manifest, a file name or a glob
+
+    Each Struct has the inputFile, weightFile, varianceFile, filterName, a dict of outputs (calexp,
+    catalog, calibCatalog, regions; None if not wanted), and the line of the manifest that it came from.
+    Lines that can't be parsed have their error set rather than raising an exception
+    """
+    if not os.path.isfile(manifest):
+        inputFiles = sorted(f for f in glob.glob(manifest) if not isOutputFileName(f))
+        if not inputFiles:
+            raise RuntimeError("Manifest %s is neither a file nor a glob matching any files" % manifest)
+
+        return [_makeEntry(inputFile, line=inputFile) for inputFile in inputFiles]
+
+    entries = []
+    with open(manifest) as fd:
+        for lineNo, line in enumerate(fd, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            entries.append(parseManifestLine(line, "%s:%d" % (manifest, lineNo)))
+
+    return entries
+
+
+def parseManifestLine(line, where="the manifest"):
+    """Return a Struct describing the input on line, a (non-blank, non-comment) line of a manifest
+
+    See readManifest;  where (e.g. file:lineNo) is used in the error set if the line can't be parsed
+    """
+    fields = line.split()
+    kwargs, errors = {}, []
+    for field in fields[1:]:
+        key, sep, value = field.partition("=")
+        if not sep or key not in manifestKeys:
+            errors.append("Unable to parse %s at %s (expected one of %s=...)" %
+                          (field, where, "=..., ".join(sorted(manifestKeys))))
+        else:
+            kwargs[key] = value
+    if errors:
+        kwargs["error"] = "; ".join(errors)
+
+    return _makeEntry(fields[0], line=line, **kwargs)
+
+
+def validateManifest(entries, verbose=False):
+    """Check the inputs and outputs of entries (as returned by readManifest) using only their headers
+
+    Sets each entry's bbox and cost (its number of pixels), or its error if it can't be processed.
+    Returns the entries that can be processed, largest first (so that a pool of workers isn't left
+    waiting for a big file at the end of the batch), and those that can't
+    """
+    from .processFile import readImageBBox
+
+    for entry in entries:
+        if entry.error:
+            continue
+
+        entry.bbox = readImageBBox(entry.inputFile)
+        if entry.bbox is None:
+            entry.error = "Unable to read the dimensions of %s" % entry.inputFile
+            continue
+        entry.cost = entry.bbox.getWidth()*entry.bbox.getHeight()
+
+        for fileName in (entry.weightFile, entry.varianceFile):
+            if fileName:
+                bbox = readImageBBox(fileName)
+                if bbox is None:
+                    entry.error = "Unable to read the dimensions of %s" % fileName
+                elif bbox.getDimensions() != entry.bbox.getDimensions():
+                    entry.error = "The dimensions of %s and %s differ" % (fileName, entry.inputFile)
+        if entry.weightFile and entry.varianceFile:
+            entry.error = "Please only specify a weight *or* a variance for %s" % entry.inputFile
+
+        for fileName in entry.outputs.values():
+            if fileName and not os.path.isdir(os.path.dirname(fileName) or "."):
+                entry.error = "The directory for %s doesn't exist" % fileName
+
+    valid = sorted([entry for entry in entries if not entry.error], key=lambda entry: -entry.cost)
+    invalid = [entry for entry in entries if entry.error]
+
+    if verbose:
+        print("Manifest: %d inputs (%.1f Mpixel in all, largest %.1f Mpixel); %d invalid" %
+              (len(valid), sum(entry.cost for entry in valid)/1e6,
+               (valid[0].cost/1e6 if valid else 0), len(invalid)))
+    for entry in invalid:
+        print("Skipping %s: %s" % (entry.inputFile, entry.error))
+
+    return valid, invalid
+
+
+def formatManifestEntry(entry):
+    """Return entry formatted as a line of a manifest"""
+    fields = [entry.inputFile]
+    for key, value in [("weight", entry.weightFile), ("variance", entry.varianceFile),
+                       ("filter", entry.filterName)] + sorted(entry.outputs.items()):
+        if value:
+            fields.append("%s=%s" % (key, value))
+
+    return " ".join(fields)
+
+
+def writeRetryManifest(fileName, entries):
+    """Write the entries that failed to fileName as a manifest, each preceded by its error as a comment"""
+    with open(fileName, "w") as fd:
+        for entry in entries:
+            error = (entry.error or "").strip().splitlines()
+            print("# %s" % (error[-1] if error else "failed"), file=fd)     # the last line of a traceback
+            print(formatManifestEntry(entry), file=fd)
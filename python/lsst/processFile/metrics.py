@@ -0,0 +1,189 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Measure the time and memory used by the stages of processing a file
+
+A StageTimer records the wall time, CPU time, peak resident set size and (optionally) a count of the
+objects processed by each stage of processing each file.  It can also run selected stages under cProfile,
+write a JSON report, and record its measurements in an exposure's metadata
+"""
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+__all__ = ["StageTimer", "noTimer", "getRss", "getPeakRss", "resetPeakRss", "getCpuTime"]
+
+def resetPeakRss():
+    """Reset the peak resident set size reported by getPeakRss to the current resident set size
+
+    Only possible on linux;  returns False if the peak couldn't be reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fd:
+            fd.write("5")
+    except (IOError, OSError):
+        return False
+
+    return True
+
+def getPeakRss():
+    """Return the peak resident set size of this process in bytes
+
+    This is the peak since the last successful call to resetPeakRss, or since the process started
+    """
+    try:
+        with open("/proc/self/status") as fd:
+            for line in fd:
+                if line.startswith("VmHWM:"):
+                    return 1024*int(line.split()[1])
+    except (IOError, OSError):
+        pass
+
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRss if sys.platform == "darwin" else 1024*maxRss   # bytes on os/x, kB on linux
+
+def getRss():
+    """Return the current resident set size of this process in bytes (the peak, if that's unavailable)"""
+    try:
+        with open("/proc/self/status") as fd:
+            for line in fd:
+                if line.startswith("VmRSS:"):
+                    return 1024*int(line.split()[1])
+    except (IOError, OSError):
+        pass
+
+    return getPeakRss()
+
+def getCpuTime():
+    """Return the user + system CPU time used by this process, in seconds"""
+    times = os.times()
+    return times[0] + times[1]
+
+class StageTimer(object):
+    """Record the wall time, CPU time and peak memory use of named stages of processing
+
+    Use as e.g.
+        timer = StageTimer()
+        timer.inputFile = "foo.fits"
+        with timer("detection") as stage:
+            sources = ...
+            stage["count"] = len(sources)
+
+    The results are in timer.stages, a list of dicts with keys inputFile, name, wall and cpu (seconds),
+    peakRss (bytes) and count (None unless set by the caller), in the order that the stages completed.
+
+    If profile contains a stage's name (or "all") the stage is run under cProfile, and the statistics
+    are written to profileDir as <inputFile>.<stage>.prof (<inputFile>.<stage>.<n>.prof for the n-th
+    and subsequent runs of a stage, e.g. when processing tiles)
+    """
+
+    def __init__(self, profile=(), profileDir="."):
+        self.stages = []
+        self.inputFile = None
+        self.profile = set(profile)
+        self.profileDir = profileDir
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        stage = dict(inputFile=self.inputFile, name=name, count=None)
+
+        profiler = None
+        if name in self.profile or "all" in self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+
+        resetPeakRss()
+        t0, cpu0 = time.time(), getCpuTime()
+        if profiler:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler:
+                profiler.disable()
+            stage.update(wall=time.time() - t0, cpu=getCpuTime() - cpu0, peakRss=getPeakRss())
+            self.stages.append(stage)
+
+            if profiler:
+                prefix = os.path.basename(self.inputFile) if self.inputFile else "processFile"
+                nRun = len([s for s in self.getStages(self.inputFile) if s["name"] == name])
+                suffix = "" if nRun == 1 else ".%d" % nRun     # e.g. the stage is run for each tile
+                profiler.dump_stats(os.path.join(self.profileDir, "%s.%s%s.prof" % (prefix, name, suffix)))
+
+    def getStages(self, inputFile):
+        """Return the stages recorded while processing inputFile"""
+        return [stage for stage in self.stages if stage["inputFile"] == inputFile]
+
+    def setMetadata(self, metadata, inputFile):
+        """Record the measurements for inputFile in metadata (e.g. an exposure's), as METRIC_STAGE_WALL etc.
+
+        If a stage ran more than once (e.g. once per tile) the times are summed, the count is summed,
+        and the peak memory is the largest
+        """
+        for name, total in sorted(_sumStages(self.getStages(inputFile)).items()):
+            key = "METRIC_%s" % name.upper()
+            metadata.set(key + "_WALL", total["wall"])
+            metadata.set(key + "_CPU", total["cpu"])
+            metadata.set(key + "_PEAKRSS", total["peakRss"])
+            if total["count"] is not None:
+                metadata.set(key + "_COUNT", total["count"])
+
+    def writeJson(self, fileName):
+        """Write the measurements for each file, and the totals for each stage, to fileName as JSON"""
+        files = {}
+        for stage in self.stages:
+            files.setdefault(stage["inputFile"], []).append(
+                dict((k, v) for k, v in stage.items() if k != "inputFile"))
+
+        with open(fileName, "w") as fd:
+            json.dump(dict(files=files, totals=_sumStages(self.stages)), fd, indent=2, sort_keys=True)
+
+    def report(self):
+        """Return a summary of the time spent in each stage, summed over all the files"""
+        totals = sorted(_sumStages(self.stages).items(), key=lambda item: -item[1]["wall"])
+        return "\n".join("%-20s %8.3fs wall %8.3fs cpu %8.1f MB peak" %
+                         (name, total["wall"], total["cpu"], total["peakRss"]/1024.0**2)
+                         for name, total in totals)
+
+def _sumStages(stages):
+    """Return a dict of the wall and cpu times, counts, and peak memory use of stages, summed by name"""
+    totals = {}
+    for stage in stages:
+        total = totals.setdefault(stage["name"], dict(wall=0.0, cpu=0.0, peakRss=0, count=None, n=0))
+        total["wall"] += stage["wall"]
+        total["cpu"] += stage["cpu"]
+        total["peakRss"] = max(total["peakRss"], stage["peakRss"])
+        total["n"] += 1
+        if stage["count"] is not None:
+            total["count"] = (total["count"] or 0) + stage["count"]
+
+    return totals
+
+@contextlib.contextmanager
+def noTimer(name):
+    """A replacement for a StageTimer that records nothing"""
+    yield {}
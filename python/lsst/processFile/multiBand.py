@@ -0,0 +1,225 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Process images of the same field in several bands, detecting and deblending only once
+
+The sources are detected and deblended on a detection image (either a reference band, or the
+inverse-variance weighted mean of all the bands; see ProcessFileConfig.multiBandDetection) and measured
+there to make a reference catalogue.  Each band is then measured by forced photometry at the positions
+and shapes of the reference catalogue, so all the bands' catalogues share the same source IDs.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import lsst.afw.coord as afwCoord
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+import lsst.afw.table as afwTable
+import lsst.pipe.base as pipeBase
+from lsst.meas.base import ForcedMeasurementTask
+
+from .metrics import noTimer
+from .parallelMeasurement import measureSources
+
+__all__ = ["makeForcedTask", "makeDetectionExposure", "processMultiBand"]
+
+
+def makeForcedTask(config, refSchema):
+    """Return a Struct with the ForcedMeasurementTask that measures each band, and its algMetadata
+
+    refSchema is the schema of the reference catalogue (i.e. makeTasks(config).schema)
+    """
+    import lsst.daf.base as dafBase
+
+    algMetadata = dafBase.PropertyList()
+    task = ForcedMeasurementTask(refSchema, algMetadata=algMetadata, config=config.forcedMeasurement)
+
+    return pipeBase.Struct(task=task, algMetadata=algMetadata)
+
+
+def makeDetectionExposure(exposures, referenceIndex=0):
+    """Return the inverse-variance weighted mean of exposures, which must all cover the same pixels
+
+    The mask is the OR of the exposures' masks, and the variance is that of the weighted mean;  pixels
+    with no valid data in any band (BAD, or with a non-positive variance) have no weight, and are BAD in
+    the result if they're bad in every band.  The PSF, Wcs and metadata are those of
+    exposures[referenceIndex]
+    """
+    reference = exposures[referenceIndex]
+    bbox = reference.getBBox(afwImage.PARENT)
+    for exposure in exposures:
+        if exposure.getBBox(afwImage.PARENT) != bbox:
+            raise RuntimeError("Unable to combine exposures with different bounding boxes: %s and %s" %
+                               (bbox, exposure.getBBox(afwImage.PARENT)))
+
+    combined = reference.Factory(reference, True)
+    mi = combined.getMaskedImage()
+    image, mask, variance = mi.getImage().getArray(), mi.getMask().getArray(), mi.getVariance().getArray()
+    badBit = mi.getMask().getPlaneBitMask("BAD")
+
+    weightSum = np.zeros_like(variance)
+    image[:] = 0
+    mask[:] = 0
+    for exposure in exposures:
+        bandMi = exposure.getMaskedImage()
+        bandImage, bandMask = bandMi.getImage().getArray(), bandMi.getMask().getArray()
+        bandVariance = bandMi.getVariance().getArray()
+
+        good = np.logical_and(bandVariance > 0, (bandMask & badBit) == 0)
+        weight = np.zeros_like(bandVariance)
+        np.divide(1.0, bandVariance, out=weight, where=good)
+
+        image += np.where(good, weight*bandImage, 0)
+        weightSum += weight
+        mask |= bandMask
+
+    good = weightSum > 0
+    np.divide(image, weightSum, out=image, where=good)
+    image[~good] = 0
+    variance[:] = 0
+    np.divide(1.0, weightSum, out=variance, where=good)
+    mask[good] &= np.invert(mask.dtype.type(badBit))    # BAD only where no band is good
+
+    return combined
+
+
+def processMultiBand(config, tasks, forcedTask, inputFiles, weightFiles=None, varianceFiles=None,
+                     referenceIndex=0, verbose=False, timer=None, checkpointers=None):
+    """Process inputFiles (images of the same field in different bands), detecting and deblending once
+
+    tasks is as returned by makeTasks(config), and forcedTask by makeForcedTask(config, tasks.schema).
+    Each band is read and characterized separately (resuming from a checkpoint if checkpointers, a list
+    of a lsst.processFile.checkpoint.Checkpointer (or None) for each file, is provided).  The sources are
+    then detected, deblended and measured on inputFiles[referenceIndex] (or, if config.multiBandDetection
+    is "combined", on the weighted mean of all the bands; see makeDetectionExposure), and measured in
+    each band by forcedTask.  The PSF flags are propagated to the reference catalogue from the reference
+    band's calibSources.
+
+    Returns a Struct containing the detection exposure, the reference catalogue (refSources), and a list
+    of bands, each a Struct with the inputFile, exposure, calibSources and (forced) sources
+    """
+    from .processFile import _readAndCharacterize, propagatePsfFlags
+
+    if timer is None:
+        timer = noTimer
+    nBand = len(inputFiles)
+    if weightFiles is None:
+        weightFiles = [None]*nBand
+    if varianceFiles is None:
+        varianceFiles = [None]*nBand
+    if checkpointers is None:
+        checkpointers = [None]*nBand
+    #
+    # Read and characterize each band
+    #
+    bands = []
+    for inputFile, weightFile, varianceFile, checkpointer in zip(inputFiles, weightFiles, varianceFiles,
+                                                                 checkpointers):
+        if timer is not noTimer:
+            timer.inputFile = inputFile
+
+        saved = None
+        if checkpointer is not None:
+            with timer("restoreCheckpoint"):
+                saved = checkpointer.restore(stage="characterize")[1]
+        if saved is None:
+            exposure, calibSources = _readAndCharacterize(config, tasks, inputFile, weightFile, varianceFile,
+                                                          verbose, None, None, timer)
+            if checkpointer is not None and config.doCalibrate:
+                with timer("saveCheckpoint"):
+                    checkpointer.save("characterize", pipeBase.Struct(exposure=exposure,
+                                                                      calibSources=calibSources))
+        else:
+            exposure, calibSources = saved.exposure, saved.calibSources
+        del saved
+
+        bands.append(pipeBase.Struct(inputFile=inputFile, exposure=exposure, calibSources=calibSources,
+                                     sources=None))
+    #
+    # Detect, deblend and measure the reference catalogue
+    #
+    reference = bands[referenceIndex]
+    _setCommonWcs([band.exposure for band in bands], reference.exposure)
+
+    if timer is not noTimer:
+        timer.inputFile = reference.inputFile
+    if config.multiBandDetection == "combined":
+        with timer("combineBands") as stage:
+            detExposure = makeDetectionExposure([band.exposure for band in bands], referenceIndex)
+            stage["count"] = nBand
+    else:
+        detExposure = reference.exposure
+
+    tab = afwTable.SourceTable.make(tasks.schema)
+    with timer("detection") as stage:
+        refSources = tasks.sourceDetectionTask.run(tab, detExposure).sources
+        stage["count"] = len(refSources)
+
+    if config.doDeblend:
+        with timer("deblend") as stage:
+            nParent = len(refSources)
+            tasks.sourceDeblendTask.run(detExposure, refSources)
+            stage["count"] = len(refSources) - nParent
+
+    with timer("measurement") as stage:
+        measureSources(tasks.sourceMeasurementTask, detExposure, refSources, nJobs=config.measurementJobs,
+                       verbose=verbose)
+        stage["count"] = len(refSources)
+
+    if verbose:
+        print("Detected %d objects in %s" % (len(refSources), "the combined bands"
+                                             if config.multiBandDetection == "combined" else
+                                             reference.inputFile))
+
+    with timer("propagatePsfFlags") as stage:
+        propagatePsfFlags(tasks.keysToCopy, reference.calibSources, refSources)
+        stage["count"] = 0 if reference.calibSources is None else len(reference.calibSources)
+    #
+    # Measure each band at the positions (and with the footprints) of the reference catalogue
+    #
+    refWcs = detExposure.getWcs()
+    for band in bands:
+        if timer is not noTimer:
+            timer.inputFile = band.inputFile
+        with timer("forcedMeasurement") as stage:
+            band.sources = forcedTask.task.generateMeasCat(band.exposure, refSources, refWcs)
+            forcedTask.task.run(band.sources, band.exposure, refSources, refWcs)
+            stage["count"] = len(band.sources)
+
+    return pipeBase.Struct(exposure=detExposure, refSources=refSources, bands=bands)
+
+
+def _setCommonWcs(exposures, reference):
+    """Give exposures without a Wcs that of reference (or, if it has none, a trivial one)
+
+    Forced measurement transforms the reference footprints between the bands using their Wcs;
+    exposures read from files without a Wcs are assumed to be aligned pixel-for-pixel
+    """
+    wcs = reference.getWcs()
+    if wcs is None:
+        pixelScale = (1.0*afwGeom.arcseconds).asDegrees()
+        wcs = afwImage.makeWcs(afwCoord.IcrsCoord(0*afwGeom.degrees, 0*afwGeom.degrees),
+                               afwGeom.Point2D(0, 0), pixelScale, 0.0, 0.0, pixelScale)
+
+    for exposure in exposures:
+        if exposure.getWcs() is None:
+            exposure.setWcs(wcs)
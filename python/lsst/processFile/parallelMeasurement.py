@@ -0,0 +1,179 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Measure the sources in a single exposure in several processes at once
+
+The catalogue is split into chunks of whole families (a parent and its deblended children), balanced
+by their number of pixels, and each chunk is measured by a child process forked for the purpose.  The
+children see the parent's exposure and catalogue in (copy-on-write) shared memory, so the pixels
+aren't copied;  only the pages touched when replacing the sources with noise are duplicated.  Each
+child replaces every source in the catalogue with the same noise as the serial code would (the noise
+depends only on the footprints and the noise config), so the results are identical to measuring
+serially.  The measured chunks are passed back as FITS catalogues (without footprints), and their
+fields are copied into the parent's records by ID
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+import lsst.afw.table as afwTable
+
+__all__ = ["measureSources", "makeFamilyChunks"]
+
+
+def measureSources(task, exposure, sources, nJobs=1, verbose=False):
+    """Measure sources in exposure with task (a SingleFrameMeasurementTask), using up to nJobs processes
+
+    If nJobs <= 1, there are too few families of sources, or os.fork isn't available, this is simply
+    task.measure(exposure, sources)
+    """
+    chunks = makeFamilyChunks(sources, nJobs) if nJobs > 1 and hasattr(os, "fork") else []
+    if len(chunks) <= 1:
+        task.measure(exposure, sources)
+        return
+
+    if verbose:
+        print("Measuring %d sources in %d processes" % (len(sources), len(chunks)))
+
+    tmpDir = tempfile.mkdtemp(prefix="processFile-measure-")
+    try:
+        children = []
+        sys.stdout.flush()              # or the children will print our buffered output too
+        sys.stderr.flush()
+        for i, chunk in enumerate(chunks):
+            fileName = os.path.join(tmpDir, "chunk-%d.fits" % i)
+            pid = os.fork()
+            if pid == 0:                # the child
+                status = 0
+                try:
+                    _measureChunk(task, exposure, sources, chunk, fileName)
+                except Exception:
+                    with open(fileName + ".err", "w") as fd:
+                        fd.write(traceback.format_exc())
+                    status = 1
+                finally:
+                    os._exit(status)    # don't run the parent's atexit handlers or flush its buffers
+
+            children.append((pid, fileName))
+
+        errors = []
+        for pid, fileName in children:
+            status = os.waitpid(pid, 0)[1]
+            if status != 0:
+                errorFile = fileName + ".err"
+                errors.append(open(errorFile).read() if os.path.exists(errorFile) else
+                              "the measurement process exited with status %d" % status)
+        if errors:
+            raise RuntimeError("Failed to measure sources in parallel:\n%s" % "\n".join(errors))
+
+        records = dict((record.getId(), record) for record in sources)
+        for pid, fileName in children:
+            measuredCat = afwTable.SourceCatalog.readFits(fileName)
+            mapper = _makeMapperByName(measuredCat.getSchema(), sources.getSchema())
+            for measured in measuredCat:
+                records[measured.getId()].assign(measured, mapper)
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+
+def makeFamilyChunks(sources, nChunk):
+    """Split sources into up to nChunk lists of families, balanced by their number of pixels
+
+    Each family is a (parent, [children]) tuple of records;  the families in each chunk are in the
+    order of the catalogue
+    """
+    families, children = [], {}
+    for record in sources:
+        if record.getParent() == 0:
+            families.append((record, []))
+        else:
+            children.setdefault(record.getParent(), []).append(record)
+    families = [(parent, children.get(parent.getId(), [])) for parent, _ in families]
+
+    nChunk = min(nChunk, len(families))
+    if nChunk <= 0:
+        return []
+
+    def cost(family):
+        return sum(record.getFootprint().getArea() for record in [family[0]] + family[1])
+
+    chunks = [[] for i in range(nChunk)]
+    load = [0]*nChunk
+    order = sorted(range(len(families)), key=lambda i: -cost(families[i]))
+    for i in order:                     # largest first, each to the least loaded chunk
+        j = load.index(min(load))
+        chunks[j].append(i)
+        load[j] += cost(families[i])
+
+    return [[families[i] for i in sorted(chunk)] for chunk in chunks if chunk]
+
+
+def _makeMapperByName(inputSchema, outputSchema):
+    """Return a SchemaMapper that copies each field of inputSchema to the field of outputSchema of that name
+
+    (reading a catalogue back from FITS may change the order of its fields)
+    """
+    mapper = afwTable.SchemaMapper(inputSchema, outputSchema)
+    for item in inputSchema:
+        mapper.addMapping(item.getKey(), outputSchema.find(item.getField().getName()).getKey())
+
+    return mapper
+
+
+def _measureChunk(task, exposure, sources, chunk, fileName):
+    """Measure the families in chunk, following SingleFrameMeasurementTask.run, and write them to fileName
+
+    Every source in sources is replaced by noise, so each is measured exactly as it is serially
+    """
+    from lsst.meas.base.noiseReplacer import NoiseReplacer, DummyNoiseReplacer
+
+    footprints = dict((record.getId(), (record.getParent(), record.getFootprint())) for record in sources)
+    if task.config.doReplaceWithNoise:
+        noiseReplacer = NoiseReplacer(task.config.noiseReplacer, exposure, footprints, log=task.log)
+    else:
+        noiseReplacer = DummyNoiseReplacer()
+
+    measured = afwTable.SourceCatalog(sources.getTable())
+    for parent, children in chunk:
+        childCat = afwTable.SourceCatalog(sources.getTable())
+        for child in children:
+            childCat.append(child)
+            noiseReplacer.insertSource(child.getId())
+            task.callMeasure(child, exposure)
+            noiseReplacer.removeSource(child.getId())
+
+        parentCat = afwTable.SourceCatalog(sources.getTable())
+        parentCat.append(parent)
+        noiseReplacer.insertSource(parent.getId())
+        task.callMeasure(parent, exposure)
+        task.callMeasureN(parentCat, exposure)
+        task.callMeasureN(childCat, exposure)
+        noiseReplacer.removeSource(parent.getId())
+
+        measured.extend(parentCat)
+        measured.extend(childCat)
+    noiseReplacer.end()
+
+    measured.writeFits(fileName, flags=afwTable.SOURCE_IO_NO_FOOTPRINTS)
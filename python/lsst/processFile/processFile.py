@@ -0,0 +1,1380 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Process a single file (or a set of files), detecting and measuring sources
+
+This module contains the processing used by bin/processFile.py.  It imports the tasks it needs
+but not the deblender or afw.display, which are only imported if they are actually used
+"""
+from __future__ import absolute_import, division, print_function
+
+import itertools
+import os
+import sys
+import traceback
+import numpy as np
+
+import lsst.daf.base               as dafBase
+import lsst.afw.geom               as afwGeom
+import lsst.afw.image              as afwImage
+import lsst.afw.table              as afwTable
+import lsst.pipe.base              as pipeBase
+
+from lsst.ip.isr import IsrTask
+from lsst.pipe.tasks.characterizeImage import CharacterizeImageTask
+from lsst.meas.algorithms.detection import SourceDetectionTask
+from lsst.meas.base import SingleFrameMeasurementTask
+
+from .processFileConfig import ProcessFileConfig
+from .metrics import noTimer
+from .asyncWriter import AsyncWriter
+from .checkpoint import Checkpointer, makeDetectionProducts, restoreSources
+from .budget import Budget, deblendLimits, trimmedPlugins, getFallbacks
+from .parallelMeasurement import measureSources
+from .psfSeed import PsfSeeder, characterizeFromSeed, copyPsfSeedMetadata
+
+__all__ = ["ProcessFileConfig", "FileProcessor", "makeTasks", "processOneFile", "processExposure",
+           "processTiledFile", "iterRun", "run",
+           "iterRunMultiBand", "writeOutputs", "serve", "processShard", "getVersion", "capJobs",
+           "readImageBBox", "makeExposure", "interpolateDefects", "propagatePsfFlags", "displaySources"]
+
+def makeTasks(config):
+    """Create the schema and the tasks needed to process data with the specified config
+
+    Returns a Struct containing the schema, algMetadata, the tasks, and the keys used to propagate
+    PSF flags from the calibSources to the sources
+    """
+    schema = afwTable.SourceTable.makeMinimalSchema()
+    algMetadata = dafBase.PropertyList()
+
+    isrTask = IsrTask(config=config.isr) if config.interpPlanes else None
+    charImageTask =         CharacterizeImageTask(None, config=config.charImage)
+    sourceDetectionTask =   SourceDetectionTask(config=config.detection, schema=schema)
+    sourceDeblendTask = None
+    if config.doDeblend:
+        try:
+            from lsst.meas.deblender import SourceDeblendTask
+        except ImportError:
+            print("Failed to import lsst.meas.deblender;  setting doDeblend = False", file=sys.stderr)
+            config.doDeblend = False
+        else:
+            sourceDeblendTask = SourceDeblendTask(config=config.deblend, schema=schema)
+    sourceMeasurementTask = SingleFrameMeasurementTask(schema=schema, config=config.measurement,
+                                                       algMetadata=algMetadata)
+
+    keysToCopy = []
+    for key in [charImageTask.measurePsf.reservedKey,
+                charImageTask.measurePsf.usedKey,]:
+        keysToCopy.append((schema.addField(charImageTask.schema.find(key).field), key))
+
+    return pipeBase.Struct(
+        schema = schema,
+        algMetadata = algMetadata,
+        isrTask = isrTask,
+        charImageTask = charImageTask,
+        sourceDetectionTask = sourceDetectionTask,
+        sourceDeblendTask = sourceDeblendTask,
+        sourceMeasurementTask = sourceMeasurementTask,
+        keysToCopy = keysToCopy,
+    )
+
+def processOneFile(config, tasks, inputFile, weightFile=None, varianceFile=None, verbose=False,
+                   bbox=None, psf=None, timer=None, checkpointer=None, seed=None):
+    """Read and process a single file using the tasks returned by makeTasks()
+
+    If bbox is specified only that part of the file is read.  If psf is specified it's used
+    instead of characterizing the exposure.  If timer (e.g. a lsst.processFile.metrics.StageTimer)
+    is specified, each stage of the processing is run within a "with timer(stageName)" block
+
+    If checkpointer (a lsst.processFile.checkpoint.Checkpointer for inputFile) is specified, the
+    processing resumes after the latest checkpoint available (e.g. after detection, if only the
+    deblender or measurement config has changed), and saves the checkpoints that it passes.  The
+    checkpointer is ignored if bbox or psf is specified
+
+    If config.budget sets a wall time or memory budget (and bbox and psf aren't specified), cheaper
+    processing is used for the stages that would exceed it, and the fallbacks are recorded in the
+    metadata of the sources and exposure (see lsst.processFile.budget)
+
+    If seed (as returned by lsst.processFile.psfSeed.PsfSeeder.getSeed) is specified, characterization
+    starts from its PSF (see lsst.processFile.psfSeed)
+
+    Returns a Struct with the processed exposure, calibSources (None unless config.doCalibrate and
+    psf is None), sources, and fallbacks (the names of the budget fallbacks that were used)
+    """
+    if timer is None:
+        timer = noTimer
+    budget = None
+    if bbox is not None or psf is not None:
+        checkpointer = None
+    else:
+        budget = Budget(config.budget)
+
+    checkpoint, saved = None, None
+    if checkpointer is not None:
+        with timer("restoreCheckpoint"):
+            checkpoint, saved = checkpointer.restore()
+
+    if checkpoint is None:
+        exposure, calibSources = _readAndCharacterize(config, tasks, inputFile, weightFile, varianceFile,
+                                                      verbose, bbox, psf, timer, budget=budget, seed=seed)
+        if checkpointer is not None and calibSources is not None:
+            with timer("saveCheckpoint"):
+                checkpointer.save("characterize", pipeBase.Struct(exposure=exposure,
+                                                                  calibSources=calibSources))
+    else:
+        exposure, calibSources = saved.exposure, saved.calibSources
+
+    savedSources = saved.sources if checkpoint == "detection" else None
+    del saved
+
+    return _detectAndMeasure(config, tasks, exposure, calibSources, verbose, timer, budget=budget,
+                             checkpointer=checkpointer, savedSources=savedSources)
+
+def processExposure(config, tasks, exposure, verbose=False, timer=None, seed=None):
+    """Process an exposure that's already in memory using the tasks returned by makeTasks()
+
+    The exposure should have its mask and variance planes set (e.g. by makeExposure).  Its defects
+    are interpolated over and it's characterized (starting from seed, if provided) as in processOneFile,
+    which modifies it.
+
+    Returns a Struct as for processOneFile
+    """
+    if timer is None:
+        timer = noTimer
+    budget = Budget(config.budget)
+
+    exposure, calibSources = _characterize(config, tasks, exposure, None, verbose, timer, budget=budget,
+                                           seed=seed)
+    return _detectAndMeasure(config, tasks, exposure, calibSources, verbose, timer, budget=budget)
+
+def _detectAndMeasure(config, tasks, exposure, calibSources, verbose, timer, budget=None, checkpointer=None,
+                      savedSources=None):
+    """Detect, deblend and measure the sources in a characterized exposure
+
+    If savedSources (the sources saved in a detection checkpoint) is provided, they're used rather
+    than detecting the sources again;  otherwise the detection checkpoint is saved with checkpointer
+    (if not None).  Returns the Struct described in processOneFile
+    """
+    #
+    # Create the output table
+    #
+    tab = afwTable.SourceTable.make(tasks.schema)
+
+    if savedSources is not None:
+        sources = restoreSources(savedSources, tab)
+    else:
+        with timer("detection") as stage:
+            result = tasks.sourceDetectionTask.run(tab, exposure)
+            stage["count"] = len(result.sources)
+        sources = result.sources
+
+        # The detection checkpoint is applied to the characterize checkpoint, which is only saved if
+        # we characterized the exposure (and didn't fall back to a simple PSF)
+        if checkpointer is not None and calibSources is not None and not (budget and budget.fallbacks):
+            products = makeDetectionProducts(result, config.detection)
+            if products is not None:
+                with timer("saveCheckpoint"):
+                    checkpointer.save("detection", products)
+    del savedSources
+
+    if config.doDeblend:
+        with timer("deblend") as stage:
+            nParent = len(sources)
+            if budget and budget.fallBack("deblendLimits", config.budget.deblendFraction,
+                                          extraMemory=lambda: budget.estimateDeblendMemory(sources),
+                                          verbose=verbose):
+                with deblendLimits(tasks.sourceDeblendTask, config.budget):
+                    tasks.sourceDeblendTask.run(exposure, sources)
+            else:
+                tasks.sourceDeblendTask.run(exposure, sources)
+            stage["count"] = len(sources) - nParent    # the number of children
+
+    with timer("measurement") as stage:
+        if budget and budget.fallBack("trimmedMeasurement", config.budget.measurementFraction,
+                                      verbose=verbose):
+            with trimmedPlugins(tasks.sourceMeasurementTask, config.budget.measurementPlugins):
+                measureSources(tasks.sourceMeasurementTask, exposure, sources,
+                               nJobs=config.measurementJobs, verbose=verbose)
+        else:
+            measureSources(tasks.sourceMeasurementTask, exposure, sources, nJobs=config.measurementJobs,
+                           verbose=verbose)
+        stage["count"] = len(sources)
+
+    if verbose:
+        print("Detected %d objects" % len(sources))
+
+    with timer("propagatePsfFlags") as stage:
+        propagatePsfFlags(tasks.keysToCopy, calibSources, sources)
+        stage["count"] = 0 if calibSources is None else len(calibSources)
+
+    fallbacks = []
+    if budget and budget.isLimited():
+        if sources.getTable().getMetadata() is None:
+            sources.getTable().setMetadata(dafBase.PropertyList())
+        budget.setMetadata(sources.getTable().getMetadata())
+        budget.setMetadata(exposure.getMetadata())
+        fallbacks = budget.fallbacks
+    copyPsfSeedMetadata(exposure, sources)
+
+    return pipeBase.Struct(exposure=exposure, calibSources=calibSources, sources=sources, fallbacks=fallbacks)
+
+def _readAndCharacterize(config, tasks, inputFile, weightFile, varianceFile, verbose, bbox, psf, timer,
+                         budget=None, seed=None):
+    """Read inputFile, interpolate over its defects, and characterize it (or install psf)
+
+    Returns the exposure and calibSources (which may be None);  see processOneFile and _characterize
+    for the arguments
+    """
+    #
+    # read the data
+    #
+    if verbose:
+        print("Reading %s" % inputFile)
+
+    prepStats = {}
+    with timer("makeExposure") as stage:
+        exposure = makeExposure(inputFile, weightFile, varianceFile,
+                                config.badPixelValue, config.variance, bbox=bbox,
+                                chunkRows=config.pixelChunkRows, stats=prepStats,
+                                varianceEstimator=config.varianceEstimator,
+                                varianceSamplePixels=config.varianceSamplePixels)
+        stage["count"] = exposure.getWidth()*exposure.getHeight()
+    if verbose:
+        print("Preparing the pixels needed %.1f MB of temporaries (%.1f MB if done all at once)" %
+              (prepStats["tempBytes"]/1024.0**2, prepStats["fullFrameTempBytes"]/1024.0**2))
+        if "variance" in prepStats:
+            print("Estimated the variance (%s) as %g +- %g" %
+                  (config.varianceEstimator, prepStats["variance"], prepStats["varianceError"]))
+
+    return _characterize(config, tasks, exposure, psf, verbose, timer, budget=budget, seed=seed)
+
+def _characterize(config, tasks, exposure, psf, verbose, timer, budget=None, seed=None):
+    """Interpolate over the defects in exposure, and characterize it (or install psf)
+
+    If budget (a lsst.processFile.budget.Budget) is running out, a simple PSF is installed rather than
+    characterizing the exposure.  If seed is provided, characterization starts from its PSF (see
+    lsst.processFile.psfSeed).  Returns the exposure and calibSources (which may be None)
+    """
+    with timer("interpolateDefects"):
+        interpolateDefects(config, tasks, exposure)
+
+    if psf is None and config.doCalibrate and budget is not None:
+        doCharacterize = not budget.fallBack("simplePsf", config.budget.characterizeFraction, verbose=verbose)
+    else:
+        doCharacterize = config.doCalibrate
+
+    if psf is not None:
+        calibSources = None
+        exposure.setPsf(psf)
+    elif doCharacterize:
+        with timer("characterize") as stage:
+            if seed is not None:
+                result = characterizeFromSeed(tasks.charImageTask, exposure, seed, config.psfSeed,
+                                              verbose=verbose)
+            else:
+                result = tasks.charImageTask.characterize(exposure)
+                if config.psfSeed.source != "none":         # e.g. the first file with source == "previous"
+                    result.exposure.getMetadata().set("PSF_SEED", "none")
+            stage["count"] = len(result.sourceCat)
+        exposure, calibSources = result.exposure, result.sourceCat
+    else:
+        calibSources = None
+        if not exposure.getPsf():
+            tasks.charImageTask.installSimplePsf.run(exposure)
+
+    return exposure, calibSources
+
+def interpolateDefects(config, tasks, exposure):
+    """Interpolate over the pixels in exposure with any of the mask bits in config.interpPlanes set
+
+    using config.interpEngine (see lsst.processFile.defectInterpolation)
+    """
+    if config.interpPlanes and config.interpEngine == "vectorized":
+        from .defectInterpolation import interpolateFromMask
+        interpolateFromMask(exposure.getMaskedImage(), config.interpPlanes, chunkRows=config.pixelChunkRows)
+    elif config.interpPlanes:
+        import lsst.ip.isr as ipIsr
+        defects = ipIsr.getDefectListFromMask(exposure.getMaskedImage(), config.interpPlanes,
+                                              growFootprints=0)
+
+        tasks.isrTask.run(exposure, defects=defects)
+
+def processTiledFile(config, tasks, inputFile, weightFile=None, varianceFile=None, verbose=False,
+                     pool=None, outputDir=None, timer=None):
+    """Process inputFile in overlapping tiles of up to config.tileSize pixels on a side
+
+    Each tile is read separately (so the whole image is never in memory), and is detected, deblended
+    and measured independently.  If config.tilePsf is "single" the central tile is characterized and
+    its PSF used for all the tiles;  otherwise each tile is characterized separately.  The tiles'
+    catalogues are merged, keeping each family of sources from the tile that owns its parent
+    (see lsst.processFile.tiling)
+
+    If pool is provided (see _runTiled) the tiles are processed in its workers, using outputDir for
+    temporary files.  If timer is provided the stages of processing each tile are recorded in it
+
+    Returns a Struct with the merged calibSources and sources;  the exposure is None
+    """
+    from .tiling import makeTiles, findCentralTile, selectOwnedSources, mergeTileCatalogs
+
+    if timer is None:
+        timer = noTimer
+
+    bbox = readImageBBox(inputFile)
+    if bbox is None:
+        raise RuntimeError("Unable to read the dimensions of %s" % inputFile)
+    tiles = makeTiles(bbox, config.tileSize, config.tileOverlap)
+
+    if verbose:
+        print("Processing %s in %d tiles" % (inputFile, len(tiles)))
+    #
+    # Characterize the central tile if we're using a single PSF for the entire image
+    #
+    psf, calibSources = None, None
+    if config.tilePsf == "single":
+        with timer("makeExposure") as stage:
+            exposure = makeExposure(inputFile, weightFile, varianceFile, config.badPixelValue,
+                                    config.variance, bbox=findCentralTile(tiles, bbox).bbox,
+                                    chunkRows=config.pixelChunkRows,
+                                    varianceEstimator=config.varianceEstimator,
+                                    varianceSamplePixels=config.varianceSamplePixels)
+            stage["count"] = exposure.getWidth()*exposure.getHeight()
+        with timer("interpolateDefects"):
+            interpolateDefects(config, tasks, exposure)
+
+        if config.doCalibrate:
+            with timer("characterize") as stage:
+                result = tasks.charImageTask.characterize(exposure)
+                stage["count"] = len(result.sourceCat)
+            exposure, calibSources = result.exposure, result.sourceCat
+        elif not exposure.getPsf():
+            tasks.charImageTask.installSimplePsf.run(exposure)
+        psf = exposure.getPsf()
+        del exposure
+    #
+    # Process the tiles
+    #
+    tileSources, tileCalibSources = [], []
+    if pool is None:
+        for tile in tiles:
+            result = processOneFile(config, tasks, inputFile, weightFile, varianceFile, verbose=verbose,
+                                    bbox=tile.bbox, psf=psf, timer=timer)
+            tileSources.append(selectOwnedSources(result.sources, tile.ownedBBox))
+            if result.calibSources is not None:
+                tileCalibSources.append(selectOwnedSources(result.calibSources, tile.ownedBBox))
+            del result
+    else:
+        prefix = os.path.join(outputDir, "%08x" % abs(hash(inputFile)))
+        psfFile = None
+        if psf is not None:
+            psfFile = prefix + ".psf.fits"
+            _writePsf(psf, psfFile)
+
+        workArgs = [("%s-%d" % (prefix, i), inputFile, weightFile, varianceFile,
+                     _boxToTuple(tile.bbox), _boxToTuple(tile.ownedBBox), psfFile)
+                    for i, tile in enumerate(tiles)]
+        for fileNames, stages in pool.imap(_processTileInWorker, workArgs):
+            if timer is not noTimer:
+                timer.stages += stages
+            tileSources.append(afwTable.SourceCatalog.readFits(fileNames["sources"]))
+            if fileNames["calibSources"]:
+                tileCalibSources.append(afwTable.SourceCatalog.readFits(fileNames["calibSources"]))
+
+            for fileName in fileNames.values():
+                if fileName:
+                    os.remove(fileName)
+
+        if psfFile:
+            os.remove(psfFile)
+    #
+    # Merge the tiles' catalogues
+    #
+    with timer("mergeTiles") as stage:
+        sources = mergeTileCatalogs(tileSources, tasks.schema)
+        if tileCalibSources:
+            calibSources = mergeTileCatalogs(tileCalibSources, tileCalibSources[0].getSchema())
+        stage["count"] = len(sources)
+    if not tileCalibSources and calibSources is not None:
+        with timer("propagatePsfFlags") as stage:
+            propagatePsfFlags(tasks.keysToCopy, calibSources, sources)
+            stage["count"] = len(calibSources)
+
+    if verbose:
+        print("Detected %d objects in %d tiles" % (len(sources), len(tiles)))
+
+    return pipeBase.Struct(exposure=None, calibSources=calibSources, sources=sources)
+
+def getApertureRadii(algMetadata):
+    """Return the radii used by base_CircularApertureFlux, as recorded in algMetadata"""
+    if algMetadata.exists("base_CircularApertureFlux_radii"):
+        return algMetadata.get("base_CircularApertureFlux_radii")
+    else:
+        return []
+
+def displaySources(exposure, sources, title, radii, displayResults):
+    """Display an exposure and overlay its sources, as specified by the --display options
+
+    The overlays are built from the catalogue's columns and sent to ds9 as a single set of regions;
+    other display backends are sent the equivalent dot() calls in a single buffered batch
+    """
+    import lsst.afw.display as afwDisplay
+    from .regions import makeOverlays, formatRegions
+
+    overlayNames = ["centroid"]
+    if "showPSFs".upper() in displayResults:
+        overlayNames.append("psf")
+    if "showShapes".upper() in displayResults:
+        overlayNames.append("shape")
+    if "showApertures".upper() in displayResults:
+        overlayNames.append("aperture")
+
+    display = afwDisplay.getDisplay(frame=1)
+
+    display.mtv(exposure, title=title)
+
+    overlays = makeOverlays(sources, radii, overlayNames)
+    if _loadRegions(display, formatRegions(overlays, exposure.getXY0())):
+        return
+
+    with display.Buffering():
+        for overlay in overlays:
+            if overlay.shape == "point":
+                for x, y, ctype in zip(overlay.x, overlay.y, overlay.color):
+                    display.dot('+', x, y, ctype=ctype)
+            elif overlay.shape == "circle":
+                for x, y, size, ctype in zip(overlay.x, overlay.y, overlay.size, overlay.color):
+                    display.dot('o', x, y, size=size, ctype=ctype)
+            elif overlay.shape == "ellipse":
+                for x, y, a, b, theta, ctype in zip(overlay.x, overlay.y, overlay.a, overlay.b,
+                                                    overlay.theta, overlay.color):
+                    display.dot(afwGeom.ellipses.Axes(a, b, np.radians(theta)), x, y, ctype=ctype)
+
+def _loadRegions(display, regions):
+    """Load regions (lines of a DS9 region file) into display with a single command
+
+    Returns False if display isn't using the ds9 backend
+    """
+    import tempfile
+
+    impl = getattr(display, "_impl", None)
+    if not type(impl).__module__.startswith("lsst.display.ds9"):
+        return False
+
+    import lsst.display.ds9 as ds9
+
+    fd, fileName = tempfile.mkstemp(suffix=".reg", prefix="processFile-")
+    try:
+        with os.fdopen(fd, "w") as fileObj:
+            fileObj.write("\n".join(regions) + "\n")
+        ds9.ds9Cmd("regions load %s" % fileName, frame=display.frame)
+    finally:
+        os.remove(fileName)
+
+    return True
+
+class FileProcessor(object):
+    """Process files (or exposures already in memory) in this process, creating the tasks only once
+
+    Use as e.g.
+        processor = FileProcessor(config)
+        for inputFile in inputFiles:
+            result = processor.process(inputFile)
+
+    Each call to process returns a Struct with the inputFile (None for an exposure), exposure,
+    calibSources, sources, the radii of the apertures measured, and error (None, or the traceback if
+    continueOnError is True and the processing failed).  If config.tileSize > 0 files are processed
+    in tiles (and the exposure is None).  The timer and checkpointCache are as for iterRun
+    """
+
+    def __init__(self, config=None, verbose=False, timer=None, checkpointCache=None):
+        self.config = ProcessFileConfig() if config is None else config
+        self.verbose = verbose
+        self.timer = timer
+        self.checkpointCache = checkpointCache
+
+        self.tasks = makeTasks(self.config)
+        self.schema = self.tasks.schema
+        self.radii = getApertureRadii(self.tasks.algMetadata)
+        self.psfSeeder = PsfSeeder(self.config.psfSeed)
+
+    def process(self, exposureOrPath, weightFile=None, varianceFile=None, continueOnError=False):
+        """Process exposureOrPath, the name of a file (with optional weight or variance files) or an Exposure
+
+        An Exposure is modified by the processing (see processExposure)
+        """
+        inputFile = None if hasattr(exposureOrPath, "getMaskedImage") else exposureOrPath
+        if self.timer is not None:
+            self.timer.inputFile = inputFile
+
+        try:
+            if inputFile is None:
+                result = processExposure(self.config, self.tasks, exposureOrPath, verbose=self.verbose,
+                                         timer=self.timer, seed=self.psfSeeder.getSeed())
+            elif self.config.tileSize > 0:
+                result = processTiledFile(self.config, self.tasks, inputFile, weightFile, varianceFile,
+                                          verbose=self.verbose, timer=self.timer)
+            else:
+                checkpointer = _makeCheckpointer(self.checkpointCache, self.config, inputFile, weightFile,
+                                                 varianceFile, self.verbose)
+                result = processOneFile(self.config, self.tasks, inputFile, weightFile, varianceFile,
+                                        verbose=self.verbose, timer=self.timer, checkpointer=checkpointer,
+                                        seed=self.psfSeeder.getSeed())
+        except Exception:
+            if not continueOnError:
+                raise
+            result = _makeFailedResult(inputFile or "exposure", traceback.format_exc())
+        else:
+            result.radii, result.error = self.radii, None
+            self.psfSeeder.update(result.exposure, inputFile)
+        result.inputFile = inputFile
+
+        return result
+
+def iterRun(config, inputFiles, weightFiles=None, varianceFiles=None,
+            returnCalibSources=False, displayResults=[], verbose=False, jobs=1, cache=None, timer=None,
+            checkpoints=False, continueOnError=False):
+    """Process inputFiles, yielding a Struct for each file as soon as it has been processed
+
+    Each Struct contains the inputFile, its index in inputFiles, the exposure, calibSources
+    (None unless returnCalibSources is True) and sources, the radii of the apertures measured,
+    and error (None).  The caller may write the results and drop them before asking for the next file,
+    so only one exposure need be held in memory at a time.
+
+    If continueOnError is True, a file that can't be processed yields a Struct whose error is the
+    traceback (and whose exposure and catalogues are None) rather than raising an exception
+
+    If jobs > 1 the files are processed in up to jobs worker processes (but no more than
+    the available memory permits; see capJobs).  The results are yielded in the order of inputFiles
+
+    If config.tileSize > 0 each file is processed in tiles (see processTiledFile), and jobs is the
+    number of tiles to process in parallel.  In this case the exposures are None
+
+    If cache (a lsst.processFile.resultCache.ResultCache) is provided, files that have already been
+    processed with the same config are read from the cache, and newly processed files are added to it
+    (by a forked process, see lsst.processFile.asyncWriter, so that writing each entry overlaps
+    processing the next file;  the time taken is recorded as writeCache).
+    If checkpoints is also True, the intermediate products of processing each file are saved in the
+    cache, so that a rerun with e.g. only a different measurement config needn't repeat characterization
+    and detection (see processOneFile);  this costs about one more exposure per file in the cache
+
+    If timer (a lsst.processFile.metrics.StageTimer) is provided, the stages of processing each file
+    are recorded in it (including those run in worker processes)
+    """
+    if weightFiles is None:
+        weightFiles = [None]*len(inputFiles)
+    if varianceFiles is None:
+        varianceFiles = [None]*len(inputFiles)
+
+    if cache is None:
+        keys = [None]*len(inputFiles)
+        toProcess = list(range(len(inputFiles)))
+    else:
+        version = getVersion()
+        keys = [cache.makeKey(config, version, *files) for files in
+                zip(inputFiles, weightFiles, varianceFiles)]
+        toProcess = [i for i, key in enumerate(keys) if not cache.lookup(key)]
+    #
+    # Process the files that we didn't find in the cache (we need the calibSources to fill the cache)
+    #
+    results = _runPipeline(config, jobs, [inputFiles[i] for i in toProcess],
+                           [weightFiles[i] for i in toProcess], [varianceFiles[i] for i in toProcess],
+                           returnCalibSources or cache is not None, verbose, timer=timer,
+                           checkpointCache=cache if checkpoints else None, continueOnError=continueOnError)
+    toProcess = set(toProcess)
+
+    def putInCache(key, result):
+        with (timer or noTimer)("writeCache"):
+            cache.put(key, result, evict=False)     # we evict in this process, to count the evictions
+
+    def reportCacheError(inputFile, error):
+        print("Failed to add %s to the cache:\n%s" % (inputFile, error), file=sys.stderr)
+
+    cacheWriter = AsyncWriter(maxPending=1, timer=timer, onError=reportCacheError)
+    processor = None                    # processes the files evicted from the cache since we looked them up
+    try:
+        for i, inputFile in enumerate(inputFiles):
+            result = None
+            if i not in toProcess:
+                result = cache.get(keys[i])
+                if result is not None:
+                    result.error = None
+                    if verbose:
+                        print("Read the results of processing %s from the cache" % inputFile)
+
+            if result is None:
+                if i in toProcess:
+                    result = next(results)[1]
+                else:
+                    if processor is None:
+                        processor = FileProcessor(config, verbose=verbose, timer=timer,
+                                                  checkpointCache=cache if checkpoints else None)
+                    result = processor.process(inputFile, weightFiles[i], varianceFiles[i],
+                                               continueOnError=continueOnError)
+
+                if cache is not None and result.error is None and \
+                   not getFallbacks(result.sources.getTable().getMetadata()):  # depends on the machine's load
+                    cache.evict()
+                    cacheWriter.submit(lambda key=keys[i], result=result: putInCache(key, result), [],
+                                       inputFile)
+
+            if displayResults and result.exposure is not None: # display results (see also --debug option)
+                displaySources(result.exposure, result.sources, os.path.split(inputFile)[1],
+                               result.radii, displayResults)
+
+            yield pipeBase.Struct(inputFile=inputFile, index=i, exposure=result.exposure,
+                                  calibSources=result.calibSources if returnCalibSources else None,
+                                  sources=result.sources, radii=result.radii, error=result.error)
+            del result
+    finally:
+        cacheWriter.close()             # wait for the last entries to be written
+
+    if cache is not None:
+        cache.evict()
+        if verbose:
+            print(cache.report())
+
+def run(config, inputFiles, weightFiles=None, varianceFiles=None,
+        returnCalibSources=False, displayResults=[], verbose=False, jobs=1, cache=None, timer=None,
+        checkpoints=False):
+    """Process inputFiles, returning dicts of exposures, calibSources, and sources keyed by inputFile
+
+    All the outputs are held in memory until every file has been processed;  see iterRun
+    for a version that returns each file's outputs as soon as they are available
+    """
+    exposureDict = {}; calibSourcesDict = {}; sourcesDict = {}
+
+    for result in iterRun(config, inputFiles, weightFiles=weightFiles, varianceFiles=varianceFiles,
+                          returnCalibSources=returnCalibSources, displayResults=displayResults,
+                          verbose=verbose, jobs=jobs, cache=cache, timer=timer, checkpoints=checkpoints):
+        exposureDict[result.inputFile] = result.exposure
+        calibSourcesDict[result.inputFile] = result.calibSources
+        sourcesDict[result.inputFile] = result.sources
+
+    return exposureDict, calibSourcesDict, sourcesDict
+
+def iterRunMultiBand(config, inputFiles, weightFiles=None, varianceFiles=None, referenceIndex=0,
+                     returnCalibSources=False, displayResults=[], verbose=False, cache=None, timer=None,
+                     checkpoints=False):
+    """Process inputFiles, images of the same field in different bands, detecting and deblending once
+
+    The sources are detected on inputFiles[referenceIndex] (or on a combination of all the bands,
+    if config.multiBandDetection is "combined") and measured in every band by forced photometry
+    (see lsst.processFile.multiBand.processMultiBand), so the catalogues of all the bands have
+    the same source IDs.
+
+    Yields a Struct for each file, as for iterRun, with the addition of refSources, the reference
+    catalogue (the same object for every band).  All the bands are held in memory at once, and are
+    processed in this process;  if cache and checkpoints are provided only the checkpoints after
+    characterization are used
+    """
+    from .multiBand import makeForcedTask, processMultiBand
+
+    if config.tileSize > 0:
+        raise RuntimeError("Multi-band processing is not supported with tileSize > 0")
+
+    if weightFiles is None:
+        weightFiles = [None]*len(inputFiles)
+    if varianceFiles is None:
+        varianceFiles = [None]*len(inputFiles)
+
+    tasks = makeTasks(config)
+    forcedTask = makeForcedTask(config, tasks.schema)
+    radii = getApertureRadii(forcedTask.algMetadata)
+
+    checkpointers = [_makeCheckpointer(cache if checkpoints else None, config, inputFile, weightFile,
+                                       varianceFile, verbose)
+                     for inputFile, weightFile, varianceFile in zip(inputFiles, weightFiles, varianceFiles)]
+
+    result = processMultiBand(config, tasks, forcedTask, inputFiles, weightFiles, varianceFiles,
+                              referenceIndex=referenceIndex, verbose=verbose, timer=timer,
+                              checkpointers=checkpointers)
+    refSources = result.refSources
+    bands = result.bands
+    del result
+
+    for i, inputFile in enumerate(inputFiles):
+        band = bands[i]
+        bands[i] = None                 # let the caller drop each band once it's been written
+
+        if displayResults:
+            displaySources(band.exposure, band.sources, os.path.split(inputFile)[1], radii, displayResults)
+
+        yield pipeBase.Struct(inputFile=inputFile, index=i, exposure=band.exposure,
+                              calibSources=band.calibSources if returnCalibSources else None,
+                              sources=band.sources, radii=radii, refSources=refSources, error=None)
+        del band
+def writeOutputs(result, version, outputCalexp=None, outputCalibCatalog=None, outputCatalog=None,
+                 outputRegions=None, timer=None, calexpPlanes="all", calexpQuantizeLevel=None, verbose=False):
+    """Write the exposure and catalogues in a Struct returned by iterRun to the specified files
+
+    The calexp contains the planes specified by calexpPlanes, and is tile-compressed if
+    calexpQuantizeLevel isn't None (see lsst.processFile.calexpOutput.writeCalexp);  if verbose, its
+    size, compression ratio and the time taken to write it are reported.
+
+    If outputRegions is specified, all the overlays that --display can show are written to it as a
+    DS9 region file (see lsst.processFile.regions)
+
+    If timer (a lsst.processFile.metrics.StageTimer) is provided, the time taken to write each file
+    is recorded in it, and its measurements of processing result.inputFile are added to the exposure's
+    metadata (as METRIC_DETECTION_WALL etc.)
+    """
+    if timer is None:
+        timer = noTimer
+    else:
+        timer.inputFile = result.inputFile
+
+    if result.exposure is None:
+        if outputCalexp:
+            print("No exposure is available for %s (was it processed in tiles?)" % outputCalexp,
+                  file=sys.stderr)
+    else:
+        metadata = result.exposure.getMetadata()
+        metadata.set("VERSION", version)
+        if timer is not noTimer:
+            timer.setMetadata(metadata, result.inputFile)
+
+        if outputCalexp:
+            from .calexpOutput import writeCalexp
+
+            with timer("writeCalexp"):
+                written = writeCalexp(result.exposure, outputCalexp, planes=calexpPlanes,
+                                      quantizeLevel=calexpQuantizeLevel)
+            if verbose:
+                print("Wrote %s: %.1f MB (compression ratio %.2f) in %.2fs" %
+                      (outputCalexp, written.nByte/1024.0**2, written.nByteUncompressed/written.nByte,
+                       written.wall))
+    if outputCalibCatalog:
+        with timer("writeCalibCatalog") as stage:
+            result.calibSources.writeFits(outputCalibCatalog)
+            stage["count"] = len(result.calibSources)
+    if outputCatalog:
+        with timer("writeCatalog") as stage:
+            result.sources.writeFits(outputCatalog)
+            stage["count"] = len(result.sources)
+    if outputRegions:
+        from .regions import makeOverlays, writeRegions
+
+        if result.exposure is not None:
+            xy0 = result.exposure.getXY0()
+        else:
+            bbox = readImageBBox(result.inputFile)
+            xy0 = (0, 0) if bbox is None else bbox.getMin()
+        writeRegions(outputRegions, makeOverlays(result.sources, result.radii), (xy0[0], xy0[1]))
+
+def serve(config, spoolDir=None, socketPath=None, verbose=False):
+    """Process files as they arrive in spoolDir or on the UNIX socket socketPath until interrupted
+
+    The tasks are created once;  each file's calexp and catalogues are written next to it
+    (see lsst.processFile.utils.makeOutputFileNames)
+    """
+    from .server import serve as serveFiles
+    from .utils import makeOutputFileNames
+
+    processor = FileProcessor(config, verbose=verbose)
+    version = getVersion()
+
+    def processFunc(inputFile):
+        outputs = makeOutputFileNames(inputFile)
+        result = processor.process(inputFile)
+        writeOutputs(result, version, outputCalexp=outputs["calexp"], outputCatalog=outputs["catalog"],
+                     outputCalibCatalog=outputs["calibCatalog"] if result.calibSources is not None else None)
+
+        return "%d sources" % len(result.sources)
+
+    return serveFiles(processFunc, spoolDir=spoolDir, socketPath=socketPath)
+
+def processShard(config, queueDir, timeout=600.0, verbose=False, timer=None, calexpPlanes="all",
+                 calexpQuantizeLevel=None):
+    """Process files from the shared work queue in queueDir until it's empty (see lsst.processFile.workQueue)
+
+    The tasks are created once;  each item is a line of a manifest, whose outputs are written where it
+    says (see lsst.processFile.manifest).  Items whose worker hasn't sent a heartbeat for timeout seconds
+    are returned to the queue.  Returns a Struct with the number of items processed (nDone) and
+    failed (nFailed)
+    """
+    from .manifest import parseManifestLine
+    from .workQueue import WorkQueue, runWorker
+
+    queue = WorkQueue(queueDir, timeout=timeout)
+    processor = FileProcessor(config, verbose=verbose, timer=timer)
+    version = getVersion()
+
+    def processFunc(line):
+        entry = parseManifestLine(line, queueDir)
+        if entry.error:
+            raise RuntimeError(entry.error)
+
+        result = processor.process(entry.inputFile, weightFile=entry.weightFile,
+                                   varianceFile=entry.varianceFile)
+        writeOutputs(result, version, timer=timer, calexpPlanes=calexpPlanes,
+                     calexpQuantizeLevel=calexpQuantizeLevel, verbose=verbose,
+                     outputCalexp=entry.outputs["calexp"], outputCatalog=entry.outputs["catalog"],
+                     outputCalibCatalog=(entry.outputs["calibCatalog"] if result.calibSources is not None
+                                         else None),
+                     outputRegions=entry.outputs["regions"])
+
+        return dict(nSource=len(result.sources))
+
+    return runWorker(queue, processFunc, verbose=verbose)
+
+def getVersion():
+    """Return the version of processFile, for recording in the outputs"""
+    try:
+        import lsst.processFile.version
+        return lsst.processFile.version.__version__
+    except ImportError:
+        print("Unable to deduce processFile's version -- did you run scons?", file=sys.stderr)
+        return "???"
+
+def _runPipeline(config, jobs, inputFiles, weightFiles, varianceFiles, returnCalibSources, verbose,
+                 timer=None, checkpointCache=None, continueOnError=False):
+    """Process the inputs in tiles, in a pool of workers, or serially, yielding (inputFile, result)
+
+    If checkpointCache (a ResultCache) is provided, checkpoints are saved in it (but not when tiling).
+    Each result's error is None, or (if continueOnError) the traceback of the failure to process it
+    """
+    if config.tileSize > 0:
+        return _runTiled(config, jobs, inputFiles, weightFiles, varianceFiles, returnCalibSources, verbose,
+                         timer=timer, continueOnError=continueOnError)
+
+    jobs = capJobs(jobs, inputFiles, verbose=verbose)
+    if jobs > 1:
+        return _runInPool(config, jobs, inputFiles, weightFiles, varianceFiles, returnCalibSources, verbose,
+                          timer=timer, checkpointCache=checkpointCache, continueOnError=continueOnError)
+    else:
+        return _runSerially(config, inputFiles, weightFiles, varianceFiles, verbose, timer=timer,
+                            checkpointCache=checkpointCache, continueOnError=continueOnError)
+
+def _makeFailedResult(inputFile, error):
+    """Return the result of failing to process inputFile, reporting error (a traceback)"""
+    print("Failed to process %s:\n%s" % (inputFile, error), file=sys.stderr)
+    return pipeBase.Struct(exposure=None, calibSources=None, sources=None, radii=[], error=error)
+
+def _runTiled(config, jobs, inputFiles, weightFiles, varianceFiles, returnCalibSources, verbose,
+              timer=None, continueOnError=False):
+    """Process each input in tiles using processTiledFile, yielding (inputFile, result)
+
+    If jobs > 1 the tiles are processed in a pool of worker processes, limited by the memory needed
+    to process a tile
+    """
+    tasks = makeTasks(config)
+    radii = getApertureRadii(tasks.algMetadata)
+
+    nPixel = (config.tileSize + 2*config.tileOverlap)**2
+    jobs = _capJobsForPixels(jobs, nPixel, verbose=verbose) if jobs > 1 else 1
+
+    pool, outputDir = None, None
+    if jobs > 1:
+        import multiprocessing
+        import tempfile
+
+        outputDir = tempfile.mkdtemp(prefix="processFile-")
+        pool = multiprocessing.Pool(jobs, initializer=_initWorker,
+                                    initargs=(config, outputDir, verbose, _getTimerArgs(timer)))
+    try:
+        for inputFile, weightFile, varianceFile in zip(inputFiles, weightFiles, varianceFiles):
+            if timer is not None:
+                timer.inputFile = inputFile
+            try:
+                result = processTiledFile(config, tasks, inputFile, weightFile, varianceFile, verbose=verbose,
+                                          pool=pool, outputDir=outputDir, timer=timer)
+            except Exception:
+                if not continueOnError:
+                    raise
+                result = _makeFailedResult(inputFile, traceback.format_exc())
+            else:
+                result.radii, result.error = radii, None
+
+            yield inputFile, result
+            del result
+        if pool:
+            pool.close()
+    except:
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        if pool:
+            import shutil
+
+            pool.join()
+            shutil.rmtree(outputDir, ignore_errors=True)
+
+def _runSerially(config, inputFiles, weightFiles, varianceFiles, verbose, timer=None,
+                 checkpointCache=None, continueOnError=False):
+    """Process the inputs one by one in this process, yielding (inputFile, result)"""
+    processor = FileProcessor(config, verbose=verbose, timer=timer, checkpointCache=checkpointCache)
+
+    for inputFile, weightFile, varianceFile in zip(inputFiles, weightFiles, varianceFiles):
+        result = processor.process(inputFile, weightFile, varianceFile, continueOnError=continueOnError)
+
+        yield inputFile, result
+        del result                      # don't hold the exposure while processing the next file
+
+def _makeCheckpointer(cache, config, inputFile, weightFile, varianceFile, verbose):
+    """Return a Checkpointer for inputFile that saves its checkpoints in cache, or None if cache is None"""
+    if cache is None:
+        return None
+
+    return Checkpointer(cache, config, getVersion(), inputFile, weightFile, varianceFile, verbose=verbose)
+
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+#
+# Support for processing files in a pool of worker processes
+#
+# The pool is created by forking this process, so the config is inherited rather than pickled, and each
+# worker builds its tasks once in _initWorker.  The processed data are passed back to the parent via
+# FITS files in a temporary directory, as afw's objects can't be pickled
+#
+_bytesPerPixel = 60                     # approximate peak memory needed to process a pixel
+_bytesPerWorker = 500*1024**2           # memory used by a worker before it reads any data
+
+_workerState = None
+
+def _initWorker(config, outputDir, verbose, timerArgs=None, checkpointCache=None):
+    """Create the tasks for a worker process
+
+    If timerArgs isn't None, each file is timed by a StageTimer(**timerArgs).  If checkpointCache
+    isn't None, checkpoints are saved in it
+    """
+    global _workerState
+    _workerState = pipeBase.Struct(config=config, tasks=makeTasks(config),
+                                   outputDir=outputDir, verbose=verbose, timerArgs=timerArgs,
+                                   checkpointCache=checkpointCache, psfSeeder=PsfSeeder(config.psfSeed))
+
+def _getTimerArgs(timer):
+    """Return the arguments needed to create a StageTimer like timer in a worker, or None if timer is None"""
+    return None if timer is None else dict(profile=timer.profile, profileDir=timer.profileDir)
+
+def _makeWorkerTimer(inputFile):
+    """Return a StageTimer for processing inputFile in a worker, or None if we're not timing"""
+    if _workerState.timerArgs is None:
+        return None
+
+    from .metrics import StageTimer
+
+    timer = StageTimer(**_workerState.timerArgs)
+    timer.inputFile = inputFile
+    return timer
+
+def _processInWorker(args):
+    """Process one file in a worker
+
+    Returns the names of the files containing the outputs, the aperture radii, the stages recorded
+    by the worker's timer, and None;  or, if the processing failed, (None, None, stages, traceback)
+    """
+    i, inputFile, weightFile, varianceFile, returnCalibSources = args
+    state = _workerState
+
+    timer = _makeWorkerTimer(inputFile)
+    checkpointer = _makeCheckpointer(state.checkpointCache, state.config, inputFile, weightFile,
+                                     varianceFile, state.verbose)
+    try:
+        result = processOneFile(state.config, state.tasks, inputFile, weightFile, varianceFile,
+                                verbose=state.verbose, timer=timer, checkpointer=checkpointer,
+                                seed=state.psfSeeder.getSeed())
+    except Exception:
+        return None, None, (timer.stages if timer else []), traceback.format_exc()
+    state.psfSeeder.update(result.exposure, inputFile)     # the seed for this worker's next file
+
+    fileNames = dict(exposure=os.path.join(state.outputDir, "%d.calexp.fits" % i),
+                     sources=os.path.join(state.outputDir, "%d.src.fits" % i),
+                     calibSources=None)
+
+    result.exposure.writeFits(fileNames["exposure"])
+    result.sources.writeFits(fileNames["sources"])
+    if returnCalibSources and result.calibSources is not None:
+        fileNames["calibSources"] = os.path.join(state.outputDir, "%d.calib.fits" % i)
+        result.calibSources.writeFits(fileNames["calibSources"])
+
+    return fileNames, getApertureRadii(state.tasks.algMetadata), (timer.stages if timer else []), None
+
+def _processTileInWorker(args):
+    """Process one tile in a worker
+
+    Returns the names of the files containing its owned sources, and the stages recorded by the
+    worker's timer
+    """
+    from .tiling import selectOwnedSources
+
+    prefix, inputFile, weightFile, varianceFile, bbox, ownedBBox, psfFile = args
+    state = _workerState
+
+    timer = _makeWorkerTimer(inputFile)
+    psf = _readPsf(psfFile) if psfFile else None
+    result = processOneFile(state.config, state.tasks, inputFile, weightFile, varianceFile,
+                            verbose=state.verbose, bbox=_tupleToBox(bbox), psf=psf, timer=timer)
+
+    fileNames = dict(sources=prefix + ".src.fits", calibSources=None)
+    selectOwnedSources(result.sources, _tupleToBox(ownedBBox)).writeFits(fileNames["sources"])
+    if result.calibSources is not None:
+        fileNames["calibSources"] = prefix + ".calib.fits"
+        selectOwnedSources(result.calibSources, _tupleToBox(ownedBBox)).writeFits(fileNames["calibSources"])
+
+    return fileNames, (timer.stages if timer else [])
+
+def _boxToTuple(bbox):
+    """Convert a Box2I to a tuple that we can pass to a worker process"""
+    return bbox.getMinX(), bbox.getMinY(), bbox.getMaxX(), bbox.getMaxY()
+
+def _tupleToBox(corners):
+    """Convert a tuple returned by _boxToTuple back to a Box2I"""
+    x0, y0, x1, y1 = corners
+    return afwGeom.Box2I(afwGeom.Point2I(x0, y0), afwGeom.Point2I(x1, y1))
+
+def _writePsf(psf, fileName):
+    """Write a PSF to fileName by attaching it to a trivial Exposure"""
+    exposure = afwImage.ExposureF(1, 1)
+    exposure.setPsf(psf)
+    exposure.writeFits(fileName)
+
+def _readPsf(fileName):
+    """Read a PSF written by _writePsf"""
+    return afwImage.ExposureF(fileName).getPsf()
+
+def _runInPool(config, jobs, inputFiles, weightFiles, varianceFiles, returnCalibSources, verbose,
+               timer=None, checkpointCache=None, continueOnError=False):
+    """Process the inputs in a pool of jobs worker processes, yielding (inputFile, result) in input order"""
+    import multiprocessing
+    import shutil
+    import tempfile
+
+    outputDir = tempfile.mkdtemp(prefix="processFile-")
+    pool = multiprocessing.Pool(jobs, initializer=_initWorker,
+                                initargs=(config, outputDir, verbose, _getTimerArgs(timer), checkpointCache))
+    try:
+        workArgs = [(i, inputFile, weightFile, varianceFile, returnCalibSources) for
+                    i, (inputFile, weightFile, varianceFile) in
+                    enumerate(zip(inputFiles, weightFiles, varianceFiles))]
+
+        for inputFile, (fileNames, radii, stages, error) in zip(inputFiles,
+                                                                pool.imap(_processInWorker, workArgs)):
+            if timer is not None:
+                timer.stages += stages
+            if error is not None:
+                if not continueOnError:
+                    raise RuntimeError("Failed to process %s:\n%s" % (inputFile, error))
+                yield inputFile, _makeFailedResult(inputFile, error)
+                continue
+
+            exposure = afwImage.ExposureF(fileNames["exposure"])
+            sources = afwTable.SourceCatalog.readFits(fileNames["sources"])
+            calibSources = afwTable.SourceCatalog.readFits(fileNames["calibSources"]) \
+                           if fileNames["calibSources"] else None
+
+            for fileName in fileNames.values():
+                if fileName:
+                    os.remove(fileName)
+
+            yield inputFile, pipeBase.Struct(exposure=exposure, calibSources=calibSources,
+                                             sources=sources, radii=radii, error=None)
+            del exposure, calibSources, sources
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        shutil.rmtree(outputDir, ignore_errors=True)
+
+def readImageBBox(fileName):
+    """Return the bounding box of the image in fileName, reading only the FITS headers
+
+    Returns None if the bounding box can't be determined
+    """
+    for hdu in (0, 1):                  # the image is in HDU 1 if fileName was written by afw
+        try:
+            md = afwImage.readMetadata(fileName, hdu)
+        except Exception:
+            return None
+        if md.exists("NAXIS") and md.get("NAXIS") >= 2:
+            return afwImage.bboxFromMetadata(md)
+
+    return None
+
+def readImageDimensions(fileName):
+    """Return the (width, height) of the image in fileName, reading only the FITS headers
+
+    Returns None if the dimensions can't be determined
+    """
+    bbox = readImageBBox(fileName)
+    return None if bbox is None else (bbox.getWidth(), bbox.getHeight())
+
+def getAvailableMemory():
+    """Return the memory available for new processes in bytes, or None if it can't be determined"""
+    try:
+        with open("/proc/meminfo") as fd:
+            for line in fd:
+                if line.startswith("MemAvailable:"):
+                    return 1024*int(line.split()[1])
+    except IOError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES")*os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def capJobs(jobs, inputFiles, verbose=False):
+    """Return the number of worker processes to use to process inputFiles
+
+    The number is no larger than jobs or the number of inputs, and is reduced if there isn't enough
+    memory to process the largest input in each worker at the same time
+    """
+    jobs = max(1, min(jobs, len(inputFiles)))
+    if jobs == 1:
+        return jobs
+
+    nPixel = 0
+    for inputFile in inputFiles:
+        dims = readImageDimensions(inputFile)
+        if dims:
+            nPixel = max(nPixel, dims[0]*dims[1])
+
+    return _capJobsForPixels(jobs, nPixel, verbose=verbose)
+
+def _capJobsForPixels(jobs, nPixel, verbose=False):
+    """Return the number of jobs, each processing up to nPixel pixels, that fit in the available memory"""
+    availableMemory = getAvailableMemory()
+    if availableMemory is None:
+        return jobs
+
+    maxJobs = max(1, availableMemory//(_bytesPerWorker + _bytesPerPixel*nPixel))
+    if maxJobs < jobs:
+        if verbose:
+            print("Reducing number of jobs from %d to %d as only %.1f GB of memory is available" %
+                  (jobs, maxJobs, availableMemory/1024.0**3))
+        jobs = maxJobs
+
+    return jobs
+
+def makeExposure(inputFile, weightFile, varianceFile, badPixelValue, variance, bbox=None, chunkRows=256,
+                 stats=None, varianceEstimator="full", varianceSamplePixels=100000):
+    """Read an exposure (or the part of it within bbox) and set its mask and variance planes
+
+    The mask and variance planes are set in place, chunkRows rows at a time, so the only temporaries
+    are a couple of chunk-sized boolean arrays and a chunk of the weight or variance file (which is
+    read a strip at a time).  If stats is a dict, it's set to the number of bytes of temporaries
+    that we needed ("tempBytes"), and the number we'd have needed to process the whole image at once
+    ("fullFrameTempBytes")
+
+    If there's no weight or variance file and variance isn't positive, the variance is estimated
+    from the image using varianceEstimator and varianceSamplePixels (see
+    lsst.processFile.varianceEstimate);  the estimate and its error are added to stats as
+    "variance" and "varianceError"
+    """
+    if bbox is None:
+        exposure = afwImage.ExposureF(inputFile)
+    else:
+        exposure = afwImage.ExposureF(inputFile, bbox, afwImage.PARENT)
+
+    mi = exposure.getMaskedImage()
+    image = mi.getImage().getArray()
+    mask = mi.getMask().getArray()
+    varianceArr = mi.getVariance().getArray()
+    badBit = mi.getMask().getPlaneBitMask("BAD")
+
+    height, width = image.shape
+    chunkRows = max(1, min(chunkRows, height))
+    flagBad = np.isfinite(badPixelValue)
+
+    if weightFile or varianceFile:
+        assert(not (weightFile and varianceFile)) # we checked this earlier
+
+        assert not np.isfinite(variance), \
+            "Please don't specify a variance and %s file" % ("weight" if weightFile else "variance")
+        #
+        # We read the weights/variances in strips in the coordinate system of their file,
+        # which we assume is aligned with the inputFile
+        #
+        if bbox is None:
+            x0, y0 = 0, 0
+        else:
+            fileBBox = readImageBBox(inputFile)
+            x0, y0 = bbox.getMinX() - fileBBox.getMinX(), bbox.getMinY() - fileBBox.getMinY()
+    #
+    # Processing the whole image at once needs a boolean array for the bad pixels, a whole ImageF
+    # for the weights/variances, and (for weights) another for their inverse
+    #
+    fullFrameTempBytes = image.size if flagBad else 0
+    if weightFile or varianceFile:
+        fullFrameTempBytes += image.size*(1 + (2 if weightFile else 1)*image.itemsize)
+    tempBytes = 0
+
+    if flagBad or weightFile or varianceFile:
+        bad = np.empty((chunkRows, width), dtype=bool)
+        good = np.empty_like(bad) if weightFile else None
+        bufferBytes = bad.nbytes + (good.nbytes if weightFile else 0)
+        tempBytes = bufferBytes
+
+        for r0 in range(0, height, chunkRows):
+            r1 = min(r0 + chunkRows, height)
+            nRow = r1 - r0
+            imageChunk, maskChunk, varianceChunk = image[r0:r1], mask[r0:r1], varianceArr[r0:r1]
+            badChunk = bad[:nRow]
+
+            if flagBad:
+                np.equal(imageChunk, badPixelValue, out=badChunk)
+                np.bitwise_or(maskChunk, badBit, out=maskChunk, where=badChunk)
+
+            if weightFile or varianceFile:
+                strip = afwGeom.Box2I(afwGeom.Point2I(x0, y0 + r0), afwGeom.Extent2I(width, nRow))
+                fileChunk = _readImage(weightFile or varianceFile, strip, afwImage.LOCAL).getArray()
+                tempBytes = max(tempBytes, bufferBytes + fileChunk.nbytes)
+
+                if weightFile:          # variance = 1/weight, or 0 where the weight is 0
+                    goodChunk = good[:nRow]
+                    np.equal(fileChunk, 0, out=badChunk)
+                    np.logical_not(badChunk, out=goodChunk)
+
+                    varianceChunk[:] = 0
+                    np.divide(1.0, fileChunk, out=varianceChunk, where=goodChunk)
+                else:
+                    varianceChunk[:] = fileChunk
+                    np.isfinite(imageChunk, out=badChunk)
+                    np.logical_not(badChunk, out=badChunk)
+
+                np.bitwise_or(maskChunk, badBit, out=maskChunk, where=badChunk)
+                del fileChunk
+
+    if not (weightFile or varianceFile):
+        if not np.isfinite(variance) or variance <= 0:
+            from .varianceEstimate import estimateVariance
+
+            estimate = estimateVariance(mi, badBit, varianceEstimator, nSample=varianceSamplePixels)
+            variance = estimate.variance
+            if stats is not None:
+                stats["variance"], stats["varianceError"] = estimate.variance, estimate.error
+
+        varianceArr[:] = variance
+
+    del mi
+
+    if stats is not None:
+        stats["tempBytes"] = tempBytes
+        stats["fullFrameTempBytes"] = fullFrameTempBytes
+
+    return exposure
+
+def _readImage(fileName, bbox=None, origin=afwImage.PARENT):
+    """Read an ImageF from fileName, or just the part within bbox"""
+    if bbox is None:
+        return afwImage.ImageF(fileName)
+    else:
+        return afwImage.ImageF(fileName, 0, dafBase.PropertySet(), bbox, origin)
+
+def propagatePsfFlags(keysToCopy, calibSources, sources, matchRadius=1):
+    """Match the calibSources and sources, and propagate Interesting Flags (e.g. PSF star) to the sources
+
+    Each calibSource is matched to the closest source within matchRadius pixels (if two or more sources
+    are equally close, e.g. a parent and its only child, the last one in sources is chosen);  if several
+    calibSources match the same source, the last one's flags are copied.  The matching uses a KD-tree
+    over the centroid columns;  if scipy isn't available it falls back to afwTable.matchXy
+    """
+    if calibSources is None or sources is None:
+        return
+
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        return _propagatePsfFlagsByMatchXy(keysToCopy, calibSources, sources, matchRadius)
+
+    if len(calibSources) == 0 or len(sources) == 0:
+        return
+
+    if not calibSources.isContiguous():
+        calibSources = calibSources.copy(deep=True)
+
+    calibXY, sourceXY = _getCentroids(calibSources), _getCentroids(sources)
+    goodCalib = np.flatnonzero(np.isfinite(calibXY).all(axis=1))
+    goodSources = np.flatnonzero(np.isfinite(sourceXY).all(axis=1))
+    if len(goodCalib) == 0 or len(goodSources) == 0:
+        return
+    #
+    # Find all the sources within matchRadius of each calibSource, and choose the closest
+    #
+    neighbours = cKDTree(sourceXY[goodSources]).query_ball_point(calibXY[goodCalib], r=matchRadius)
+    nNeighbour = np.array([len(n) for n in neighbours], dtype=int)
+    if nNeighbour.sum() == 0:
+        return
+
+    calibIndex = np.repeat(goodCalib, nNeighbour)
+    sourceIndex = goodSources[np.fromiter(itertools.chain.from_iterable(neighbours), dtype=int,
+                                          count=nNeighbour.sum())]
+    dist = np.hypot(*(sourceXY[sourceIndex] - calibXY[calibIndex]).T)
+
+    order = np.lexsort((-sourceIndex, dist, calibIndex))  # closest first, and then the last in sources
+    calibIndex, sourceIndex = calibIndex[order], sourceIndex[order]
+    isClosest = np.ones(len(calibIndex), dtype=bool)
+    isClosest[1:] = calibIndex[1:] != calibIndex[:-1]
+    calibIndex, sourceIndex = calibIndex[isClosest], sourceIndex[isClosest]
+    #
+    # If several calibSources match the same source the last one wins, so keep its last occurrence
+    #
+    sourceIndex, last = np.unique(sourceIndex[::-1], return_index=True)
+    calibIndex = calibIndex[::-1][last]
+    #
+    # Copy over the desired flags, reading them all at once from calibSources' columns
+    #
+    for skey, ckey in keysToCopy:
+        values = np.asarray(calibSources[ckey])[calibIndex]
+        for i, value in zip(sourceIndex, values):
+            sources[int(i)].set(skey, value.item())
+
+def _getCentroids(catalog):
+    """Return an (n, 2) array of the slot centroids of the sources in catalog"""
+    if not catalog.isContiguous():
+        catalog = catalog.copy(deep=True)
+    return np.column_stack([catalog.getX(), catalog.getY()]).astype(float)
+
+def _propagatePsfFlagsByMatchXy(keysToCopy, calibSources, sources, matchRadius=1):
+    """The implementation of propagatePsfFlags using afwTable.matchXy, used if scipy isn't available"""
+    if calibSources is None or sources is None:
+        return
+
+    closest = False                 # return all matched objects
+    matched = afwTable.matchXy(calibSources, sources, matchRadius, closest)
+    #
+    # Because we had to allow multiple matches to handle parents, we now need to
+    # prune to the best matches
+    #
+    bestMatches = {}
+    for m0, m1, d in matched:
+        id0 = m0.getId()
+        if id0 in bestMatches:
+            if d > bestMatches[id0][2]:
+                continue
+
+        bestMatches[id0] = (m0, m1, d)
+
+    matched = bestMatches.values()
+    #
+    # Check that we got it right
+    #
+    if len(set(m[0].getId() for m in matched)) != len(matched):
+        print("At least one calibSource is matched to more than one Source")
+    #
+    # Copy over the desired flags
+    #
+    for cs, s, d in matched:
+        for skey, ckey in keysToCopy:
+            s.set(skey, cs.get(ckey))
+
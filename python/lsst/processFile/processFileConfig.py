@@ -0,0 +1,140 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.pex.config as pexConfig
+
+from lsst.ip.isr import IsrTask
+from lsst.pipe.tasks.characterizeImage import CharacterizeImageTask
+from lsst.meas.algorithms.detection import SourceDetectionTask
+try:
+    from lsst.meas.deblender import SourceDeblendTask   # we need its ConfigClass
+except ImportError:
+    SourceDeblendTask = None
+from lsst.meas.base import SingleFrameMeasurementTask, ForcedMeasurementTask
+
+from .budget import BudgetConfig
+from .defectInterpolation import interpEngines
+from .psfSeed import PsfSeedConfig
+from .varianceEstimate import varianceEstimators
+
+__all__ = ["MyIsrConfig", "ProcessFileConfig"]
+
+class MyIsrConfig(IsrTask.ConfigClass):
+    """A version of IsrTask.ConfigClass that disables almost everything
+    The interpolation code is still run"""
+    
+    def __init__(self, *args, **kwargs):
+        IsrTask.ConfigClass.__init__(self, *args, **kwargs)
+        self.doBias = False
+        self.doDark = False
+        self.doFlat = False
+        self.doFringe = False
+        self.doLinearize = False
+        self.doAssembleCcd = False
+
+class ProcessFileConfig(pexConfig.Config):
+    """A container for the Configs that ProcessFile needs
+
+Using such a container allows us to use the standard -c/-C/--show config options that pipe_base provides
+"""
+    variance = pexConfig.Field(dtype=float, default=np.nan,
+                               doc="Initial per-pixel variance (if <= 0, estimate from inputs)")
+    varianceEstimator = pexConfig.ChoiceField(
+        dtype=str, default="full",
+        doc="How to estimate the variance if it isn't given (as variance, or a weight or variance file)",
+        allowed=varianceEstimators)
+    varianceSamplePixels = pexConfig.Field(dtype=int, default=100000,
+                                           doc="Approximate number of pixels used by the subsample and "
+                                           "boxes varianceEstimators")
+    badPixelValue = pexConfig.Field(dtype=float, default=np.nan, doc="Value indicating a bad pixel")
+    interpPlanes = pexConfig.ListField(
+        dtype = str, default = ["BAD",],
+        doc = "Names of mask planes to interpolate over (e.g. ['BAD', 'SAT'])",
+        itemCheck = lambda x: x in afwImage.MaskU().getMaskPlaneDict().keys())
+    interpEngine = pexConfig.ChoiceField(dtype=str, default="isr",
+                                         doc="How to interpolate over the interpPlanes "
+                                         "(see lsst.processFile.defectInterpolation)",
+                                         allowed=interpEngines)
+
+    pixelChunkRows = pexConfig.Field(dtype=int, default=256,
+                                     doc="Number of rows to process at a time when setting the mask and "
+                                     "variance planes of the input data")
+
+    isr = MyIsrConfig()
+
+    doCalibrate = pexConfig.Field(dtype=bool, default=True, doc="Calibrate input data?")
+    charImage = pexConfig.ConfigField(dtype=CharacterizeImageTask.ConfigClass,
+                                      doc=CharacterizeImageTask.ConfigClass.__doc__)
+    psfSeed = pexConfig.ConfigField(dtype=PsfSeedConfig,
+                                    doc="Start characterization from the PSF of a previous exposure or a "
+                                    "calexp (see lsst.processFile.psfSeed)")
+
+    detection = pexConfig.ConfigField(dtype=SourceDetectionTask.ConfigClass,
+                                      doc=SourceDetectionTask.ConfigClass.__doc__)
+    detection.returnOriginalFootprints = False
+
+    measurement = pexConfig.ConfigField(dtype=SingleFrameMeasurementTask.ConfigClass,
+                                        doc=SingleFrameMeasurementTask.ConfigClass.__doc__)
+
+    measurementJobs = pexConfig.Field(dtype=int, default=1,
+                                      doc="Number of processes in which to measure the sources of each "
+                                      "exposure (each measures whole families of sources; the results are "
+                                      "the same as measuring them serially)")
+
+    doDeblend = pexConfig.Field(dtype=bool, default=True, doc="Deblend sources?")
+    if SourceDeblendTask:
+        deblend = pexConfig.ConfigField(dtype=SourceDeblendTask.ConfigClass,
+                                        doc=SourceDeblendTask.ConfigClass.__doc__)
+
+    tileSize = pexConfig.Field(dtype=int, default=0,
+                               doc="Process the image in tiles of (up to) this many pixels on a side, "
+                               "reading each tile separately; 0 disables tiling")
+    tileOverlap = pexConfig.Field(dtype=int, default=100,
+                                  doc="Number of pixels by which each tile extends into its neighbours; "
+                                  "should be larger than the largest object you wish to measure")
+    tilePsf = pexConfig.ChoiceField(
+        dtype=str, default="single",
+        doc="How to characterize the tiles (PSF estimation, background subtraction, CR removal)",
+        allowed={
+            "single": "Characterize the central tile, and use its PSF for all the tiles",
+            "perTile": "Characterize each tile separately",
+        })
+
+    multiBandDetection = pexConfig.ChoiceField(
+        dtype=str, default="reference",
+        doc="Where to detect (and deblend) sources when processing several bands together (--multiBand)",
+        allowed={
+            "reference": "Detect on the reference band",
+            "combined": "Detect on the inverse-variance weighted mean of all the bands",
+        })
+    forcedMeasurement = pexConfig.ConfigField(dtype=ForcedMeasurementTask.ConfigClass,
+                                              doc="Forced measurement of each band at the positions of the "
+                                              "sources detected with --multiBand")
+
+    budget = pexConfig.ConfigField(dtype=BudgetConfig,
+                                   doc="Per-file wall time and memory budgets, and the cheaper processing "
+                                   "to fall back on when they run out (see lsst.processFile.budget)")
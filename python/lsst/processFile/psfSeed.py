@@ -0,0 +1,177 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Warm-start characterization from the PSF of a previous exposure
+
+Characterization normally starts from a simple (double Gaussian) PSF and iterates PSF measurement,
+cosmic-ray repair and detection config.charImage.psfIterations times.  For a sequence of exposures of
+the same field or CCD the PSF of the previous exposure (or of a calexp) is a much better starting point,
+so config.psfSeed can install it before characterizing, and run only config.psfSeed.psfIterations
+iterations (or none, keeping the seed).  If the PSF that is measured differs in size from the seed by
+more than config.psfSeed.maxSizeChange the seed is assumed to have been a bad one, and the exposure is
+characterized from scratch.  The seed that was used is recorded in the exposure's (and the catalogue's)
+metadata:
+    PSF_SEED             The source of the seed (none, previous or calexp)
+    PSF_SEED_FILE        The file whose PSF was used
+    PSF_SEED_SIZECHANGE  The fractional change in the PSF's determinant radius from the seed's
+    PSF_SEED_REJECTED    True if the seed was rejected and the exposure characterized from scratch
+The background is estimated from scratch in either case.
+"""
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+import lsst.daf.base as dafBase
+import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
+
+__all__ = ["PsfSeedConfig", "PsfSeeder", "psfSeedKeys", "characterizeFromSeed", "copyPsfSeedMetadata"]
+
+psfSeedKeys = ["PSF_SEED", "PSF_SEED_FILE", "PSF_SEED_SIZECHANGE", "PSF_SEED_REJECTED"]
+
+
+class PsfSeedConfig(pexConfig.Config):
+    """Where to find the PSF that seeds characterization, and how far to trust it"""
+    source = pexConfig.ChoiceField(
+        dtype=str, default="none",
+        doc="The source of the PSF that seeds characterization",
+        allowed={
+            "none": "Start from a simple PSF (see charImage.installSimplePsf)",
+            "previous": "The PSF of the previous exposure processed by the same process (the first "
+                        "exposure starts from a simple PSF)",
+            "calexp": "The PSF of the calexp psfSeed.calexp",
+        })
+    calexp = pexConfig.Field(dtype=str, default="",
+                             doc="The calexp whose PSF is the seed if source == calexp")
+    psfIterations = pexConfig.Field(dtype=int, default=1,
+                                    doc="Number of iterations of PSF measurement when starting from a seed "
+                                    "(at most charImage.psfIterations); 0 keeps the seed PSF")
+    maxSizeChange = pexConfig.Field(dtype=float, default=0.2,
+                                    doc="Characterize from scratch if the measured PSF's size differs from "
+                                    "the seed's by more than this fraction; 0 accepts any change (and saves "
+                                    "keeping a copy of the exposure while characterizing it)")
+
+
+class PsfSeeder(object):
+    """Provide the seed PSFs for characterizing a series of exposures, as specified by config
+
+    Call getSeed() before characterizing each exposure, and update() after processing it
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._seed = None
+
+        if config.source == "calexp":
+            if not config.calexp:
+                raise ValueError("Please specify psfSeed.calexp with psfSeed.source = calexp")
+            self._seed = pipeBase.Struct(psf=readPsf(config.calexp), source="calexp", fileName=config.calexp)
+
+    def getSeed(self):
+        """Return a Struct with the seed psf, its source, and its fileName;  or None if there's no seed yet"""
+        return self._seed
+
+    def update(self, exposure, fileName):
+        """Remember exposure's PSF (read from fileName) as the next seed, if config.source == previous"""
+        if self.config.source == "previous" and exposure is not None and exposure.getPsf():
+            self._seed = pipeBase.Struct(psf=exposure.getPsf(), source="previous", fileName=fileName or "")
+
+
+def readPsf(fileName):
+    """Read the PSF from the calexp fileName (reading only a single pixel)"""
+    bbox = afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(1, 1))
+    psf = afwImage.ExposureF(fileName, bbox, afwImage.LOCAL).getPsf()
+    if not psf:
+        raise RuntimeError("%s has no PSF" % fileName)
+
+    return psf
+
+
+@contextlib.contextmanager
+def seededConfig(charImageConfig, psfIterations):
+    """Temporarily configure charImageConfig to refine (or just keep) the PSF that's already installed"""
+    names = [name for name in ("psfIterations", "doMeasurePsf", "useSimplePsf")
+             if hasattr(charImageConfig, name)]
+    saved = [(name, getattr(charImageConfig, name)) for name in names]
+    try:
+        if psfIterations > 0:
+            charImageConfig.psfIterations = min(charImageConfig.psfIterations, psfIterations)
+        else:
+            charImageConfig.psfIterations = 1
+            charImageConfig.doMeasurePsf = False
+        if "useSimplePsf" in names:     # or the seed is replaced by a simple PSF before measuring the PSF
+            charImageConfig.useSimplePsf = False
+        yield
+    finally:
+        for name, value in saved:
+            setattr(charImageConfig, name, value)
+
+
+def characterizeFromSeed(charImageTask, exposure, seed, config, verbose=False):
+    """Characterize exposure with charImageTask, starting from seed (as returned by PsfSeeder.getSeed)
+
+    config is a PsfSeedConfig.  Returns the Struct returned by charImageTask.characterize, whose
+    exposure's metadata records the seed (see the module docstring)
+    """
+    original = None                     # a copy to characterize from scratch, as characterize alters exposure
+    if config.maxSizeChange > 0:
+        original = exposure.Factory(exposure, True)
+    exposure.setPsf(seed.psf.clone())
+
+    with seededConfig(charImageTask.config, config.psfIterations):
+        result = charImageTask.characterize(exposure)
+
+    center = afwGeom.Box2D(exposure.getBBox()).getCenter()
+    seedSize = seed.psf.computeShape(center).getDeterminantRadius()
+    sizeChange = result.exposure.getPsf().computeShape(center).getDeterminantRadius()/seedSize - 1
+
+    rejected = original is not None and abs(sizeChange) > config.maxSizeChange
+    if rejected:
+        if verbose:
+            print("The PSF's size differs from the seed's (%s) by %.0f%%;  characterizing from scratch" %
+                  (seed.fileName, 100*sizeChange))
+        result = charImageTask.characterize(original)
+    elif verbose:
+        print("Characterized from the PSF of %s (size change %.1f%%)" % (seed.fileName, 100*sizeChange))
+    del original
+
+    metadata = result.exposure.getMetadata()
+    metadata.set("PSF_SEED", seed.source)
+    metadata.set("PSF_SEED_FILE", seed.fileName)
+    metadata.set("PSF_SEED_SIZECHANGE", sizeChange)
+    metadata.set("PSF_SEED_REJECTED", rejected)
+
+    return result
+
+
+def copyPsfSeedMetadata(exposure, sources):
+    """Copy the record of exposure's PSF seed (if any) to the metadata of sources (a SourceCatalog)"""
+    metadata = exposure.getMetadata()
+    if not metadata.exists("PSF_SEED"):
+        return
+
+    if sources.getTable().getMetadata() is None:
+        sources.getTable().setMetadata(dafBase.PropertyList())
+    for key in psfSeedKeys:
+        if metadata.exists(key):
+            sources.getTable().getMetadata().set(key, metadata.get(key))
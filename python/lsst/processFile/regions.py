@@ -0,0 +1,122 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Build the overlays used to display sources (centroids, PSF stars, shapes, and apertures) as arrays,
+and format them as DS9 regions so that they can be sent to a display or written to a file in one go
+
+Each kind of overlay is tagged (centroid, psf, shape, aperture), so you can show or hide them
+separately using ds9's Region/Groups menu
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import lsst.pipe.base as pipeBase
+
+__all__ = ["allOverlays", "makeOverlays", "formatRegions", "writeRegions"]
+
+allOverlays = ("centroid", "psf", "shape", "aperture")
+
+def makeOverlays(sources, radii=[], overlays=allOverlays):
+    """Return a list of Structs describing the overlays for sources
+
+    Each Struct has the overlay's name (one of allOverlays), a shape ("point", "circle" or "ellipse"),
+    and arrays x, y and color, and also size (for circles), or a, b and theta (in degrees; for ellipses).
+    The positions are in the sources' (i.e. parent) pixel coordinates
+    """
+    if not sources.isContiguous():
+        sources = sources.copy(deep=True)
+
+    x, y = sources.get("slot_Centroid_x"), sources.get("slot_Centroid_y")
+    schema = sources.getSchema()
+
+    def getFlag(name):
+        try:
+            schema.find(name)
+        except KeyError:
+            return np.zeros(len(sources), dtype=bool)
+        return sources.get(name).astype(bool)
+
+    results = []
+    if "centroid" in overlays:
+        color = np.where(getFlag("flags_negative"), "cyan", "green")
+        results.append(pipeBase.Struct(name="centroid", shape="point", x=x, y=y, color=color))
+
+    if "psf" in overlays:
+        used, reserved = getFlag("calib_psfUsed"), getFlag("calib_psfReserved")
+        isPsf = used | reserved
+        results.append(pipeBase.Struct(name="psf", shape="circle", x=x[isPsf], y=y[isPsf],
+                                       size=np.full(isPsf.sum(), 10.0),
+                                       color=np.where(used[isPsf], "green", "yellow")))
+
+    if "shape" in overlays:
+        xx, yy, xy = [sources.get("slot_Shape_%s" % m) for m in ("xx", "yy", "xy")]
+        with np.errstate(invalid="ignore"):
+            d = np.hypot(0.5*(xx - yy), xy)
+            a = np.sqrt(0.5*(xx + yy) + d)
+            b = np.sqrt(np.maximum(0.5*(xx + yy) - d, 0))
+            good = np.isfinite(a) & np.isfinite(b)
+        theta = np.degrees(0.5*np.arctan2(2*xy, xx - yy))
+        results.append(pipeBase.Struct(name="shape", shape="ellipse", x=x[good], y=y[good],
+                                       a=a[good], b=b[good], theta=theta[good],
+                                       color=np.full(good.sum(), "red", dtype=object)))
+
+    if "aperture" in overlays and len(radii) > 0:
+        nRadius = len(radii)
+        results.append(pipeBase.Struct(name="aperture", shape="circle", x=np.repeat(x, nRadius),
+                                       y=np.repeat(y, nRadius), size=np.tile(radii, len(x)),
+                                       color=np.full(nRadius*len(x), "yellow", dtype=object)))
+
+    return results
+
+def formatRegions(overlays, xy0=(0, 0)):
+    """Return a list of lines in DS9's region format describing overlays (as returned by makeOverlays)
+
+    xy0 is the origin of the image that the regions will be displayed on;  ds9's image coordinates
+    are 1-indexed relative to it
+    """
+    lines = ["# Region file format: DS9 version 4.1", "image"]
+    for overlay in overlays:
+        x = overlay.x - xy0[0] + 1
+        y = overlay.y - xy0[1] + 1
+        good = np.isfinite(x) & np.isfinite(y)
+        tag = "tag={%s}" % overlay.name
+
+        if overlay.shape == "point":
+            lines += ["point(%.3f,%.3f) # point=cross color=%s %s" % (_x, _y, c, tag) for _x, _y, c in
+                      zip(x[good], y[good], overlay.color[good])]
+        elif overlay.shape == "circle":
+            lines += ["circle(%.3f,%.3f,%.3f) # color=%s %s" % (_x, _y, r, c, tag) for _x, _y, r, c in
+                      zip(x[good], y[good], overlay.size[good], overlay.color[good])]
+        elif overlay.shape == "ellipse":
+            lines += ["ellipse(%.3f,%.3f,%.3f,%.3f,%.2f) # color=%s %s" % t for t in
+                      zip(x[good], y[good], overlay.a[good], overlay.b[good], overlay.theta[good],
+                          overlay.color[good], [tag]*good.sum())]
+        else:
+            raise RuntimeError("Unknown overlay shape %s" % overlay.shape)
+
+    return lines
+
+def writeRegions(fileName, overlays, xy0=(0, 0)):
+    """Write overlays (as returned by makeOverlays) to fileName as a DS9 region file"""
+    with open(fileName, "w") as fd:
+        fd.write("\n".join(formatRegions(overlays, xy0)) + "\n")
@@ -0,0 +1,247 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""An on-disk cache of processFile's outputs, keyed by the contents of the inputs and the config
+
+Each entry is a directory named by its key containing the calexp and catalogues;  entries are written
+to a temporary directory and renamed into place, so several processes may safely share a cache
+"""
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+try:
+    from StringIO import StringIO       # python 2: Config.saveToStream writes str, not unicode
+except ImportError:
+    from io import StringIO
+
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.afw.table as afwTable
+import lsst.pipe.base as pipeBase
+
+__all__ = ["ResultCache", "getDefaultCacheDir"]
+
+_entryFiles = dict(exposure="calexp.fits", calibSources="calib.fits", sources="src.fits",
+                   background="background.fits", radii="radii.json")
+
+def getDefaultCacheDir():
+    """Return the default cache directory: $PROCESSFILE_CACHE, else $XDG_CACHE_HOME/processFile"""
+    if os.environ.get("PROCESSFILE_CACHE"):
+        return os.environ["PROCESSFILE_CACHE"]
+
+    cacheHome = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cacheHome, "processFile")
+
+class ResultCache(object):
+    """A cache of the exposure and catalogues produced by processing a file
+
+    The key (see makeKey) is a hash of the bytes of the input, weight and variance files, the
+    serialized config, and the version of processFile.  If adding an entry makes the cache larger
+    than maxBytes the least recently used entries are deleted
+    """
+
+    def __init__(self, directory, maxBytes=10*1024**3):
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._digests = {}              # (fileName, size, mtime): sha1 of the contents
+
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def makeKey(self, config, version, inputFile, weightFile=None, varianceFile=None, stage=None,
+                fields=None):
+        """Return the key for processing inputFile (with weightFile or varianceFile) using config
+
+        If fields (a list of names of config's fields) is specified only those parts of the config
+        are used;  stage is a name distinguishing e.g. the keys of different checkpoints
+        """
+        stream = StringIO()
+        if fields is None:
+            config.saveToStream(stream)
+        else:
+            for name in fields:
+                value = getattr(config, name)
+                if hasattr(value, "saveToStream"):
+                    value.saveToStream(stream, root="config.%s" % name)
+                else:
+                    stream.write("config.%s=%r\n" % (name, value))
+
+        sha = hashlib.sha1()
+        sha.update(("version=%s\nstage=%s\n" % (version, stage)).encode())
+        sha.update(stream.getvalue().encode())
+        for role, fileName in [("input", inputFile), ("weight", weightFile), ("variance", varianceFile)]:
+            digest = "None" if fileName is None else self._hashFile(fileName)
+            sha.update(("%s=%s\n" % (role, digest)).encode())
+
+        return sha.hexdigest()
+
+    def lookup(self, key):
+        """Return True if key is in the cache, counting it as a hit or a miss
+
+        The entry is marked as having been used, so it won't be evicted before less recently used entries
+        """
+        entryDir = self._getEntryDir(key)
+        try:
+            os.utime(entryDir, None)
+        except OSError:
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        return True
+
+    def get(self, key):
+        """Return a Struct with the cached exposure, calibSources, sources, background and radii for key
+
+        Any of them may be None if they weren't available when the entry was written.
+        Returns None if the entry isn't in the cache (or can't be read).  The entry is marked as having
+        been used, but isn't counted as a hit (see lookup)
+        """
+        entryDir = self._getEntryDir(key)
+        try:
+            os.utime(entryDir, None)
+        except OSError:
+            return None
+
+        def fileName(what):
+            name = os.path.join(entryDir, _entryFiles[what])
+            return name if os.path.exists(name) else None
+
+        try:
+            exposure = afwImage.ExposureF(fileName("exposure")) if fileName("exposure") else None
+            calibSources = afwTable.SourceCatalog.readFits(fileName("calibSources")) \
+                           if fileName("calibSources") else None
+            sources = afwTable.SourceCatalog.readFits(fileName("sources")) if fileName("sources") else None
+            background = afwMath.BackgroundList.readFits(fileName("background")) \
+                         if fileName("background") else None
+            radii = None
+            if fileName("radii"):
+                with open(fileName("radii")) as fd:
+                    radii = json.load(fd)
+        except Exception as e:
+            print("Discarding unreadable cache entry %s: %s" % (entryDir, e), file=sys.stderr)
+            shutil.rmtree(entryDir, ignore_errors=True)
+            return None
+
+        return pipeBase.Struct(exposure=exposure, calibSources=calibSources, sources=sources,
+                               background=background, radii=radii)
+
+    def put(self, key, result, evict=True):
+        """Add result (a Struct with exposure, calibSources, sources, background and radii) as key
+
+        Any of them may be None (or missing).  If evict is True, least recently used entries are then
+        evicted until the cache is no larger than maxBytes
+        """
+        tmpDir = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            for what in ("exposure", "calibSources", "sources", "background"):
+                if getattr(result, what, None) is not None:
+                    getattr(result, what).writeFits(os.path.join(tmpDir, _entryFiles[what]))
+            if getattr(result, "radii", None) is not None:
+                with open(os.path.join(tmpDir, _entryFiles["radii"]), "w") as fd:
+                    json.dump(list(result.radii), fd)
+
+            try:
+                os.rename(tmpDir, self._getEntryDir(key))
+            except OSError:             # another process added the same entry
+                pass
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache is no larger than maxBytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith("."):    # an entry that's still being written
+                continue
+            entryDir = os.path.join(self.directory, name)
+            try:
+                entries.append((os.stat(entryDir).st_mtime, _getDirectorySize(entryDir), entryDir))
+            except OSError:             # deleted by another process
+                continue
+
+        totalBytes = sum(size for mtime, size, entryDir in entries)
+        for mtime, size, entryDir in sorted(entries):
+            if totalBytes <= self.maxBytes:
+                break
+
+            shutil.rmtree(entryDir, ignore_errors=True)
+            totalBytes -= size
+            self.evictions += 1
+
+    def getSize(self):
+        """Return the number of entries in the cache and their total size in bytes"""
+        nEntry, nByte = 0, 0
+        for name in os.listdir(self.directory):
+            if not name.startswith("."):
+                nEntry += 1
+                nByte += _getDirectorySize(os.path.join(self.directory, name))
+
+        return nEntry, nByte
+
+    def report(self):
+        """Return a one-line summary of the cache's hits, misses and size"""
+        nEntry, nByte = self.getSize()
+        return "Result cache %s: %d hits, %d misses, %d evictions; %d entries, %.1f of %.1f MB" % (
+            self.directory, self.hits, self.misses, self.evictions, nEntry,
+            nByte/1024.0**2, self.maxBytes/1024.0**2)
+
+    def _getEntryDir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _hashFile(self, fileName, blockSize=1024**2):
+        """Return the sha1 hex digest of the contents of fileName
+
+        The digest is remembered until the file's size or modification time changes
+        """
+        stat = os.stat(fileName)
+        memoKey = (os.path.abspath(fileName), stat.st_size, stat.st_mtime)
+        if memoKey not in self._digests:
+            sha = hashlib.sha1()
+            with open(fileName, "rb") as fd:
+                while True:
+                    block = fd.read(blockSize)
+                    if not block:
+                        break
+                    sha.update(block)
+            self._digests[memoKey] = sha.hexdigest()
+
+        return self._digests[memoKey]
+
+def _getDirectorySize(dirName):
+    """Return the total size in bytes of the files in dirName"""
+    return sum(os.path.getsize(os.path.join(dirName, name)) for name in os.listdir(dirName))
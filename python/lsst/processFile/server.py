@@ -0,0 +1,220 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Support for running processFile as a long-lived server
+
+The expensive setup (importing the stack and building the tasks) is done once by the caller, who
+passes serve() a function to process a single file.  Files are then taken from a spool directory
+as they appear, or from clients connected to a UNIX-domain socket who send one filename per line.
+"""
+from __future__ import absolute_import, division, print_function
+
+import errno
+import fnmatch
+import os
+import select
+import socket
+import sys
+import time
+import traceback
+
+from .utils import makeOutputFileNames, isOutputFileName
+
+__all__ = ["serve", "LatencyStatistics"]
+
+
+class LatencyStatistics(object):
+    """Accumulate and report the time taken to process each file"""
+
+    def __init__(self):
+        self.n = 0
+        self.nFailed = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency, failed=False):
+        self.n += 1
+        if failed:
+            self.nFailed += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def __str__(self):
+        if self.n == 0:
+            return "No files processed"
+        return "Processed %d files (%d failed); mean latency %.3fs, max %.3fs" % \
+            (self.n, self.nFailed, self.total/self.n, self.max)
+
+
+def _processAndReport(processFunc, inputFile, stats):
+    """Call processFunc(inputFile), reporting and recording how long it took
+
+    Returns (success, latency, message) where message is the value returned by processFunc, or the error
+    """
+    t0 = time.time()
+    try:
+        message = processFunc(inputFile)
+        success = True
+    except Exception as e:
+        traceback.print_exc()
+        message = "%s: %s" % (type(e).__name__, e)
+        success = False
+    latency = time.time() - t0
+
+    stats.add(latency, failed=not success)
+    print("%s %s %.3fs %s" % ("OK" if success else "FAILED", inputFile, latency, message or ""))
+    sys.stdout.flush()
+
+    return success, latency, message
+
+
+class _SpoolDirectory(object):
+    """Find the files in a spool directory that are ready to be processed
+
+    A file is ready once its size has stopped changing between two polls, and it hasn't already been
+    processed (i.e. its outputs are newer than it) or failed (i.e. it has a .failed marker)
+    """
+
+    def __init__(self, spoolDir, pattern):
+        self.spoolDir = spoolDir
+        self.pattern = pattern
+        self._sizes = {}
+
+    def _isDone(self, fileName):
+        if os.path.exists(fileName + ".failed"):
+            return True
+        catalog = makeOutputFileNames(fileName)["catalog"]
+        try:
+            return os.path.getmtime(catalog) >= os.path.getmtime(fileName)
+        except OSError:
+            return False
+
+    def poll(self):
+        """Return a sorted list of the files that are ready to process"""
+        ready = []
+        sizes = {}
+        for name in sorted(os.listdir(self.spoolDir)):
+            if not fnmatch.fnmatch(name, self.pattern) or isOutputFileName(name):
+                continue
+
+            fileName = os.path.join(self.spoolDir, name)
+            if self._isDone(fileName):
+                continue
+            try:
+                sizes[fileName] = os.path.getsize(fileName)
+            except OSError:             # it vanished
+                continue
+
+            if sizes[fileName] > 0 and self._sizes.get(fileName) == sizes[fileName]:
+                ready.append(fileName)
+
+        self._sizes = sizes
+        return ready
+
+    def markFailed(self, fileName, message):
+        with open(fileName + ".failed", "w") as fd:
+            print(message, file=fd)
+
+
+def _makeServerSocket(socketPath):
+    try:
+        os.remove(socketPath)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socketPath)
+    sock.listen(5)
+    return sock
+
+
+def _handleClient(conn, processFunc, stats, timeout):
+    """Process the filenames sent by a client, replying with a line per file"""
+    conn.settimeout(timeout)
+    rfile = conn.makefile("r")
+    wfile = conn.makefile("w")
+    try:
+        for line in rfile:
+            inputFile = line.strip()
+            if not inputFile:
+                continue
+
+            success, latency, message = _processAndReport(processFunc, inputFile, stats)
+            wfile.write("%s %s %.3f %s\n" %
+                        ("OK" if success else "FAILED", inputFile, latency, message or ""))
+            wfile.flush()
+    except (socket.timeout, socket.error) as e:
+        print("Dropping client: %s" % e, file=sys.stderr)
+    finally:
+        rfile.close()
+        wfile.close()
+        conn.close()
+
+
+def serve(processFunc, spoolDir=None, socketPath=None, pattern="*.fits", pollInterval=1.0,
+          clientTimeout=60.0):
+    """Process files from spoolDir and/or socketPath until interrupted
+
+    processFunc is called with the name of each file to process, and is expected to write its outputs
+    next to the input (see utils.makeOutputFileNames);  it may return a short string to be included in
+    the per-file report
+
+    When watching spoolDir, files matching pattern are processed once their size is stable;
+    files that fail are marked with a .failed file so that they aren't retried.
+
+    When listening on socketPath, clients send newline-separated filenames and receive a line
+    "OK|FAILED filename latency message" for each one
+    """
+    if spoolDir is None and socketPath is None:
+        raise ValueError("Please specify a spool directory and/or a socket to serve")
+
+    stats = LatencyStatistics()
+    spool = _SpoolDirectory(spoolDir, pattern) if spoolDir else None
+    server = _makeServerSocket(socketPath) if socketPath else None
+
+    print("Serving%s%s" % (" spool directory %s" % spoolDir if spoolDir else "",
+                           " socket %s" % socketPath if socketPath else ""))
+    sys.stdout.flush()
+    try:
+        while True:
+            if spool:
+                for inputFile in spool.poll():
+                    success, latency, message = _processAndReport(processFunc, inputFile, stats)
+                    if not success:
+                        spool.markFailed(inputFile, message)
+
+            if server:
+                readable = select.select([server], [], [], pollInterval)[0]
+                if readable:
+                    conn = server.accept()[0]
+                    _handleClient(conn, processFunc, stats, clientTimeout)
+            else:
+                time.sleep(pollInterval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.close()
+            os.remove(socketPath)
+        print(stats)
+
+    return stats
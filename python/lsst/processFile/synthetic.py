@@ -0,0 +1,119 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Make synthetic star fields to test and benchmark processFile without needing real data"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.pipe.base as pipeBase
+
+__all__ = ["makeStarField", "addBadPixels", "writeImage", "makeSyntheticFiles"]
+
+def makeStarField(width, height, nStar, psfSigma=2.0, sky=1000.0, minFlux=1e3, maxFlux=1e6, seed=1):
+    """Make an image of nStar Gaussian stars on a flat sky, with Poisson-like noise (the gain is 1)
+
+    The stars' fluxes are uniformly distributed in log(flux) between minFlux and maxFlux
+
+    Returns a Struct with the image and its variance (both float32 numpy arrays of shape (height, width)),
+    and the stars' positions x, y and fluxes
+    """
+    rng = np.random.RandomState(seed)
+
+    x = rng.uniform(0, width - 1, size=nStar)
+    y = rng.uniform(0, height - 1, size=nStar)
+    flux = np.exp(rng.uniform(np.log(minFlux), np.log(maxFlux), size=nStar))
+
+    model = np.zeros((height, width), dtype=np.float32)
+    r = int(5*psfSigma) + 1
+    norm = 1/(2*np.pi*psfSigma**2)
+    for xc, yc, f in zip(x, y, flux):
+        x0, x1 = max(int(xc) - r, 0), min(int(xc) + r + 1, width)
+        y0, y1 = max(int(yc) - r, 0), min(int(yc) + r + 1, height)
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        model[y0:y1, x0:x1] += f*norm*np.exp(-((xx - xc)**2 + (yy - yc)**2)/(2*psfSigma**2))
+
+    variance = model + sky
+    image = variance + np.sqrt(variance)*rng.normal(size=variance.shape).astype(np.float32)
+
+    return pipeBase.Struct(image=image, variance=variance, x=x, y=y, flux=flux)
+
+def addBadPixels(image, badFraction, badPixelValue=np.nan, seed=1):
+    """Set about badFraction of the pixels in image (a 2-d numpy array) to badPixelValue, in bad columns
+    and rectangular blemishes
+
+    Returns a boolean array of the pixels that were set
+    """
+    rng = np.random.RandomState(seed)
+    height, width = image.shape
+    bad = np.zeros(image.shape, dtype=bool)
+
+    nBad = int(badFraction*image.size)
+    while bad.sum() < nBad:
+        if rng.uniform() < 0.5:         # a (partial) bad column
+            x = rng.randint(width)
+            y0 = rng.randint(height)
+            bad[y0:y0 + rng.randint(1, height//4 + 2), x] = True
+        else:                           # a blemish
+            x0, y0 = rng.randint(width), rng.randint(height)
+            bad[y0:y0 + rng.randint(2, 20), x0:x0 + rng.randint(2, 20)] = True
+
+    image[bad] = badPixelValue
+    return bad
+
+def writeImage(array, fileName):
+    """Write a 2-d numpy array to fileName as an afw ImageF"""
+    height, width = array.shape
+    image = afwImage.ImageF(width, height)
+    image.getArray()[:] = array
+    image.writeFits(fileName)
+
+def makeSyntheticFiles(directory, width, height, nStar, weight=False, variance=False, badFraction=0.0,
+                       badPixelValue=np.nan, psfSigma=2.0, sky=1000.0, seed=1, name=None):
+    """Write a synthetic star field (see makeStarField) to directory, optionally with a weight or a
+    variance image, and with about badFraction of its pixels set to badPixelValue
+
+    Returns a Struct with the inputFile, weightFile and varianceFile (the last two may be None), and
+    the number of stars
+    """
+    if name is None:
+        name = "synthetic-%dx%d-%d" % (width, height, nStar)
+
+    field = makeStarField(width, height, nStar, psfSigma=psfSigma, sky=sky, seed=seed)
+    if badFraction > 0:
+        addBadPixels(field.image, badFraction, badPixelValue=badPixelValue, seed=seed)
+
+    inputFile = os.path.join(directory, name + ".fits")
+    writeImage(field.image, inputFile)
+
+    weightFile, varianceFile = None, None
+    if weight:
+        weightFile = os.path.join(directory, name + ".weight.fits")
+        writeImage(1/field.variance, weightFile)
+    if variance:
+        varianceFile = os.path.join(directory, name + ".variance.fits")
+        writeImage(field.variance, varianceFile)
+
+    return pipeBase.Struct(inputFile=inputFile, weightFile=weightFile, varianceFile=varianceFile,
+                           nStar=nStar)
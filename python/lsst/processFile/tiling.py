@@ -0,0 +1,146 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Split an image into overlapping tiles, and merge the catalogues measured on them
+
+Each tile owns a disjoint region of the image, and is processed with a border of extra pixels so that
+objects near the edge of its region are fully contained.  A family of sources (a deblended parent and
+all its children) is kept from the one tile that owns the parent's centroid, so objects in the overlaps
+appear exactly once in the merged catalogue.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+import lsst.pipe.base as pipeBase
+
+__all__ = ["makeTiles", "findCentralTile", "selectOwnedSources", "mergeTileCatalogs"]
+
+
+def _splitRange(x0, n, nSplit):
+    """Split [x0, x0 + n) into nSplit nearly-equal pieces, returning a list of (first, last) pairs"""
+    edges = [x0 + (i*n)//nSplit for i in range(nSplit + 1)]
+    return [(edges[i], edges[i + 1] - 1) for i in range(nSplit)]
+
+
+def makeTiles(bbox, tileSize, overlap):
+    """Divide bbox into tiles no more than tileSize pixels on a side
+
+    Returns a list of Structs with fields:
+      - ownedBBox: the part of the image whose sources belong to this tile (the ownedBBoxes
+                   are disjoint, and cover bbox)
+      - bbox:      the pixels to process;  ownedBBox grown by overlap and clipped to bbox
+    """
+    nx = max(1, -(-bbox.getWidth()//tileSize))
+    ny = max(1, -(-bbox.getHeight()//tileSize))
+
+    tiles = []
+    for y0, y1 in _splitRange(bbox.getMinY(), bbox.getHeight(), ny):
+        for x0, x1 in _splitRange(bbox.getMinX(), bbox.getWidth(), nx):
+            ownedBBox = afwGeom.Box2I(afwGeom.Point2I(x0, y0), afwGeom.Point2I(x1, y1))
+            tileBBox = afwGeom.Box2I(ownedBBox)
+            tileBBox.grow(overlap)
+            tileBBox.clip(bbox)
+
+            tiles.append(pipeBase.Struct(bbox=tileBBox, ownedBBox=ownedBBox))
+
+    return tiles
+
+
+def findCentralTile(tiles, bbox):
+    """Return the tile that owns the centre of bbox"""
+    centre = afwGeom.Point2I((bbox.getMinX() + bbox.getMaxX())//2, (bbox.getMinY() + bbox.getMaxY())//2)
+    for tile in tiles:
+        if tile.ownedBBox.contains(centre):
+            return tile
+
+    return tiles[0]
+
+
+def _getPositions(sources):
+    """Return arrays of the sources' x and y positions
+
+    We use the slot centroid, falling back to the first peak of the footprint if it's NaN
+    """
+    x = np.array([s.getX() for s in sources], dtype=float)
+    y = np.array([s.getY() for s in sources], dtype=float)
+
+    for i in np.where(np.logical_not(np.isfinite(x) & np.isfinite(y)))[0]:
+        peak = sources[int(i)].getFootprint().getPeaks()[0]
+        x[i], y[i] = peak.getFx(), peak.getFy()
+
+    return x, y
+
+
+def selectOwnedSources(sources, ownedBBox):
+    """Return the sources belonging to families whose parent lies within ownedBBox
+
+    Pixel i covers [i - 0.5, i + 0.5), so the ownedBBoxes of a set of tiles partition the plane.
+    Returns a new (shallow) catalogue
+    """
+    if len(sources) == 0:
+        return sources
+
+    x, y = _getPositions(sources)
+    ids = np.array([s.getId() for s in sources])
+    parents = np.array([s.getParent() for s in sources])
+
+    inside = (x >= ownedBBox.getMinX() - 0.5) & (x < ownedBBox.getMaxX() + 0.5) & \
+             (y >= ownedBBox.getMinY() - 0.5) & (y < ownedBBox.getMaxY() + 0.5)
+
+    isParent = parents == 0
+    ownedParents = ids[isParent & inside]
+    keep = np.where(isParent, inside, np.isin(parents, ownedParents))
+
+    owned = afwTable.SourceCatalog(sources.getTable())
+    for i in np.where(keep)[0]:
+        owned.append(sources[int(i)])
+
+    return owned
+
+
+def mergeTileCatalogs(catalogs, schema):
+    """Concatenate the catalogues from a set of tiles, renumbering the sources so that their IDs are unique
+
+    The catalogues should already have been trimmed with selectOwnedSources.  Children's parent IDs
+    are updated to match their parents' new IDs
+    """
+    merged = afwTable.SourceCatalog(schema)
+    merged.reserve(sum(len(cat) for cat in catalogs))
+
+    nextId = 1
+    for cat in catalogs:
+        start = len(merged)
+        merged.extend(cat, deep=True)
+
+        idMap = {}
+        for rec in merged[start:]:
+            idMap[rec.getId()] = nextId
+            rec.setId(nextId)
+            nextId += 1
+
+        for rec in merged[start:]:
+            if rec.getParent() != 0:
+                rec.setParent(idMap[rec.getParent()])
+
+    return merged
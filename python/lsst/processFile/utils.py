@@ -0,0 +1,47 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Small utilities shared by processFile's modes of operation"""
+from __future__ import absolute_import, division, print_function
+
+import os
+
+__all__ = ["outputSuffixes", "makeOutputFileNames", "isOutputFileName"]
+
+# Suffixes used for the outputs written next to an input file
+outputSuffixes = dict(calexp=".calexp.fits", catalog=".src.fits", calibCatalog=".calib.fits")
+
+
+def makeOutputFileNames(inputFile):
+    """Return a dict of the names of the outputs to write next to inputFile
+
+    The keys are those of outputSuffixes, e.g. foo.fits's catalog is foo.src.fits
+    """
+    root = os.path.splitext(inputFile)[0]
+    if root.endswith(".fits"):          # e.g. foo.fits.fz
+        root = os.path.splitext(root)[0]
+
+    return dict((k, root + suffix) for k, suffix in outputSuffixes.items())
+
+
+def isOutputFileName(fileName):
+    """Return True if fileName looks like one of the outputs named by makeOutputFileNames"""
+    return any(fileName.endswith(suffix) for suffix in outputSuffixes.values())
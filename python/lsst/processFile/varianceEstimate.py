@@ -0,0 +1,149 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Estimate the per-pixel variance of an image for which no variance or weight was provided
+
+Sigma-clipping every pixel of a large frame costs far more than a single number deserves, so the
+variance may instead be estimated from a strided subsample of the pixels (using the same clipping
+as afw's VARIANCECLIP), or from the MAD of a grid of small boxes.  Each estimate comes with its
+(1-sigma) statistical error, so you can check that the subsample is large enough
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import lsst.afw.math as afwMath
+import lsst.pipe.base as pipeBase
+
+__all__ = ["varianceEstimators", "estimateVariance"]
+
+varianceEstimators = {
+    "full": "The sigma-clipped variance of every pixel (afw's VARIANCECLIP)",
+    "subsample": "The sigma-clipped variance of a strided subsample of about varianceSamplePixels pixels",
+    "boxes": "The median of the variances estimated from the MAD of each of a grid of boxes, containing "
+             "about varianceSamplePixels pixels in all;  unlike the clipped variance this isn't "
+             "inflated by gradients in the background",
+}
+
+_nBoxPerSide = 32                       # the boxes form an _nBoxPerSide x _nBoxPerSide grid
+
+
+def estimateVariance(maskedImage, badBit, estimator="full", nSample=100000, numSigmaClip=3.0, numIter=3):
+    """Estimate the variance of the pixels in maskedImage that don't have badBit set
+
+    estimator is one of varianceEstimators;  nSample is the approximate number of pixels used by
+    the subsample and boxes estimators.  numSigmaClip and numIter are the clipping parameters (the
+    defaults are afw's)
+
+    Returns a Struct with the variance, its error, and the number of pixels used (nPixel)
+    """
+    if estimator == "full":
+        sctrl = afwMath.StatisticsControl()
+        sctrl.setAndMask(badBit)
+        sctrl.setNumSigmaClip(numSigmaClip)
+        sctrl.setNumIter(numIter)
+        stats = afwMath.makeStatistics(maskedImage, afwMath.VARIANCECLIP | afwMath.NPOINT, sctrl)
+        variance, nPixel = stats.getValue(afwMath.VARIANCECLIP), int(stats.getValue(afwMath.NPOINT))
+        return pipeBase.Struct(variance=variance, nPixel=nPixel,
+                               error=variance*np.sqrt(2.0/max(1, nPixel - 1)))  # for Gaussian noise
+
+    image = maskedImage.getImage().getArray()
+    mask = maskedImage.getMask().getArray()
+    height, width = image.shape
+
+    if estimator == "subsample":
+        step = max(1, int(np.sqrt(height*width/nSample)))
+        values = _goodValues(image[step//2::step, step//2::step], mask[step//2::step, step//2::step], badBit)
+        return _clippedVariance(values, numSigmaClip, numIter)
+    elif estimator == "boxes":
+        return _boxVariance(image, mask, badBit, nSample)
+    else:
+        raise ValueError("Unknown variance estimator %s; please choose one of %s" %
+                         (estimator, ", ".join(sorted(varianceEstimators))))
+
+
+def _goodValues(image, mask, badBit):
+    """Return the finite values of image (a numpy array) where mask doesn't have badBit set, as float64"""
+    good = np.logical_and(np.isfinite(image), (mask & badBit) == 0)
+    return image[good].astype(np.float64)
+
+
+def _clippedVariance(values, numSigmaClip, numIter):
+    """Return a Struct with the sigma-clipped variance of values, its error, the number used, and their mean
+
+    The clipping follows afw's:  start from the median and the interquartile range, and then
+    numIter times keep the values within numSigmaClip standard deviations of the mean of the
+    previous iteration.  The error includes the contribution of the clipped values' kurtosis
+    """
+    if len(values) < 2:
+        return pipeBase.Struct(variance=np.nan, error=np.nan, nPixel=len(values),
+                               mean=values.mean() if len(values) else np.nan)
+
+    q1, center, q3 = np.percentile(values, [25, 50, 75])
+    sigma = 0.741*(q3 - q1)
+    kept = values
+    for i in range(numIter):
+        kept = values[np.abs(values - center) < numSigmaClip*sigma] if sigma > 0 else values
+        if len(kept) < 2:
+            kept = values
+            break
+        center, sigma = kept.mean(), kept.std(ddof=1)
+
+    n = len(kept)
+    deviations = kept - kept.mean()
+    variance = np.dot(deviations, deviations)/(n - 1)
+    m4 = np.mean(deviations**4)
+    errorSq = (m4 - variance**2*(n - 3)/(n - 1))/n     # the variance of the sample variance
+
+    return pipeBase.Struct(variance=variance, error=np.sqrt(max(errorSq, 0.0)), nPixel=n, mean=kept.mean())
+
+
+def _boxVariance(image, mask, badBit, nSample):
+    """Return a Struct with the median of the MAD-based variances of a grid of boxes, its error,
+    and the number of pixels used
+
+    The boxes are small, so that most of them contain no bright objects
+    """
+    height, width = image.shape
+    boxSize = max(2, int(np.sqrt(nSample)/_nBoxPerSide))
+    boxWidth, boxHeight = min(boxSize, width), min(boxSize, height)
+
+    variances, nPixel = [], 0
+    for yc in (np.arange(_nBoxPerSide) + 0.5)*height/_nBoxPerSide:
+        y0 = min(max(0, int(yc) - boxHeight//2), height - boxHeight)
+        for xc in (np.arange(_nBoxPerSide) + 0.5)*width/_nBoxPerSide:
+            x0 = min(max(0, int(xc) - boxWidth//2), width - boxWidth)
+            values = _goodValues(image[y0:y0 + boxHeight, x0:x0 + boxWidth],
+                                 mask[y0:y0 + boxHeight, x0:x0 + boxWidth], badBit)
+            if len(values) < 2:
+                continue
+            mad = np.median(np.abs(values - np.median(values)))
+            variances.append((1.4826*mad)**2)
+            nPixel += len(values)
+
+    if not variances:
+        return pipeBase.Struct(variance=np.nan, error=np.nan, nPixel=0)
+
+    variances = np.array(variances)         # a few boxes contain stars, so use a robust scatter
+    scatter = 1.4826*np.median(np.abs(variances - np.median(variances)))
+    error = 1.2533*scatter/np.sqrt(len(variances)) if len(variances) > 1 else np.nan
+
+    return pipeBase.Struct(variance=float(np.median(variances)), error=error, nPixel=nPixel)
@@ -0,0 +1,402 @@
+#
+# LSST Data Management System
+# Copyright 2008-2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""A queue of files to process, shared between processFile instances on several hosts via a directory
+
+There is no scheduler or broker:  the queue is a directory (on a filesystem that all the hosts can
+see, e.g. NFS or Lustre) with subdirectories
+    pending   One file per item waiting to be processed, containing its line of a manifest
+    claimed   The items being processed, renamed to ITEM~HOST~PID by the worker that claimed them
+    done      A JSON record of each item that was processed (host, pid, start and end times, ...)
+    failed    The same for the items that failed, including the error
+    tmp       Files being written, which are renamed into place when they're complete
+A worker claims an item by renaming it from pending to claimed;  rename is atomic, so if several
+workers try to claim the same item only one succeeds and the others move on to the next.  While it
+processes an item the worker touches its claimed file every heartbeat seconds;  an item whose claimed
+file hasn't been touched for timeout seconds (because its worker died, or its host crashed) is renamed
+back to pending by the next worker to look for work.  The heartbeat is sent by a forked process rather
+than a thread, as the stack's C++ code doesn't release the GIL.
+
+The hosts' clocks needn't agree:  the claimed files' mtimes are set by the filesystem (e.g. the NFS
+server), and are compared with the mtime of a file that the worker looking for stale items has just
+touched in tmp, rather than its own clock.  A heartbeat may take a while to be seen by other hosts,
+though, so timeout should be at least twice the heartbeat interval plus the time that the filesystem
+caches files' attributes (up to 60s with NFS's default acregmax) and its timestamps' granularity
+(e.g. 2s);  the default (600s, with a heartbeat every 60s) is safe on NFS.
+"""
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import errno
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import lsst.pipe.base as pipeBase
+
+__all__ = ["WorkQueue", "runWorker", "summarizeQueue", "formatQueueSummary"]
+
+_subdirs = ["pending", "claimed", "done", "failed", "tmp"]
+
+
+class WorkQueue(object):
+    """A queue of work items in the directory queueDir, created if needed (see the module docstring)
+
+    Items claimed by a worker that hasn't sent a heartbeat for timeout seconds are returned to the
+    queue;  the heartbeat is sent every heartbeat seconds (default: timeout/10).  See the module docstring
+    for the minimum safe timeout.  host identifies this worker in the records of the items that it
+    processes (default: the hostname)
+    """
+
+    def __init__(self, queueDir, timeout=600.0, heartbeat=None, host=None):
+        self.queueDir = queueDir
+        self.timeout = timeout
+        self.heartbeatInterval = heartbeat if heartbeat else timeout/10.0
+        self.host = (host if host else socket.gethostname()).replace("~", "-")
+        self.pid = os.getpid()
+
+        for subdir in _subdirs:
+            try:
+                os.makedirs(self._path(subdir))
+            except OSError as e:            # maybe another worker just created it
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, subdir, name=""):
+        return os.path.join(self.queueDir, subdir, name)
+
+    def _write(self, subdir, name, contents):
+        """Write contents to subdir/name atomically, by writing it to tmp and then renaming it"""
+        tmpFile = self._path("tmp", "%s.%s.%d" % (name, self.host, self.pid))
+        with open(tmpFile, "w") as fd:
+            fd.write(contents)
+        os.rename(tmpFile, self._path(subdir, name))
+
+    def listItems(self, subdir):
+        """Return the sorted names of the files in subdir (one of pending, claimed, done, failed)"""
+        return sorted(os.listdir(self._path(subdir)))
+
+    def enqueue(self, lines):
+        """Add the items in lines (lines of a manifest, as strings) to the queue
+
+        The items are claimed in the order they're given (e.g. largest first), after any items
+        enqueued previously.  Returns the items' names
+        """
+        prefix = "%015d-%s-%d" % (int(1000*time.time()), self.host, self.pid)
+        names = []
+        for i, line in enumerate(lines):
+            name = "%s-%06d.item" % (prefix, i)
+            self._write("pending", name, line.strip() + "\n")
+            names.append(name)
+
+        return names
+
+    def claim(self):
+        """Claim the next pending item, returning a Struct (name, line, path, startTime) or None
+
+        Stale items are returned to the queue first (see reclaimStale)
+        """
+        self.reclaimStale()
+
+        for name in self.listItems("pending"):
+            if not name.endswith(".item"):
+                continue
+
+            path = self._path("claimed", "%s~%s~%d" % (name, self.host, self.pid))
+            try:
+                os.rename(self._path("pending", name), path)
+            except OSError as e:            # another worker beat us to it
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+
+            os.utime(path, None)            # our first heartbeat
+            with open(path) as fd:
+                line = fd.read().strip()
+
+            return pipeBase.Struct(name=name, line=line, path=path, startTime=time.time())
+
+        return None
+
+    def reclaimStale(self, verbose=True):
+        """Return the claimed items that haven't had a heartbeat for timeout seconds to the queue
+
+        The time since each item's heartbeat is measured by the filesystem's clock (see _now).
+        Returns the number of items reclaimed
+        """
+        nReclaimed = 0
+        now = self._now()
+        for claimedName in self.listItems("claimed"):
+            path = self._path("claimed", claimedName)
+            try:
+                stat = os.stat(path)
+            except OSError:                 # it's just been completed or reclaimed
+                continue
+            if now - max(stat.st_mtime, stat.st_ctime) <= self.timeout:  # renaming updates st_ctime
+                continue
+
+            try:
+                os.rename(path, self._path("pending", claimedName.split("~")[0]))
+            except OSError:
+                continue
+            nReclaimed += 1
+            if verbose:
+                name, host, pid = claimedName.split("~")
+                print("Reclaimed %s from %s:%s, which hasn't sent a heartbeat for %.0fs" %
+                      (name, host, pid, now - stat.st_mtime), file=sys.stderr)
+
+        return nReclaimed
+
+    def _now(self):
+        """Return the current time according to the queue's filesystem
+
+        The heartbeats' mtimes are set by the filesystem (e.g. the NFS server) whose clock may differ
+        from ours, so compare them with the mtime of a file that we've just touched
+        """
+        probe = self._path("tmp", ".clock.%s.%d" % (self.host, self.pid))
+        try:
+            with open(probe, "a"):
+                pass
+            os.utime(probe, None)
+            return os.stat(probe).st_mtime
+        finally:
+            try:
+                os.remove(probe)
+            except OSError:
+                pass
+
+    def release(self, item):
+        """Return item (as returned by claim) to the queue without processing it"""
+        try:
+            os.rename(item.path, self._path("pending", item.name))
+        except OSError:                     # it's already been reclaimed
+            pass
+
+    def complete(self, item, summary=None, error=None):
+        """Record that item (as returned by claim) was processed, or failed with error (a string)
+
+        summary is a dict of extra values (e.g. nSource) to record
+        """
+        endTime = time.time()
+        record = dict(summary if summary else {})
+        record.update(host=self.host, pid=self.pid, line=item.line, start=item.startTime, end=endTime,
+                      wallTime=endTime - item.startTime, error=error)
+        self._write("failed" if error else "done", item.name, json.dumps(record, sort_keys=True) + "\n")
+
+        try:
+            os.remove(item.path)
+        except OSError:                     # it was reclaimed while we were processing it
+            try:
+                os.remove(self._path("pending", item.name))
+            except OSError:                 # ... and someone else has claimed it; they'll redo it
+                pass
+
+    def isEmpty(self):
+        """Return True if no items are pending or being processed"""
+        return not self.listItems("pending") and not self.listItems("claimed")
+
+    @contextlib.contextmanager
+    def heartbeat(self, item):
+        """Touch item's claimed file every self.heartbeatInterval seconds while the block is running"""
+        if not hasattr(os, "fork"):
+            with self._heartbeatThread(item):
+                yield
+            return
+
+        parentPid = os.getpid()
+        sys.stdout.flush()                  # or the child will print our buffered output too
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:                        # the child
+            try:
+                while os.getppid() == parentPid and os.path.exists(item.path):
+                    os.utime(item.path, None)
+                    time.sleep(self.heartbeatInterval)
+            except Exception:
+                pass
+            finally:
+                os._exit(0)                 # don't run the parent's atexit handlers or flush its buffers
+
+        try:
+            yield
+        finally:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+            os.waitpid(pid, 0)
+
+    @contextlib.contextmanager
+    def _heartbeatThread(self, item):
+        stop = threading.Event()
+
+        def beat():
+            while not stop.is_set() and os.path.exists(item.path):
+                try:
+                    os.utime(item.path, None)
+                except OSError:
+                    break
+                stop.wait(self.heartbeatInterval)
+
+        thread = threading.Thread(target=beat)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+
+def runWorker(queue, processFunc, pollInterval=None, verbose=False):
+    """Process items from queue (a WorkQueue) until none are pending or being processed by other workers
+
+    processFunc is called with each item's line of the manifest, and may return a dict of values to
+    record (e.g. nSource);  if it raises the item is recorded as failed.  While other workers are
+    still processing items we wait (checking every pollInterval seconds; default: queue.heartbeatInterval)
+    in case they die and their items are reclaimed
+
+    Returns a Struct with the number of items processed (nDone) and failed (nFailed)
+    """
+    nDone, nFailed = 0, 0
+    while True:
+        item = queue.claim()
+        if item is None:
+            if queue.isEmpty():
+                break
+            time.sleep(pollInterval if pollInterval else queue.heartbeatInterval)
+            continue
+
+        if verbose:
+            print("%s:%d claimed %s" % (queue.host, queue.pid, item.line))
+        summary, error = None, None
+        try:
+            with queue.heartbeat(item):
+                summary = processFunc(item.line)
+        except KeyboardInterrupt:
+            queue.release(item)
+            raise
+        except Exception:
+            error = traceback.format_exc()
+            print("Failed to process %s:\n%s" % (item.line, error), file=sys.stderr)
+
+        queue.complete(item, summary, error)
+        if error:
+            nFailed += 1
+        else:
+            nDone += 1
+
+    if verbose:
+        print("%s:%d processed %d items (%d failed)" % (queue.host, queue.pid, nDone + nFailed, nFailed))
+
+    return pipeBase.Struct(nDone=nDone, nFailed=nFailed)
+
+
+def summarizeQueue(queueDir):
+    """Summarize the progress of the queue in queueDir, and the throughput of each host
+
+    Returns a Struct with the number of items pending, claimed, done, and failed, and a dict hosts
+    of Structs with each host's nDone, nFailed, nClaimed, nWorker (the number of processes that
+    have completed items), busyTime (the total wall time spent processing items), firstStart and
+    lastEnd (times in seconds since the epoch), and nSource (the number of sources measured)
+    """
+    if not os.path.isdir(os.path.join(queueDir, "pending")):
+        raise RuntimeError("%s is not a work queue" % queueDir)
+
+    queue = WorkQueue(queueDir)
+    hosts = {}
+
+    def getHost(host):
+        if host not in hosts:
+            hosts[host] = pipeBase.Struct(nDone=0, nFailed=0, nClaimed=0, pids=set(), busyTime=0.0,
+                                          firstStart=None, lastEnd=None, nSource=0)
+        return hosts[host]
+
+    for subdir in ("done", "failed"):
+        for name in queue.listItems(subdir):
+            try:
+                with open(queue._path(subdir, name)) as fd:
+                    record = json.load(fd)
+            except (IOError, ValueError):
+                continue
+
+            host = getHost(record["host"])
+            if subdir == "done":
+                host.nDone += 1
+            else:
+                host.nFailed += 1
+            host.pids.add(record["pid"])
+            host.busyTime += record["wallTime"]
+            host.nSource += record.get("nSource", 0)
+            host.firstStart = min(host.firstStart, record["start"]) if host.firstStart else record["start"]
+            host.lastEnd = max(host.lastEnd, record["end"]) if host.lastEnd else record["end"]
+
+    claimed = queue.listItems("claimed")
+    for claimedName in claimed:
+        getHost(claimedName.split("~")[1]).nClaimed += 1
+
+    for host in hosts.values():
+        host.nWorker = len(host.pids)
+        del host.pids
+
+    return pipeBase.Struct(nPending=len(queue.listItems("pending")), nClaimed=len(claimed),
+                           nDone=sum(host.nDone for host in hosts.values()),
+                           nFailed=sum(host.nFailed for host in hosts.values()), hosts=hosts)
+
+
+def formatQueueSummary(summary):
+    """Return summary (as returned by summarizeQueue) as a list of lines to print
+
+    The throughput of each host is the number of items it completed per hour between the start of its
+    first item and the end of its last
+    """
+    lines = ["Queue: %d pending, %d being processed, %d done, %d failed" %
+             (summary.nPending, summary.nClaimed, summary.nDone, summary.nFailed)]
+    if not summary.hosts:
+        return lines
+
+    fmt = "%-24s %7s %7s %7s %7s %10s %10s %10s %10s"
+    lines.append(fmt % ("host", "workers", "done", "failed", "active", "busy(s)", "span(s)",
+                        "s/item", "items/hour"))
+    totals = pipeBase.Struct(nWorker=0, nDone=0, nFailed=0, nClaimed=0, busyTime=0.0, span=0.0, rate=0.0)
+    for name, host in sorted(summary.hosts.items()):
+        nItem = host.nDone + host.nFailed
+        span = host.lastEnd - host.firstStart if nItem else 0.0
+        rate = 3600*nItem/span if span > 0 else 0.0
+        lines.append(fmt % (name, host.nWorker, host.nDone, host.nFailed, host.nClaimed,
+                            "%.1f" % host.busyTime, "%.1f" % span,
+                            "%.2f" % (host.busyTime/nItem) if nItem else "-", "%.1f" % rate))
+        for key, value in [("nWorker", host.nWorker), ("nDone", host.nDone), ("nFailed", host.nFailed),
+                           ("nClaimed", host.nClaimed), ("busyTime", host.busyTime), ("rate", rate)]:
+            setattr(totals, key, getattr(totals, key) + value)
+        totals.span = max(totals.span, span)
+
+    nItem = totals.nDone + totals.nFailed
+    lines.append(fmt % ("total", totals.nWorker, totals.nDone, totals.nFailed, totals.nClaimed,
+                        "%.1f" % totals.busyTime, "%.1f" % totals.span,
+                        "%.2f" % (totals.busyTime/nItem) if nItem else "-", "%.1f" % totals.rate))
+
+    return lines
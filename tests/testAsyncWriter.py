@@ -0,0 +1,117 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import unittest
+
+import lsst.utils.tests
+from lsst.processFile.asyncWriter import AsyncWriter
+from lsst.processFile.metrics import StageTimer
+
+
+class AsyncWriterTestCase(unittest.TestCase):
+    """Test writing files in background processes"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeFile(self, fileName, nByte, timer=None):
+        if timer:
+            with timer("write") as stage:
+                stage["count"] = nByte
+                with open(fileName, "wb") as fd:
+                    fd.write(b"x"*nByte)
+        else:
+            with open(fileName, "wb") as fd:
+                fd.write(b"x"*nByte)
+
+    def testWrite(self):
+        for maxPending in (0, 1, 3):
+            timer = StageTimer()
+            fileNames = [os.path.join(self.tmpDir, "%d-%d.dat" % (maxPending, i)) for i in range(5)]
+            with AsyncWriter(maxPending=maxPending, timer=timer) as writer:
+                for i, fileName in enumerate(fileNames):
+                    writer.submit(lambda fileName=fileName, i=i: self.writeFile(fileName, 100*(i + 1), timer),
+                                  [fileName, None], "file %d" % i)
+
+            for i, fileName in enumerate(fileNames):
+                self.assertEqual(os.path.getsize(fileName), 100*(i + 1))
+            self.assertEqual(writer.nFile, 5)
+            self.assertEqual(writer.nByte, 100*(1 + 2 + 3 + 4 + 5))
+            self.assertEqual(sorted(stage["count"] for stage in timer.stages), [100, 200, 300, 400, 500])
+
+    def testErrorsAreRaised(self):
+        badFile = os.path.join(self.tmpDir, "noSuchDirectory", "foo.dat")
+        writer = AsyncWriter(maxPending=2)
+        writer.submit(lambda: self.writeFile(badFile, 10), [badFile], "bad file")
+        with self.assertRaises(IOError):
+            writer.close()
+
+        with self.assertRaises(IOError):
+            with AsyncWriter(maxPending=2) as writer:
+                writer.submit(lambda: self.writeFile(badFile, 10), [badFile], "bad file")
+
+
+    def testOnErrorIsPassedKey(self):
+        goodFile = os.path.join(self.tmpDir, "foo.dat")
+        badFile = os.path.join(self.tmpDir, "noSuchDirectory", "foo.dat")
+        for maxPending in (0, 2):
+            errors = []
+            with AsyncWriter(maxPending=maxPending, onError=lambda key, error: errors.append(key)) as writer:
+                writer.submit(lambda: self.writeFile(goodFile, 10), [goodFile], "input.fits", key=0)
+                writer.submit(lambda: self.writeFile(badFile, 10), [badFile], "input.fits", key=1)
+                writer.submit(lambda: self.writeFile(badFile, 10), [badFile], "other.fits")
+            self.assertEqual(errors, [1, "other.fits"])
+
+
+    def testLongErrorsDontBlock(self):
+        """A child whose summary is larger than the pipe's buffer is read before we wait for it"""
+        def writeFunc():
+            raise RuntimeError("x"*(1024**2))
+
+        errors = []
+        with AsyncWriter(maxPending=2, onError=lambda key, error: errors.append(error)) as writer:
+            for i in range(3):
+                writer.submit(writeFunc, [], "file %d" % i)
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(all("x"*(1024**2) in error for error in errors))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
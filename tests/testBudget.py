@@ -0,0 +1,120 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import collections
+import sys
+import time
+
+import unittest
+
+import lsst.utils.tests
+import lsst.daf.base as dafBase
+import lsst.pipe.base as pipeBase
+from lsst.processFile.budget import BudgetConfig, Budget, getFallbacks, deblendLimits, trimmedPlugins
+
+
+class BudgetTestCase(unittest.TestCase):
+    """Test the per-file budgets and their fallbacks"""
+
+    def testUnlimited(self):
+        budget = Budget(BudgetConfig())
+        self.assertFalse(budget.isLimited())
+        self.assertFalse(budget.fallBack("simplePsf", 0.0, extraMemory=1e15))
+        self.assertEqual(budget.fallbacks, [])
+
+    def testWallTime(self):
+        config = BudgetConfig()
+        config.wallTime = 0.1
+        budget = Budget(config)
+        self.assertFalse(budget.fallBack("simplePsf", 0.5))
+        time.sleep(0.06)
+        self.assertTrue(budget.fallBack("deblendLimits", 0.5))
+        self.assertEqual(budget.fallbacks, ["deblendLimits"])
+
+    def testMemory(self):
+        config = BudgetConfig()
+        config.memory = 1024.0          # GB;  more than we're using
+        budget = Budget(config)
+        self.assertFalse(budget.fallBack("deblendLimits", 0.5))
+        self.assertTrue(budget.fallBack("deblendLimits", 0.5, extraMemory=2*1024.0**4))
+        self.assertTrue(budget.fallBack("deblendLimits", 0.5, extraMemory=lambda: 2*1024.0**4))
+
+    def testExtraMemoryIsOnlyEstimatedIfNeeded(self):
+        def extraMemory():
+            raise AssertionError("extraMemory shouldn't have been called")
+
+        self.assertFalse(Budget(BudgetConfig()).fallBack("deblendLimits", 0.5, extraMemory=extraMemory))
+
+        config = BudgetConfig()
+        config.wallTime = 1000.0
+        self.assertFalse(Budget(config).fallBack("deblendLimits", 0.5, extraMemory=extraMemory))
+
+        config.wallTime = 1e-6
+        self.assertTrue(Budget(config).fallBack("deblendLimits", 0.5, extraMemory=extraMemory))
+
+    def testMetadata(self):
+        config = BudgetConfig()
+        config.wallTime = 1e-6
+        budget = Budget(config)
+        self.assertTrue(budget.fallBack("trimmedMeasurement", 0.5))
+
+        metadata = dafBase.PropertyList()
+        budget.setMetadata(metadata)
+        self.assertFalse(metadata.get("BUDGET_SIMPLEPSF"))
+        self.assertTrue(metadata.get("BUDGET_TRIMMEDMEASUREMENT"))
+        self.assertEqual(getFallbacks(metadata), ["trimmedMeasurement"])
+        self.assertEqual(getFallbacks(dafBase.PropertyList()), [])
+        self.assertEqual(getFallbacks(None), [])
+
+    def testDeblendLimits(self):
+        config = BudgetConfig()
+        for maxFootprintArea, expected in [(0, config.deblendMaxFootprintArea), (100, 100)]:
+            task = pipeBase.Struct(config=pipeBase.Struct(maxFootprintArea=maxFootprintArea,
+                                                          maxNumberOfPeaks=0))
+            with deblendLimits(task, config):
+                self.assertEqual(task.config.maxFootprintArea, expected)
+                self.assertEqual(task.config.maxNumberOfPeaks, config.deblendMaxNumberOfPeaks)
+            self.assertEqual(task.config.maxFootprintArea, maxFootprintArea)
+            self.assertEqual(task.config.maxNumberOfPeaks, 0)
+
+    def testTrimmedPlugins(self):
+        plugins = collections.OrderedDict((name, name.upper()) for name in
+                                          ["base_SdssCentroid", "base_GaussianFlux", "base_PsfFlux"])
+        task = pipeBase.Struct(plugins=plugins)
+        with trimmedPlugins(task, ["base_PsfFlux", "base_SdssCentroid", "base_NoSuchPlugin"]):
+            self.assertEqual(list(task.plugins.items()),
+                             [("base_SdssCentroid", "BASE_SDSSCENTROID"), ("base_PsfFlux", "BASE_PSFFLUX")])
+        self.assertIs(task.plugins, plugins)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
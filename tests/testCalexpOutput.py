@@ -0,0 +1,95 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import unittest
+import numpy as np
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+import lsst.utils.tests
+from lsst.processFile.calexpOutput import writeCalexp
+
+
+class CalexpOutputTestCase(unittest.TestCase):
+    """Test writing compressed calexps, and calexps without some of their planes"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.tmpDir, "calexp.fits")
+
+        bbox = afwGeom.Box2I(afwGeom.Point2I(10, 20), afwGeom.Extent2I(200, 150))
+        self.exposure = afwImage.ExposureF(bbox)
+        mi = self.exposure.getMaskedImage()
+        rand = np.random.RandomState(1)
+        mi.getImage().getArray()[:] = 1000 + 10*rand.normal(size=(150, 200))
+        mi.getVariance().getArray()[:] = 100 + rand.uniform(size=(150, 200))
+        mi.getMask().getArray()[:] = rand.randint(0, 4, size=(150, 200))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testCompression(self):
+        uncompressed = writeCalexp(self.exposure, self.fileName)
+        self.assertAlmostEqual(uncompressed.nByteUncompressed/uncompressed.nByte, 1.0, delta=0.2)
+
+        compressed = writeCalexp(self.exposure, self.fileName, quantizeLevel=16)
+        self.assertLess(compressed.nByte, uncompressed.nByte)
+
+        mi, readMi = self.exposure.getMaskedImage(), afwImage.ExposureF(self.fileName).getMaskedImage()
+        self.assertTrue(np.all(mi.getMask().getArray() == readMi.getMask().getArray()))
+        self.assertLess(np.max(np.abs(mi.getImage().getArray() - readMi.getImage().getArray())), 10/16.0)
+
+    def testPlanes(self):
+        writeCalexp(self.exposure, self.fileName, planes="scalarVariance")
+        calexp = afwImage.ExposureF(self.fileName)
+        median = np.median(self.exposure.getMaskedImage().getVariance().getArray())
+        self.assertAlmostEqual(calexp.getMetadata().get("VARIANCE_SCALAR"), median, places=4)
+        self.assertTrue(np.all(calexp.getMaskedImage().getVariance().getArray() == np.float32(median)))
+        self.assertNotIn("VARIANCE_SCALAR", self.exposure.getMetadata().names())
+
+        writeCalexp(self.exposure, self.fileName, planes="psfOnly")
+        calexp = afwImage.ExposureF(self.fileName)
+        self.assertEqual(calexp.getWidth()*calexp.getHeight(), 1)
+        self.assertEqual(calexp.getMetadata().get("CALEXP_WIDTH"), 200)
+        self.assertEqual(calexp.getMetadata().get("CALEXP_Y0"), 20)
+
+        with self.assertRaises(ValueError):
+            writeCalexp(self.exposure, self.fileName, planes="noSuchPlanes")
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
@@ -0,0 +1,115 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import unittest
+import numpy as np
+
+import lsst.afw.table as afwTable
+import lsst.utils.tests
+from lsst.processFile.combinedCatalog import CombinedCatalogWriter, getCatalogColumns, _hdf5ChunkRows
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class CombinedCatalogTestCase(unittest.TestCase):
+    """Test appending many catalogues to a single columnar file"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def makeCatalog(self, nSource):
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        fluxKey = schema.addField("base_PsfFlux_flux", type=float, doc="flux")
+        flagKey = schema.addField("base_PsfFlux_flag", type="Flag", doc="flag")
+        schema.addField("other", type=np.int32, doc="an integer")
+        catalog = afwTable.SourceCatalog(schema)
+        for i in range(nSource):
+            rec = catalog.addNew()
+            rec.set(fluxKey, 10.0*i)
+            rec.set(flagKey, i%2 == 1)
+
+        return catalog
+
+    def testColumnSelection(self):
+        catalog = self.makeCatalog(3)
+        names = [name for name, value in getCatalogColumns(catalog, ["base_PsfFlux_*"])]
+        self.assertEqual(sorted(names), ["base_PsfFlux_flag", "base_PsfFlux_flux", "id"])
+
+        columns = dict(getCatalogColumns(catalog))
+        self.assertIn("other", columns)
+        self.assertEqual(list(columns["base_PsfFlux_flag"]), [False, True, False])
+
+    @unittest.skipUnless(pyarrow, "pyarrow is not available")
+    def testParquet(self):
+        fileName = os.path.join(self.tmpDir, "sources.parquet")
+        with CombinedCatalogWriter(fileName, columns=["base_PsfFlux_*"]) as writer:
+            for i, nSource in enumerate([3, 0, 5]):
+                writer.append(self.makeCatalog(nSource), "input%d.fits" % i, "r")
+
+        parquetFile = pyarrow.parquet.ParquetFile(fileName)
+        self.assertEqual(parquetFile.metadata.num_row_groups, 3)
+        table = pyarrow.parquet.read_table(fileName, columns=["base_PsfFlux_flux", "inputFile"]).to_pydict()
+        self.assertEqual(table["base_PsfFlux_flux"], [0, 10, 20, 0, 10, 20, 30, 40])
+        self.assertEqual(table["inputFile"], ["input0.fits"]*3 + ["input2.fits"]*5)
+
+    @unittest.skipUnless(h5py, "h5py is not available")
+    def testHdf5(self):
+        fileName = os.path.join(self.tmpDir, "sources.h5")
+        with CombinedCatalogWriter(fileName) as writer:
+            for i, nSource in enumerate([3, 0, 5]):
+                writer.append(self.makeCatalog(nSource), "input%d.fits" % i, "r")
+
+        with h5py.File(fileName, "r") as fd:
+            self.assertEqual(list(fd["sources/fileIndex"][:]), [0]*3 + [2]*5)
+            self.assertEqual(list(fd["sources/base_PsfFlux_flux"][:]), [0, 10, 20, 0, 10, 20, 30, 40])
+            self.assertEqual(list(fd["files/nRow"][:]), [3, 0, 5])
+            self.assertEqual(fd["files/inputFile"][1].decode(), "input1.fits")
+            self.assertEqual(fd["sources/base_PsfFlux_flux"].chunks, (_hdf5ChunkRows,))  # not the 3 rows
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
@@ -0,0 +1,141 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import sys
+
+import unittest
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.utils.tests
+from lsst.processFile.defectInterpolation import interpolateFromMask
+from lsst.processFile.processFile import ProcessFileConfig, makeTasks, interpolateDefects
+from lsst.processFile.synthetic import makeStarField
+
+
+def makeMaskedImage(array, badFraction, seed=1):
+    """Return a MaskedImageF of array with about badFraction of its pixels (and the first 5 columns) BAD"""
+    rng = np.random.RandomState(seed)
+    mi = afwImage.MaskedImageF(array.shape[1], array.shape[0])
+    mi.getImage().getArray()[:] = array
+    mi.getVariance().set(1.0)
+    mask = mi.getMask().getArray()
+    mask[:] = 0
+    mask[rng.uniform(size=array.shape) < badFraction] |= mi.getMask().getPlaneBitMask("BAD")
+    mask[:, :5] |= mi.getMask().getPlaneBitMask("BAD")
+
+    return mi
+
+
+class TestDefectInterpolation(unittest.TestCase):
+    """Test the vectorized interpolation over masked pixels"""
+
+    def testPlaneIsReproduced(self):
+        y, x = np.mgrid[0:100, 0:150]
+        plane = (1000 + 3*x + 2*y).astype(np.float32)
+        mi = makeMaskedImage(plane, 0.2)
+        bad = (mi.getMask().getArray() & mi.getMask().getPlaneBitMask("BAD")) != 0
+
+        nInterp = interpolateFromMask(mi, ["BAD"], fallbackValue=-1.0, chunkRows=16)
+        self.assertEqual(nInterp, bad.sum())
+
+        image = mi.getImage().getArray()
+        interior = bad.copy()
+        interior[:, :5] = False
+        np.testing.assert_allclose(image[interior], plane[interior], rtol=1e-6)
+        np.testing.assert_array_equal(image[~bad], plane[~bad])
+        self.assertTrue(np.all(image[:, :5] == -1.0))  # touching the edge, so set to the fallback
+
+        intrp = (mi.getMask().getArray() & mi.getMask().getPlaneBitMask("INTRP")) != 0
+        np.testing.assert_array_equal(intrp, bad)
+
+    def testChunksDontMatter(self):
+        field = makeStarField(200, 120, 50, seed=2)
+        results = []
+        for chunkRows in (1, 7, 256):
+            mi = makeMaskedImage(field.image, 0.3)
+            interpolateFromMask(mi, ["BAD"], chunkRows=chunkRows)
+            results.append(mi.getImage().getArray().copy())
+        for result in results[1:]:
+            np.testing.assert_array_equal(result, results[0])
+
+    def testEdgeRunsUseFallback(self):
+        """Runs touching the edge are set to the clipped mean of the unmasked pixels"""
+        y, x = np.mgrid[0:60, 0:80]
+        image = np.where((x + y)%2 == 0, 99.0, 101.0).astype(np.float32)
+        image[10, 20:22] = 1e4          # outliers, in pairs so as to keep the mean of the rest 100
+        image[30, 50:52] = -1e4
+        mi = afwImage.MaskedImageF(80, 60)
+        mi.getImage().getArray()[:] = image
+        mask = mi.getMask().getArray()
+        mask[:] = 0
+        mask[:, :4] = mi.getMask().getPlaneBitMask("BAD")
+        mask[:, -2:] = mi.getMask().getPlaneBitMask("BAD")
+
+        interpolateFromMask(mi, ["BAD"])
+        result = mi.getImage().getArray()
+        np.testing.assert_array_equal(result[:, :4], 100.0)
+        np.testing.assert_array_equal(result[:, -2:], 100.0)
+        np.testing.assert_array_equal(result[:, 4:-2], image[:, 4:-2])
+
+    def testEquivalentToIsr(self):
+        """The vectorized and isr engines both reproduce a plane under isolated interior defects"""
+        y, x = np.mgrid[0:128, 0:128]
+        plane = (1000 + 0.5*x - 0.25*y).astype(np.float32)
+        defects = [(20, 30, 1), (40, 50, 2), (60, 70, 3), (80, 90, 5)]  # (row, first column, width)
+
+        interpolated = {}
+        for engine in ("isr", "vectorized"):
+            config = ProcessFileConfig()
+            config.interpEngine = engine
+            mi = afwImage.MaskedImageF(128, 128)
+            mi.getVariance().set(1.0)
+            mi.getImage().getArray()[:] = plane
+            mask = mi.getMask().getArray()
+            mask[:] = 0
+            for row, x0, width in defects:
+                mask[row, x0:x0 + width] = mi.getMask().getPlaneBitMask("BAD")
+                mi.getImage().getArray()[row, x0:x0 + width] = 0.0
+            mask[100:110, 60] = mi.getMask().getPlaneBitMask("BAD")  # a bad column, 10 rows long
+            mi.getImage().getArray()[100:110, 60] = 0.0
+
+            exposure = afwImage.makeExposure(mi)
+            interpolateDefects(config, makeTasks(config), exposure)
+            interpolated[engine] = exposure.getMaskedImage().getImage().getArray().copy()
+
+        np.testing.assert_allclose(interpolated["vectorized"], plane, rtol=1e-6)
+        np.testing.assert_allclose(interpolated["isr"], plane, rtol=1e-5)
+        np.testing.assert_allclose(interpolated["vectorized"], interpolated["isr"], rtol=1e-5)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
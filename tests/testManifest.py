@@ -0,0 +1,99 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import unittest
+import numpy as np
+
+import lsst.utils.tests
+from lsst.processFile.manifest import readManifest, validateManifest, writeRetryManifest
+from lsst.processFile.synthetic import writeImage
+
+
+class ManifestTestCase(unittest.TestCase):
+    """Test reading, validating and scheduling a manifest of files to process"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        for name, size in [("small", 10), ("large", 30), ("medium", 20), ("weight", 20)]:
+            writeImage(np.zeros((size, size)), self.path(name + ".fits"))
+
+        self.manifest = self.path("manifest.txt")
+        with open(self.manifest, "w") as fd:
+            print("# a comment", file=fd)
+            print(self.path("small.fits"), file=fd)
+            print("%s catalog=%s filter=r" % (self.path("large.fits"), self.path("large.cat.fits")), file=fd)
+            print("", file=fd)
+            print("%s weight=%s" % (self.path("medium.fits"), self.path("weight.fits")), file=fd)
+            print("%s weight=%s" % (self.path("small.fits"), self.path("weight.fits")), file=fd)
+            print(self.path("missing.fits"), file=fd)
+            print("%s nonsense=1" % self.path("small.fits"), file=fd)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def path(self, fileName):
+        return os.path.join(self.tmpDir, fileName)
+
+    def testReadManifest(self):
+        entries = readManifest(self.manifest)
+        self.assertEqual(len(entries), 6)
+        self.assertEqual(entries[0].outputs["catalog"], self.path("small.src.fits"))
+        self.assertEqual(entries[1].outputs, dict(catalog=self.path("large.cat.fits"), calexp=None,
+                                                  calibCatalog=None, regions=None))
+        self.assertEqual(entries[1].filterName, "r")
+        self.assertEqual(entries[2].weightFile, self.path("weight.fits"))
+        self.assertIsNotNone(entries[5].error)
+
+        entries = readManifest(self.path("*.fits"))
+        self.assertEqual(len(entries), 4)
+
+    def testValidationAndScheduling(self):
+        valid, invalid = validateManifest(readManifest(self.manifest))
+        self.assertEqual([os.path.basename(entry.inputFile) for entry in valid],
+                         ["large.fits", "medium.fits", "small.fits"])
+        self.assertEqual([entry.cost for entry in valid], [900, 400, 100])
+        self.assertEqual(len(invalid), 3)       # wrong-sized weight, missing file, and unparseable
+
+        retryManifest = self.path("retry.txt")
+        writeRetryManifest(retryManifest, invalid)
+        retries = readManifest(retryManifest)
+        self.assertEqual([entry.inputFile for entry in retries], [entry.inputFile for entry in invalid])
+        self.assertEqual(retries[0].weightFile, self.path("weight.fits"))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
@@ -0,0 +1,128 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import unittest
+import numpy as np
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+import lsst.afw.table as afwTable
+import lsst.utils.tests
+from lsst.processFile.checkpoint import Checkpointer, makeDetectionProducts
+from lsst.processFile.multiBand import makeDetectionExposure, makeForcedTask, processMultiBand
+from lsst.processFile.processFile import ProcessFileConfig, makeTasks
+from lsst.processFile.resultCache import ResultCache
+from lsst.processFile.synthetic import makeSyntheticFiles
+
+
+class MultiBandTestCase(unittest.TestCase):
+    """Test combining the bands to make a detection image"""
+
+    def setUp(self):
+        self.bbox = afwGeom.Box2I(afwGeom.Point2I(10, 20), afwGeom.Extent2I(30, 20))
+
+    def makeExposure(self, value, variance, bbox=None):
+        exposure = afwImage.ExposureF(self.bbox if bbox is None else bbox)
+        mi = exposure.getMaskedImage()
+        mi.getImage().set(value)
+        mi.getVariance().set(variance)
+        mi.getMask().set(0)
+        return exposure
+
+    def testInverseVarianceWeightedMean(self):
+        exposures = [self.makeExposure(1.0, 1.0), self.makeExposure(4.0, 4.0)]
+        badBit = exposures[1].getMaskedImage().getMask().getPlaneBitMask("BAD")
+        exposures[0].getMaskedImage().getMask().getArray()[5, 6] = badBit
+        exposures[0].getMaskedImage().getMask().getArray()[7, 8] = badBit
+        exposures[1].getMaskedImage().getMask().getArray()[7, 8] = badBit
+
+        combined = makeDetectionExposure(exposures, referenceIndex=1)
+        image = combined.getMaskedImage().getImage().getArray()
+        mask = combined.getMaskedImage().getMask().getArray()
+        variance = combined.getMaskedImage().getVariance().getArray()
+
+        self.assertEqual(combined.getBBox(afwImage.PARENT), self.bbox)
+        self.assertAlmostEqual(image[0, 0], (1.0/1 + 4.0/4)/(1/1.0 + 1/4.0), places=5)
+        self.assertAlmostEqual(variance[0, 0], 1/(1/1.0 + 1/4.0), places=5)
+
+        self.assertAlmostEqual(image[5, 6], 4.0, places=5)  # only the second band is good
+        self.assertAlmostEqual(variance[5, 6], 4.0, places=5)
+        self.assertEqual(mask[5, 6] & badBit, 0)
+
+        self.assertEqual(mask[7, 8] & badBit, badBit)       # bad in both bands
+        self.assertEqual(np.sum((mask & badBit) != 0), 1)
+
+    def testMismatchedBandsAreRejected(self):
+        otherBBox = afwGeom.Box2I(afwGeom.Point2I(0, 0), self.bbox.getDimensions())
+        with self.assertRaises(RuntimeError):
+            makeDetectionExposure([self.makeExposure(1.0, 1.0), self.makeExposure(1.0, 1.0, otherBBox)])
+
+
+class MultiBandCheckpointTestCase(unittest.TestCase):
+    """Test that processing several bands only resumes from the checkpoints after characterization"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.inputFiles = [makeSyntheticFiles(self.tmpDir, 128, 128, 30, sky=sky, seed=2, name=band).inputFile
+                           for band, sky in [("g", 500.0), ("r", 1000.0)]]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testDetectionCheckpointIsIgnored(self):
+        config = ProcessFileConfig()
+        tasks = makeTasks(config)
+        forcedTask = makeForcedTask(config, tasks.schema)
+        cache = ResultCache(os.path.join(self.tmpDir, "cache"))
+        checkpointers = [Checkpointer(cache, config, "1.0", inputFile) for inputFile in self.inputFiles]
+
+        def process():
+            result = processMultiBand(config, tasks, forcedTask, self.inputFiles, checkpointers=checkpointers)
+            return [[source.getPsfFlux() for source in band.sources] for band in result.bands]
+
+        expected = process()            # saves the characterize checkpoints
+        for checkpointer in checkpointers:
+            exposure = checkpointer.restore(stage="characterize")[1].exposure
+            detection = tasks.sourceDetectionTask.run(afwTable.SourceTable.make(tasks.schema), exposure)
+            checkpointer.save("detection", makeDetectionProducts(detection, config.detection))
+            self.assertEqual(checkpointer.restore()[0], "detection")
+
+        self.assertEqual(process(), expected)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
@@ -0,0 +1,88 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import shutil
+import sys
+import tempfile
+
+import unittest
+import numpy as np
+
+import lsst.utils.tests
+from lsst.processFile.processFile import ProcessFileConfig, makeTasks, processOneFile
+from lsst.processFile.parallelMeasurement import makeFamilyChunks
+from lsst.processFile.combinedCatalog import getCatalogColumns
+from lsst.processFile.synthetic import makeSyntheticFiles
+
+
+class ParallelMeasurementTestCase(unittest.TestCase):
+    """Test measuring the sources of an exposure in several processes"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.files = makeSyntheticFiles(self.tmpDir, 512, 512, 300, seed=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def processFile(self, measurementJobs):
+        config = ProcessFileConfig()
+        config.measurementJobs = measurementJobs
+        return processOneFile(config, makeTasks(config), self.files.inputFile).sources
+
+    def testSameAsSerial(self):
+        serial = self.processFile(1)
+        parallel = self.processFile(3)
+
+        self.assertEqual(len(serial), len(parallel))
+        for (name, serialValues), (parallelName, parallelValues) in zip(getCatalogColumns(serial),
+                                                                        getCatalogColumns(parallel)):
+            self.assertEqual(name, parallelName)
+            np.testing.assert_array_equal(serialValues, parallelValues, err_msg=name)
+
+    def testFamiliesAreKeptTogether(self):
+        sources = self.processFile(1)
+        chunks = makeFamilyChunks(sources, 4)
+        self.assertEqual(len(chunks), 4)
+
+        ids = []
+        for chunk in chunks:
+            for parent, children in chunk:
+                self.assertEqual(parent.getParent(), 0)
+                for child in children:
+                    self.assertEqual(child.getParent(), parent.getId())
+                ids += [parent.getId()] + [child.getId() for child in children]
+        self.assertEqual(sorted(ids), sorted(source.getId() for source in sources))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
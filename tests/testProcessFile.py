@@ -23,16 +23,18 @@ from __future__ import print_function
 
 import os
 import shutil
-import subprocess
 import sys
 import tempfile
 
 import unittest
+import numpy as np
 
 import lsst.afw.table as afwTable
 import lsst.pex.exceptions as pexExcept
 import lsst.utils
 import lsst.utils.tests
+from lsst.processFile.processFile import FileProcessor, makeExposure, writeOutputs, getVersion
+from lsst.processFile.synthetic import makeSyntheticFiles
 
 testDataPackage = "afwdata"
 try:
@@ -40,26 +42,32 @@ try:
 except pexExcept.NotFoundError as err:
     testDataDirectory = None
 
+_processor = None
+
+
+def getProcessor():
+    """Return a FileProcessor with the default config, shared by all the tests (so the tasks are only
+    created once)"""
+    global _processor
+    if _processor is None:
+        _processor = FileProcessor()
+    return _processor
+
 
 def runSampleProcessFile(imageFile, outputCalexp, outputCatalog, outputCalibCatalog):
-    output = subprocess.check_output(["processfile.py", imageFile,
-                                      "--outputCalexp", outputCalexp,
-                                      "--outputCatalog", outputCatalog,
-                                      "--outputCalibCatalog", outputCalibCatalog,
-                                      ])
-    return output
+    result = getProcessor().process(imageFile)
+    writeOutputs(result, getVersion(), outputCalexp=outputCalexp, outputCatalog=outputCatalog,
+                 outputCalibCatalog=outputCalibCatalog)
+    return result
 
 
+@unittest.skipIf(testDataDirectory is None, "%s is not available" % testDataPackage)
 class TestProcessFileRun(unittest.TestCase):
     """Test that processFile runs.
 
-    Ideally processFile.py would just be a call to
-    python/lsst/processFile/processFile.py parseAndRun
-    But it's not structured that way right now
-    So instead we're going to call the executable
-    and ensure that the output files are generated and non-zero in size.
+    The file is processed in this process by a FileProcessor (as bin/processFile.py does),
+    and we ensure that the output files are generated and non-zero in size.
     """
-    @unittest.skipIf(testDataDirectory is None, "%s is not available" % testDataPackage)
     @classmethod
     def setUpClass(self):
         """
@@ -87,7 +95,7 @@ class TestProcessFileRun(unittest.TestCase):
         self.outputCatalog = os.path.join(self.tmpPath, testOutputCatalogFile)
         self.outputCalibCatalog = os.path.join(self.tmpPath, testOutputCalibCatalogFile)
 
-        # We run processFile.py here in the setUp method.
+        # We process the file here in the setUp method.
         # so that the results are availalbe to the individual tests
         runSampleProcessFile(self.imageFile, self.outputCalexp,
                              self.outputCatalog, self.outputCalibCatalog)
@@ -140,6 +148,56 @@ class TestProcessFileRun(unittest.TestCase):
         self.assertLess(sizeOfImage, 1.20*self.expectedSizeOfCalexp)
 
 
+class TestFileProcessor(unittest.TestCase):
+    """Test processing several synthetic images with a single FileProcessor"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpPath = tempfile.mkdtemp()
+        cls.files = [makeSyntheticFiles(cls.tmpPath, 256, 256, nStar, seed=nStar) for nStar in (50, 100, 200)]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpPath)
+
+    def testManyImages(self):
+        processor = getProcessor()
+        tasks = processor.tasks
+        for files in self.files:
+            result = processor.process(files.inputFile)
+            self.assertEqual(result.inputFile, files.inputFile)
+            self.assertIsNone(result.error)
+            self.assertGreater(len(result.sources), 0.5*files.nStar)
+            self.assertLess(len(result.sources), 2.0*files.nStar)
+            self.assertEqual(result.sources.getSchema(), processor.schema)
+        self.assertIs(processor.tasks, tasks)
+
+    def testExposure(self):
+        """Processing an Exposure gives the same results as processing the file it was read from"""
+        processor = getProcessor()
+        files = self.files[0]
+        config = processor.config
+        exposure = makeExposure(files.inputFile, files.weightFile, files.varianceFile,
+                                config.badPixelValue, config.variance)
+
+        fromFile = processor.process(files.inputFile)
+        fromExposure = processor.process(exposure)
+        self.assertIsNone(fromExposure.inputFile)
+        self.assertEqual(len(fromFile.sources), len(fromExposure.sources))
+        np.testing.assert_array_equal([source.getPsfFlux() for source in fromFile.sources],
+                                      [source.getPsfFlux() for source in fromExposure.sources])
+
+    def testContinueOnError(self):
+        processor = getProcessor()
+        badFile = os.path.join(self.tmpPath, "noSuchFile.fits")
+        with self.assertRaises(Exception):
+            processor.process(badFile)
+
+        result = processor.process(badFile, continueOnError=True)
+        self.assertIsNotNone(result.error)
+        self.assertIsNone(result.sources)
+
+
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
 
@@ -0,0 +1,100 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import sys
+
+import unittest
+import numpy as np
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+import lsst.utils.tests
+from lsst.processFile.processFile import propagatePsfFlags, _propagatePsfFlagsByMatchXy
+
+
+class PropagatePsfFlagsTestCase(unittest.TestCase):
+    """Test copying the PSF flags from the calibSources to the sources"""
+
+    def setUp(self):
+        rng = np.random.RandomState(666)
+
+        calibSchema, self.calibCentroidKey = self.makeSchema()
+        self.calibKey = calibSchema.addField("calib_psfUsed", type="Flag", doc="used for PSF")
+        self.schema, self.centroidKey = self.makeSchema()
+        self.keysToCopy = [(self.schema.addField(calibSchema.find(self.calibKey).field), self.calibKey)]
+
+        self.xy = rng.uniform(0, 500, size=(1000, 2))
+        self.calibSources = afwTable.SourceCatalog(calibSchema)
+        for x, y in self.xy[::10] + rng.normal(0, 0.2, size=(100, 2)):
+            rec = self.calibSources.addNew()
+            rec.set(self.calibCentroidKey, afwGeom.Point2D(x, y))
+            rec.set(self.calibKey, bool(rng.randint(2)))
+
+    def makeSchema(self):
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        centroidKey = afwTable.Point2DKey.addFields(schema, "centroid", "centroid", "pixel")
+        schema.getAliasMap().set("slot_Centroid", "centroid")
+        return schema, centroidKey
+
+    def makeSources(self):
+        sources = afwTable.SourceCatalog(self.schema)
+        for x, y in self.xy:
+            sources.addNew().set(self.centroidKey, afwGeom.Point2D(x, y))
+        return sources
+
+    def testSameAsMatchXy(self):
+        sources, expected = self.makeSources(), self.makeSources()
+        propagatePsfFlags(self.keysToCopy, self.calibSources, sources)
+        _propagatePsfFlagsByMatchXy(self.keysToCopy, self.calibSources, expected)
+
+        skey = self.keysToCopy[0][0]
+        flags = [s.get(skey) for s in sources]
+        self.assertEqual(flags, [s.get(skey) for s in expected])
+        self.assertEqual(sum(flags), sum(cs.get(self.calibKey) for cs in self.calibSources))
+
+
+    def testManyEquidistantSources(self):
+        """The last of more than a few equally close sources (e.g. a parent's children) is chosen"""
+        sources = afwTable.SourceCatalog(self.schema)
+        for i in range(8):
+            sources.addNew().set(self.centroidKey, afwGeom.Point2D(100.0, 200.0))
+        calibSources = afwTable.SourceCatalog(self.calibSources.getSchema())
+        calibSources.addNew().set(self.calibCentroidKey, afwGeom.Point2D(100.5, 200.0))
+        calibSources[0].set(self.calibKey, True)
+
+        propagatePsfFlags(self.keysToCopy, calibSources, sources)
+        skey = self.keysToCopy[0][0]
+        self.assertEqual([s.get(skey) for s in sources], [False]*7 + [True])
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
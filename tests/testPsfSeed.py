@@ -0,0 +1,118 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import unittest
+
+import lsst.utils.tests
+from lsst.processFile.processFile import FileProcessor, ProcessFileConfig, writeOutputs, getVersion
+from lsst.processFile.psfSeed import seededConfig
+from lsst.processFile.synthetic import makeSyntheticFiles
+
+
+class TestSeededConfig(unittest.TestCase):
+    """Test configuring characterization to start from a seed PSF"""
+
+    def testIterationsAreRestored(self):
+        config = ProcessFileConfig().charImage
+        config.psfIterations = 3
+        with seededConfig(config, 1):
+            self.assertEqual(config.psfIterations, 1)
+            self.assertTrue(config.doMeasurePsf)
+        self.assertEqual(config.psfIterations, 3)
+
+    def testZeroIterationsKeepsTheSeed(self):
+        config = ProcessFileConfig().charImage
+        with seededConfig(config, 0):
+            self.assertFalse(config.doMeasurePsf)
+        self.assertTrue(config.doMeasurePsf)
+
+
+class TestPsfSeed(unittest.TestCase):
+    """Test characterizing a series of synthetic images starting from a previous PSF"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpPath = tempfile.mkdtemp()
+        cls.files = [makeSyntheticFiles(cls.tmpPath, 256, 256, 100, seed=seed, name="seq%d" % seed)
+                     for seed in range(3)]
+        cls.wideFile = makeSyntheticFiles(cls.tmpPath, 256, 256, 100, psfSigma=4.0, name="wide")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpPath)
+
+    def makeProcessor(self, **kwargs):
+        config = ProcessFileConfig()
+        for name, value in kwargs.items():
+            setattr(config.psfSeed, name, value)
+        return FileProcessor(config)
+
+    def testPrevious(self):
+        processor = self.makeProcessor(source="previous")
+        unseeded = FileProcessor().process(self.files[1].inputFile)
+
+        results = [processor.process(files.inputFile) for files in self.files]
+        self.assertEqual(results[0].exposure.getMetadata().get("PSF_SEED"), "none")
+        for previous, result in zip(self.files, results[1:]):
+            for metadata in (result.exposure.getMetadata(), result.sources.getTable().getMetadata()):
+                self.assertEqual(metadata.get("PSF_SEED"), "previous")
+                self.assertEqual(metadata.get("PSF_SEED_FILE"), previous.inputFile)
+                self.assertFalse(metadata.get("PSF_SEED_REJECTED"))
+            self.assertLess(abs(result.exposure.getMetadata().get("PSF_SEED_SIZECHANGE")), 0.2)
+        self.assertLess(abs(len(results[1].sources) - len(unseeded.sources)), 0.1*len(unseeded.sources))
+
+    def testCalexp(self):
+        calexp = os.path.join(self.tmpPath, "seed.calexp.fits")
+        writeOutputs(FileProcessor().process(self.files[0].inputFile), getVersion(), outputCalexp=calexp)
+
+        processor = self.makeProcessor(source="calexp", calexp=calexp, psfIterations=0)
+        for files in self.files[1:]:
+            metadata = processor.process(files.inputFile).exposure.getMetadata()
+            self.assertEqual(metadata.get("PSF_SEED"), "calexp")
+            self.assertEqual(metadata.get("PSF_SEED_FILE"), calexp)
+            self.assertEqual(metadata.get("PSF_SEED_SIZECHANGE"), 0.0)
+
+    def testBadSeedIsRejected(self):
+        processor = self.makeProcessor(source="previous")
+        processor.process(self.files[0].inputFile)
+        metadata = processor.process(self.wideFile.inputFile).exposure.getMetadata()
+        self.assertTrue(metadata.get("PSF_SEED_REJECTED"))
+        self.assertGreater(metadata.get("PSF_SEED_SIZECHANGE"), 0.2)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
@@ -0,0 +1,144 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import unittest
+
+import lsst.afw.table as afwTable
+import lsst.pipe.base as pipeBase
+import lsst.utils.tests
+from lsst.processFile.checkpoint import Checkpointer, checkpointStages
+from lsst.processFile.processFileConfig import ProcessFileConfig
+from lsst.processFile.resultCache import ResultCache
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    """Test the cache of processed outputs"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cacheDir = os.path.join(self.tmpDir, "cache")
+        self.inputFile = os.path.join(self.tmpDir, "input.fits")
+        with open(self.inputFile, "w") as fd:
+            fd.write("pixels")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def makeResult(self, nSource):
+        sources = afwTable.SourceCatalog(afwTable.SourceTable.makeMinimalSchema())
+        for i in range(nSource):
+            sources.addNew()
+        return pipeBase.Struct(exposure=None, calibSources=None, sources=sources, radii=[3.0, 4.5])
+
+    def testKeys(self):
+        cache = ResultCache(self.cacheDir)
+        config = ProcessFileConfig()
+        key = cache.makeKey(config, "1.0", self.inputFile)
+        self.assertEqual(key, cache.makeKey(config, "1.0", self.inputFile))
+        self.assertNotEqual(key, cache.makeKey(config, "1.1", self.inputFile))
+        self.assertNotEqual(key, cache.makeKey(config, "1.0", self.inputFile, weightFile=self.inputFile))
+
+        config.doDeblend = not config.doDeblend
+        self.assertNotEqual(key, cache.makeKey(config, "1.0", self.inputFile))
+
+        config.doDeblend = not config.doDeblend
+        with open(self.inputFile, "a") as fd:
+            fd.write("more pixels")
+        self.assertNotEqual(key, cache.makeKey(config, "1.0", self.inputFile))
+
+    def testCheckpointKeysOnlyDependOnUpstreamConfig(self):
+        cache = ResultCache(self.cacheDir)
+        config = ProcessFileConfig()
+
+        def makeKeys():
+            return dict((stage, cache.makeKey(config, "1.0", self.inputFile, stage=stage, fields=fields))
+                        for stage, fields in checkpointStages)
+
+        keys = makeKeys()
+        self.assertNotEqual(keys["characterize"], keys["detection"])
+
+        config.doDeblend = not config.doDeblend
+        self.assertEqual(makeKeys(), keys)
+
+        config.detection.thresholdValue += 1
+        newKeys = makeKeys()
+        self.assertEqual(newKeys["characterize"], keys["characterize"])
+        self.assertNotEqual(newKeys["detection"], keys["detection"])
+
+    def testDetectionCheckpointNeedsCharacterizeCheckpoint(self):
+        cache = ResultCache(self.cacheDir)
+        checkpointer = Checkpointer(cache, ProcessFileConfig(), "1.0", self.inputFile)
+        checkpointer.save("detection", pipeBase.Struct(sources=self.makeResult(5).sources, background=None))
+        self.assertEqual(checkpointer.restore(), (None, None))
+
+        entryFiles = os.listdir(os.path.join(self.cacheDir, checkpointer.keys["detection"]))
+        self.assertNotIn("calexp.fits", entryFiles)
+
+    def testRoundTrip(self):
+        cache = ResultCache(self.cacheDir)
+        self.assertFalse(cache.lookup("a"))
+        cache.put("a", self.makeResult(5))
+        self.assertTrue(cache.lookup("a"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        result = cache.get("a")
+        self.assertIsNone(result.exposure)
+        self.assertIsNone(result.calibSources)
+        self.assertEqual(len(result.sources), 5)
+        self.assertEqual(result.radii, [3.0, 4.5])
+
+    def testLeastRecentlyUsedEntriesAreEvicted(self):
+        cache = ResultCache(self.cacheDir)
+        cache.put("a", self.makeResult(10))
+        entrySize = cache.getSize()[1]
+        cache.maxBytes = int(2.5*entrySize)
+
+        time.sleep(1.1)                 # allow for file systems with one-second timestamps
+        cache.put("b", self.makeResult(10))
+        time.sleep(1.1)
+        cache.lookup("a")               # "a" is now more recently used than "b"
+        cache.put("c", self.makeResult(10))
+
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(cache.lookup("a"))
+        self.assertFalse(cache.lookup("b"))
+        self.assertTrue(cache.lookup("c"))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
@@ -0,0 +1,133 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import unittest
+
+import lsst.utils.tests
+from lsst.processFile.server import serve, _SpoolDirectory
+from lsst.processFile.utils import makeOutputFileNames
+
+
+def touchOutputs(inputFile):
+    """A stand-in for processing a file: write its catalog next to it"""
+    with open(makeOutputFileNames(inputFile)["catalog"], "w") as fd:
+        print("processed", file=fd)
+    return "done"
+
+
+class TestSpoolDirectory(unittest.TestCase):
+    """Test the selection of files from a spool directory"""
+
+    def setUp(self):
+        self.spoolDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spoolDir)
+
+    def write(self, name, contents="data"):
+        fileName = os.path.join(self.spoolDir, name)
+        with open(fileName, "w") as fd:
+            fd.write(contents)
+        return fileName
+
+    def testFilesAreReadyWhenStable(self):
+        spool = _SpoolDirectory(self.spoolDir, "*.fits")
+        fileName = self.write("a.fits")
+        self.assertEqual(spool.poll(), [])  # we haven't seen it before
+        self.assertEqual(spool.poll(), [fileName])
+
+        self.write("a.fits", "more data")  # still being written
+        self.assertEqual(spool.poll(), [])
+        self.assertEqual(spool.poll(), [fileName])
+
+    def testProcessedAndFailedFilesAreSkipped(self):
+        spool = _SpoolDirectory(self.spoolDir, "*.fits")
+        done = self.write("done.fits")
+        touchOutputs(done)
+        failed = self.write("failed.fits")
+        spool.markFailed(failed, "oops")
+
+        spool.poll()
+        self.assertEqual(spool.poll(), [])
+
+
+class TestSocketServer(unittest.TestCase):
+    """Test sending filenames to the server over a UNIX socket"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.socketPath = os.path.join(self.tmpDir, "processFile.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testRoundTrip(self):
+        def processFunc(inputFile):
+            if inputFile.endswith("bad.fits"):
+                raise RuntimeError("bad file")
+            return touchOutputs(inputFile)
+
+        thread = threading.Thread(target=serve, args=(processFunc,),
+                                  kwargs=dict(socketPath=self.socketPath, pollInterval=0.1))
+        thread.daemon = True
+        thread.start()
+        for i in range(50):
+            if os.path.exists(self.socketPath):
+                break
+            time.sleep(0.1)
+
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.socketPath)
+        client.sendall(("%s\n%s\n" % (os.path.join(self.tmpDir, "good.fits"),
+                                       os.path.join(self.tmpDir, "bad.fits"))).encode())
+        client.shutdown(socket.SHUT_WR)
+        fd = client.makefile("r")
+        replies = fd.readlines()
+        fd.close()
+        client.close()
+
+        self.assertEqual(len(replies), 2)
+        self.assertTrue(replies[0].startswith("OK "))
+        self.assertTrue(replies[1].startswith("FAILED "))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpDir, "good.src.fits")))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
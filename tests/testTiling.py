@@ -0,0 +1,100 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import sys
+
+import unittest
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+import lsst.utils.tests
+from lsst.processFile.tiling import makeTiles, selectOwnedSources, mergeTileCatalogs
+
+
+class TilingTestCase(unittest.TestCase):
+    """Test splitting an image into tiles and merging their catalogues"""
+
+    def setUp(self):
+        self.bbox = afwGeom.Box2I(afwGeom.Point2I(10, 20), afwGeom.Extent2I(1000, 700))
+
+    def testTilesPartitionTheImage(self):
+        tiles = makeTiles(self.bbox, 256, 50)
+        self.assertEqual(len(tiles), 4*3)
+
+        nOwned = 0
+        for tile in tiles:
+            self.assertLessEqual(tile.ownedBBox.getWidth(), 256)
+            self.assertLessEqual(tile.ownedBBox.getHeight(), 256)
+            self.assertTrue(tile.bbox.contains(tile.ownedBBox))
+            self.assertTrue(self.bbox.contains(tile.bbox))
+            nOwned += tile.ownedBBox.getArea()
+
+            for other in tiles:
+                if other is not tile:
+                    self.assertFalse(tile.ownedBBox.overlaps(other.ownedBBox))
+
+        self.assertEqual(nOwned, self.bbox.getArea())
+
+    def makeCatalog(self, positions):
+        """Make a catalogue of sources at positions, a list of (x, y, parentIndex)"""
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        centroidKey = afwTable.Point2DKey.addFields(schema, "centroid", "centroid", "pixel")
+        schema.getAliasMap().set("slot_Centroid", "centroid")
+        catalog = afwTable.SourceCatalog(schema)
+        for x, y, parent in positions:
+            rec = catalog.addNew()
+            rec.set(centroidKey, afwGeom.Point2D(x, y))
+            if parent is not None:
+                rec.setParent(catalog[parent].getId())
+
+        return catalog
+
+    def testFamiliesAreKeptWithTheirParent(self):
+        tiles = makeTiles(self.bbox, 500, 50)
+        # A parent just left of the boundary at x = 509.5 with a child just to its right, and
+        # a parent just right of the boundary
+        catalog = self.makeCatalog([(509.4, 100, None), (509.6, 100, 0), (509.6, 150, None)])
+
+        owned = [selectOwnedSources(catalog, tile.ownedBBox) for tile in tiles]
+        self.assertEqual(sorted(len(cat) for cat in owned if len(cat) > 0), [1, 2])
+
+        merged = mergeTileCatalogs(owned, catalog.getSchema())
+        self.assertEqual(len(merged), 3)
+        self.assertEqual(len(set(rec.getId() for rec in merged)), 3)
+        ids = set(rec.getId() for rec in merged)
+        for rec in merged:
+            if rec.getParent() != 0:
+                self.assertIn(rec.getParent(), ids)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
@@ -0,0 +1,85 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import sys
+
+import unittest
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.utils.tests
+from lsst.processFile.synthetic import makeStarField
+from lsst.processFile.varianceEstimate import estimateVariance
+
+
+class VarianceEstimateTestCase(unittest.TestCase):
+    """Test the fast variance estimators against the full sigma-clipped variance"""
+
+    def setUp(self):
+        field = makeStarField(1024, 1024, 500, sky=1000.0, seed=3)
+        self.mi = afwImage.MaskedImageF(1024, 1024)
+        self.mi.getImage().getArray()[:] = field.image
+        self.mi.getMask().set(0)
+        self.badBit = self.mi.getMask().getPlaneBitMask("BAD")
+
+    def tearDown(self):
+        del self.mi
+
+    def testEstimatorsAgree(self):
+        full = estimateVariance(self.mi, self.badBit, "full")
+        self.assertAlmostEqual(full.variance/1000.0, 1.0, delta=0.05)   # Poisson noise on the sky
+
+        for estimator in ("subsample", "boxes"):
+            estimate = estimateVariance(self.mi, self.badBit, estimator, nSample=50000)
+            self.assertLess(estimate.nPixel, 0.1*1024**2)
+            self.assertGreater(estimate.error, 0)
+            self.assertLess(abs(estimate.variance - full.variance), 4*estimate.error, estimator)
+
+    def testBadPixelsAreIgnored(self):
+        good = estimateVariance(self.mi, self.badBit, "subsample")
+
+        image, mask = self.mi.getImage().getArray(), self.mi.getMask().getArray()
+        image[:, 100:300] = 1e6
+        mask[:, 100:300] |= self.badBit
+        image[10, 10] = np.nan
+        bad = estimateVariance(self.mi, self.badBit, "subsample")
+
+        self.assertLess(bad.nPixel, good.nPixel)
+        self.assertLess(abs(bad.variance - good.variance), 4*bad.error)
+
+    def testUnknownEstimator(self):
+        with self.assertRaises(ValueError):
+            estimateVariance(self.mi, self.badBit, "noSuchEstimator")
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()
@@ -0,0 +1,168 @@
+# LSST Data Management System
+# Copyright 2012-2016 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import unittest
+
+import lsst.utils.tests
+from lsst.processFile.workQueue import WorkQueue, runWorker, summarizeQueue, formatQueueSummary
+
+
+class TestWorkQueue(unittest.TestCase):
+    """Test sharing a queue of work between several processes, as if they were on different hosts"""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.queueDir = os.path.join(self.tmpDir, "queue")
+        self.lines = ["input%02d.fits catalog=%s/input%02d.src.fits" % (i, self.tmpDir, i) for i in range(20)]
+        WorkQueue(self.queueDir, host="enqueuer").enqueue(self.lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def processFunc(self, line):
+        """A stand-in for processing a file:  record which process processed it"""
+        with open(os.path.join(self.tmpDir, "processed-%d" % os.getpid()), "a") as fd:
+            print(line, file=fd)
+        time.sleep(0.02)
+        return dict(nSource=10)
+
+    def readProcessed(self):
+        """Return the lines processed by every process"""
+        processed = []
+        for name in os.listdir(self.tmpDir):
+            if name.startswith("processed-"):
+                with open(os.path.join(self.tmpDir, name)) as fd:
+                    processed += [line.strip() for line in fd]
+        return processed
+
+    def runWorkers(self, nWorker, timeout=600.0, die=False):
+        """Run nWorker workers in child processes, on hosts host0, host1, ...
+
+        If die, each worker claims one item and then exits without processing it
+        """
+        pids = []
+        for i in range(nWorker):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    queue = WorkQueue(self.queueDir, timeout=timeout, heartbeat=0.1, host="host%d" % i)
+                    if die:
+                        with queue.heartbeat(queue.claim()):
+                            os._exit(0)
+                    runWorker(queue, self.processFunc, pollInterval=0.1)
+                    status = 0
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+
+        for pid in pids:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def testEachItemProcessedOnce(self):
+        self.runWorkers(4)
+
+        self.assertEqual(sorted(self.readProcessed()), sorted(self.lines))
+        queue = WorkQueue(self.queueDir)
+        self.assertTrue(queue.isEmpty())
+        self.assertEqual(len(queue.listItems("done")), len(self.lines))
+
+        summary = summarizeQueue(self.queueDir)
+        self.assertEqual((summary.nPending, summary.nClaimed, summary.nDone, summary.nFailed),
+                         (0, 0, len(self.lines), 0))
+        self.assertEqual(sum(host.nDone for host in summary.hosts.values()), len(self.lines))
+        self.assertEqual(sum(host.nSource for host in summary.hosts.values()), 10*len(self.lines))
+        lines = formatQueueSummary(summary)
+        self.assertTrue(lines[-1].startswith("total"))
+
+    def testItemsAreClaimedInOrder(self):
+        queue = WorkQueue(self.queueDir)
+        claimed = [queue.claim().line for i in range(3)]
+        self.assertEqual(claimed, self.lines[:3])
+
+    def testDeadWorkersItemsAreReclaimed(self):
+        self.runWorkers(2, die=True)
+        queue = WorkQueue(self.queueDir, timeout=0.5, host="survivor")
+        self.assertEqual(len(queue.listItems("claimed")), 2)
+
+        result = runWorker(queue, self.processFunc, pollInterval=0.1)
+        self.assertEqual((result.nDone, result.nFailed), (len(self.lines), 0))
+        self.assertEqual(sorted(self.readProcessed()), sorted(self.lines))
+        self.assertEqual(list(summarizeQueue(self.queueDir).hosts.keys()), ["survivor"])
+
+    def testHeartbeatKeepsItemClaimed(self):
+        queue = WorkQueue(self.queueDir, timeout=0.5, heartbeat=0.1)
+        other = WorkQueue(self.queueDir, timeout=0.5, host="other")
+        item = queue.claim()
+        with queue.heartbeat(item):
+            time.sleep(1.5)
+            self.assertEqual(other.reclaimStale(verbose=False), 0)
+        time.sleep(1.0)
+        self.assertEqual(other.reclaimStale(verbose=False), 1)
+        self.assertEqual(len(queue.listItems("pending")), len(self.lines))
+
+    def testStalenessUsesFilesystemClock(self):
+        queue = WorkQueue(self.queueDir, timeout=60.0, host="worker")
+        other = WorkQueue(self.queueDir, timeout=60.0, host="other")
+        item = queue.claim()
+        self.assertLess(abs(other._now() - os.stat(item.path).st_mtime), 5.0)
+        self.assertEqual(os.listdir(os.path.join(self.queueDir, "tmp")), [])  # the probe's been removed
+        self.assertEqual(other.reclaimStale(verbose=False), 0)
+
+    def testFailuresAreRecorded(self):
+        def processFunc(line):
+            if line.startswith("input03"):
+                raise RuntimeError("bad file")
+            return self.processFunc(line)
+
+        queue = WorkQueue(self.queueDir, host="host0")
+        result = runWorker(queue, processFunc)
+        self.assertEqual((result.nDone, result.nFailed), (len(self.lines) - 1, 1))
+
+        failed = queue.listItems("failed")
+        self.assertEqual(len(failed), 1)
+        with open(os.path.join(self.queueDir, "failed", failed[0])) as fd:
+            record = json.load(fd)
+        self.assertEqual(record["line"], self.lines[3])
+        self.assertIn("bad file", record["error"])
+        self.assertEqual(summarizeQueue(self.queueDir).hosts["host0"].nFailed, 1)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    setup_module(sys.modules[__name__])
+    unittest.main()